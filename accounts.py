@@ -9,7 +9,10 @@ accounts module
     The tinycrypto package relies heavily on the lower-level crypto modules.
 """
 import unittest
+import bisect
 import hashlib
+import heapq
+import multiprocessing
 from tinydecred.util import tinyjson, helpers
 from tinydecred import api
 from tinydecred.pydecred import nets, constants as DCR
@@ -27,6 +30,11 @@ DEFAULT_ACCOUNT_NAME = "default"
 
 CrazyAddress = "CRAZYADDRESS"
 
+# DERIVATION_POOL_THRESHOLD is the number of addresses at which bulk address
+# generation is spread across a process pool. For smaller batches, starting the
+# pool costs more than it saves.
+DERIVATION_POOL_THRESHOLD = 100
+
 log = helpers.getLogger("TCRYP") # , logLvl=0)
 
 class CoinSymbols:
@@ -164,6 +172,228 @@ tinyjson.register(Balance)
 
 UTXO = api.UTXO
 
+class UTXOSet(object):
+    """
+    A collection of UTXOs keyed by UTXO.key, with secondary indexes by
+    transaction ID and by address, a running total of the value held, and an
+    index sorted by value for coin selection. Lookups by key, transaction ID
+    and address are constant time. UTXOs should not have their
+    txid, address or satoshis changed while they are in the set, and maturity
+    should only be changed through setMaturity.
+
+    The spendable value at the current tip height is tracked alongside the
+    total. UTXOs that are not yet mature are held in a min-heap by maturity
+    height, so advancing the tip only visits the UTXOs that mature.
+    """
+    def __init__(self, utxos=None, tipHeight=0):
+        """
+        Args:
+            utxos (iterable(UTXO)): Optional. The initial UTXOs.
+            tipHeight (int): Optional. The best block height. Default 0.
+        """
+        # utxos maps the UTXO key ({txid}#{vout}) to the UTXO.
+        self.utxos = {}
+        # txids and addresses map to the UTXO keys for each. The keys are held
+        # in a dict rather than a set to keep them in insertion order.
+        self.txids = {}
+        self.addresses = {}
+        # byValue is a sorted list of (satoshis, key).
+        self.byValue = []
+        # The total value of all UTXOs, in atoms.
+        self.total = 0
+        # The value of the UTXOs that are spendable at tipHeight.
+        self.available = 0
+        self.tipHeight = tipHeight
+        # immature maps the keys of UTXOs not yet counted in available to their
+        # maturity height. maturities is a heap of (maturity, key). Entries for
+        # UTXOs that have since been removed or rescheduled are left in the heap
+        # and skipped when popped.
+        self.immature = {}
+        self.maturities = []
+        for utxo in utxos or []:
+            self.add(utxo)
+    def __len__(self):
+        return len(self.utxos)
+    def __iter__(self):
+        return iter(self.utxos.values())
+    def __contains__(self, key):
+        return key in self.utxos
+    def add(self, utxo):
+        """
+        Add the UTXO, replacing any UTXO with the same key.
+
+        Args:
+            utxo (UTXO): The UTXO to add.
+        """
+        key = utxo.key()
+        self.pop(key)
+        self.utxos[key] = utxo
+        self.txids.setdefault(utxo.txid, {})[key] = None
+        self.addresses.setdefault(utxo.address, {})[key] = None
+        bisect.insort(self.byValue, (utxo.satoshis, key))
+        self.total += utxo.satoshis
+        self.count(key, utxo)
+    def count(self, key, utxo):
+        """
+        Add the UTXO's value to available, or schedule it for when it matures.
+        """
+        if utxo.isSpendable(self.tipHeight):
+            self.available += utxo.satoshis
+            return
+        self.immature[key] = utxo.maturity
+        heapq.heappush(self.maturities, (utxo.maturity, key))
+    def uncount(self, key, utxo):
+        """
+        Reverse count.
+        """
+        if self.immature.pop(key, None) is None:
+            self.available -= utxo.satoshis
+    def setMaturity(self, key, maturity):
+        """
+        Set the maturity height of the UTXO with the key, rescheduling it as
+        necessary.
+
+        Args:
+            key (str): The UTXO key. See UTXO.makeKey.
+            maturity (int): The maturity height, or None if the UTXO is
+                spendable once mined.
+        """
+        utxo = self.utxos[key]
+        self.uncount(key, utxo)
+        utxo.maturity = maturity
+        self.count(key, utxo)
+    def setTip(self, tipHeight):
+        """
+        Update the best block height, adding any UTXOs that have matured to
+        available. If the tip moves backwards, as after a reorg, the
+        spendable value is recalculated from scratch.
+
+        Args:
+            tipHeight (int): The best block height.
+        """
+        if tipHeight < self.tipHeight:
+            self.tipHeight = tipHeight
+            self.available = 0
+            self.immature = {}
+            self.maturities = []
+            for key, utxo in self.utxos.items():
+                self.count(key, utxo)
+            return
+        self.tipHeight = tipHeight
+        heap = self.maturities
+        while heap and heap[0][0] <= tipHeight:
+            maturity, key = heapq.heappop(heap)
+            if self.immature.get(key) != maturity:
+                # Stale entry.
+                continue
+            del self.immature[key]
+            self.available += self.utxos[key].satoshis
+    def rescan(self, tipHeight):
+        """
+        Calculate the total and spendable value by visiting every UTXO. The
+        result should always match total and available after setTip.
+
+        Args:
+            tipHeight (int): The best block height.
+
+        Returns:
+            int: The total value.
+            int: The value spendable at tipHeight.
+        """
+        tot = 0
+        avail = 0
+        for utxo in self.utxos.values():
+            tot += utxo.satoshis
+            if utxo.isSpendable(tipHeight):
+                avail += utxo.satoshis
+        return tot, avail
+    def get(self, key):
+        """
+        The UTXO with the key, or None.
+
+        Args:
+            key (str): The UTXO key. See UTXO.makeKey.
+        """
+        return self.utxos.get(key)
+    def pop(self, key):
+        """
+        Remove the UTXO with the key.
+
+        Args:
+            key (str): The UTXO key. See UTXO.makeKey.
+
+        Returns:
+            UTXO: The removed UTXO, or None if there was no UTXO with the key.
+        """
+        utxo = self.utxos.pop(key, None)
+        if utxo is None:
+            return None
+        self.unindex(self.txids, utxo.txid, key)
+        self.unindex(self.addresses, utxo.address, key)
+        del self.byValue[bisect.bisect_left(self.byValue, (utxo.satoshis, key))]
+        self.total -= utxo.satoshis
+        self.uncount(key, utxo)
+        return utxo
+    @staticmethod
+    def unindex(index, indexKey, key):
+        """
+        Remove the UTXO key from the secondary index, dropping empty entries.
+        """
+        keys = index[indexKey]
+        keys.pop(key, None)
+        if not keys:
+            del index[indexKey]
+    def hasTxid(self, txid):
+        """
+        Whether there are any UTXOs from the transaction.
+
+        Args:
+            txid (str): The hex-encoded transaction ID.
+        """
+        return txid in self.txids
+    def forTxid(self, txid):
+        """
+        The UTXOs from the transaction.
+
+        Args:
+            txid (str): The hex-encoded transaction ID.
+
+        Returns:
+            list(UTXO): The UTXOs, in the order they were added.
+        """
+        return self.lookup(self.txids, txid)
+    def forAddress(self, addr):
+        """
+        The UTXOs paying to the address.
+
+        Args:
+            addr (str): Base-58 encoded address.
+
+        Returns:
+            list(UTXO): The UTXOs, in the order they were added.
+        """
+        return self.lookup(self.addresses, addr)
+    def sortedByValue(self, approve=None):
+        """
+        The UTXOs, smallest first.
+
+        Args:
+            approve (func(UTXO) -> bool): Optional. If provided, only UTXOs for
+                which approve returns a truthy value are included.
+
+        Returns:
+            list(UTXO): The UTXOs.
+        """
+        utxos = self.utxos
+        if approve:
+            return [utxos[key] for _, key in self.byValue if approve(utxos[key])]
+        return [utxos[key] for _, key in self.byValue]
+    def lookup(self, index, indexKey):
+        """
+        The UTXOs for the secondary index entry.
+        """
+        return [self.utxos[key] for key in index.get(indexKey, ())]
+
 class Account(object):
     """
     A BIP0044 account. Keys are stored as encrypted strings. The account is 
@@ -191,6 +421,9 @@ class Account(object):
         self.lastInternalIndex = -1
         self.externalAddresses = []
         self.internalAddresses = []
+        # addrIndex maps a base58 encoded address to its (branch, index). It is
+        # not serialized, but rebuilt from the address lists on load.
+        self.addrIndex = {}
         self.cursor = 0
         self.balance = Balance()
         # maps a txid to a MsgTx for a transaction suspected of being in 
@@ -198,14 +431,17 @@ class Account(object):
         self.mempool = {}
         # txs maps a base58 encoded address to a list of txid.
         self.txs = {}
-        # utxos is a mapping of utxo key ({txid}#{vout}) to a UTXO. 
-        self.utxos = {}
+        # utxos is the set of UTXOs, indexed by key ({txid}#{vout}), by txid
+        # and by address.
+        self.utxos = UTXOSet()
         # If the accounts privKey is set with the private extended key
         # the account is considered "open". close'ing the wallet zeros
         # and drops reference to the privKey. 
         self.privKey = None # The private extended key. 
         self.extPub = None # The external branch public extended key.
         self.intPub = None # The internal branch public extended key.
+        # Private branch and child keys derived from privKey. Zeroed on close.
+        self.keyCache = None
     def __tojson__(self):
         return {
             "pubKeyEncrypted": self.pubKeyEncrypted,
@@ -219,7 +455,7 @@ class Account(object):
             "internalAddresses": self.internalAddresses,
             "cursor": self.cursor,
             "txs": self.txs,
-            "utxos": self.utxos,
+            "utxos": self.utxos.utxos,
             "balance": self.balance,
         }
     @staticmethod
@@ -235,9 +471,10 @@ class Account(object):
         acct.lastInternalIndex = obj["lastInternalIndex"]
         acct.externalAddresses = obj["externalAddresses"]
         acct.internalAddresses = obj["internalAddresses"]
+        acct.indexAddresses()
         acct.cursor = obj["cursor"]
         acct.txs = obj["txs"]
-        acct.utxos = obj["utxos"]
+        acct.utxos = UTXOSet(obj["utxos"].values())
         acct.balance = obj["balance"]
         setNetwork(acct)
         return acct
@@ -264,7 +501,7 @@ class Account(object):
         Returns:
             list(UTXO): UTXOs for the provided address.
         """
-        return [u for u in self.db["utxo"].values() if u.address == addr]
+        return self.utxos.forAddress(addr)
     def utxoscan(self):
         """
         A generator for iterating UTXOs. None of the UTXO set modifying 
@@ -273,7 +510,7 @@ class Account(object):
         Returns:
             generator(UTXO): A UTXO generator that iterates all known UTXOs.
         """
-        for utxo in self.utxos.values():
+        for utxo in self.utxos:
             yield utxo
     def addUTXO(self, utxo):
         """
@@ -282,7 +519,7 @@ class Account(object):
         Args:
             utxo (UTXO): The UTXO to add.
         """
-        self.utxos[utxo.key()] = utxo
+        self.utxos.add(utxo)
     def getUTXO(self, txid, vout):
         """
         Get a UTXO by txid and tx output index. 
@@ -291,8 +528,7 @@ class Account(object):
             txid (str): The hex-encoded transaction ID.
             vout (int): The transaction output index.
         """
-        uKey =  UTXO.makeKey(txid,  vout)
-        return self.utxos[uKey] if uKey in self.utxos else None
+        return self.utxos.get(UTXO.makeKey(txid, vout))
     def caresAboutTxid(self, txid):
         """
         Indicates whether the account has any UTXOs with this transaction ID, or
@@ -303,10 +539,13 @@ class Account(object):
         """
         return txid in self.mempool or self.hasUTXOwithTXID(txid)
     def hasUTXOwithTXID(self, txid):
-        for utxo in self.utxos.values():
-            if utxo.txid == txid:
-                return True
-        return False
+        """
+        Whether the account has any UTXOs with this transaction ID.
+
+        Args:
+            txid (str): The hex-encoded transaction ID.
+        """
+        return self.utxos.hasTxid(txid)
     def UTXOsForTXID(self, txid):
         """
         Get any UTXOs with the provided transaction ID.
@@ -314,7 +553,7 @@ class Account(object):
         Args:
             txid (str): The hex-encoded transaction ID.
         """
-        return [utxo for utxo in self.utxoscan() if utxo.txid == txid]
+        return self.utxos.forTxid(txid)
     def spendUTXOs(self, utxos):
         """
         Spend the UTXO.
@@ -325,9 +564,9 @@ class Account(object):
         for utxo in utxos:
             self.spendUTXO(utxo)
     def spendUTXO(self, utxo):
-        return self.utxos.pop(utxo.key(), None)
+        return self.utxos.pop(utxo.key())
     def resolveUTXOs(self, blockchainUTXOs):
-        self.utxos = {u.key(): u for u in blockchainUTXOs}
+        self.utxos = UTXOSet(blockchainUTXOs, self.utxos.tipHeight)
     def spendTxidVout(self, txid, vout):
         """
         Spend the UTXO.
@@ -336,7 +575,7 @@ class Account(object):
             txid (str): The hex-encoded transaction ID.
             vout (int): The transaction output index.
         """
-        return self.utxos.pop(UTXO.makeKey(txid, vout), None)
+        return self.utxos.pop(UTXO.makeKey(txid, vout))
     def addMempoolTx(self, tx):
         """
         Add a Transaction-implementing object to the mempool.
@@ -368,26 +607,22 @@ class Account(object):
             utxo.height = blockHeight
             if tx.looksLikeCoinbase():
                 # this is a coinbase transaction, set the maturity height.
-                utxo.maturity = utxo.height + self.net.CoinbaseMaturity
+                self.utxos.setMaturity(utxo.key(), utxo.height + self.net.CoinbaseMaturity)
             # else:
             #     utxo.maturity = utxo.height + 1 # Not sure about this
     def calcBalance(self, tipHeight):
         """
         Calculate the balance. The height current height must be provided to 
-        separate UTXOs which are not mature. 
+        separate UTXOs which are not mature. The totals are kept up to date by
+        the UTXOSet as UTXOs are added and spent, so only UTXOs maturing since
+        the last call are visited.
 
         Args:
             tipHeight (int): The current best block height. 
         """
-        tot = 0
-        avail = 0
-        for utxo in self.utxoscan():
-            tot += utxo.satoshis
-            if not utxo.isSpendable(tipHeight):
-                continue
-            avail += utxo.satoshis
-        self.balance.total = tot
-        self.balance.available = avail
+        self.utxos.setTip(tipHeight)
+        self.balance.total = self.utxos.total
+        self.balance.available = self.utxos.available
         return self.balance
     def generateNextPaymentAddress(self):
         """
@@ -406,6 +641,7 @@ class Account(object):
             log.warning("crazy address generated")
             addr = CrazyAddress
         self.externalAddresses.append(addr)
+        self.indexAddress(addr, EXTERNAL_BRANCH, idx)
         self.lastExternalIndex = idx
         return addr
     def getNextPaymentAddress(self):
@@ -428,13 +664,49 @@ class Account(object):
             log.warning("attempting to generate gap addresses on a closed account")
         highest = 0
         for addr in self.txs:
-            try:
-                highest = max(highest, self.externalAddresses.index(addr))
-            except ValueError: # Not found
-                continue
+            branch, idx = self.branchAndIndex(addr)
+            if branch == EXTERNAL_BRANCH:
+                highest = max(highest, idx)
         tip = highest + gap
-        while len(self.externalAddresses) < tip:
-            self.generateNextPaymentAddress()
+        self.fillAddresses(EXTERNAL_BRANCH, tip)
+    def fillAddresses(self, branch, count):
+        """
+        Derive addresses in bulk until the branch has at least count addresses.
+        Large batches are derived across a process pool. Does not move the
+        cursor.
+
+        Args:
+            branch (int): EXTERNAL_BRANCH or INTERNAL_BRANCH.
+            count (int): The number of addresses the branch should have.
+
+        Returns:
+            list(str): The new base-58 encoded addresses.
+        """
+        if branch == EXTERNAL_BRANCH:
+            addrs, lastIdx, branchKey = self.externalAddresses, self.lastExternalIndex, self.extPub
+        elif branch == INTERNAL_BRANCH:
+            addrs, lastIdx, branchKey = self.internalAddresses, self.lastInternalIndex, self.intPub
+        else:
+            raise Exception("unknown branch %d" % branch)
+        if len(addrs) != lastIdx + 1:
+            raise Exception("index-address length mismatch")
+        start = len(addrs)
+        if count <= start:
+            return []
+        processes = multiprocessing.cpu_count() if count - start >= DERIVATION_POOL_THRESHOLD else None
+        newAddrs = branchKey.deriveChildAddresses(start, count, self.net, processes)
+        for i, addr in enumerate(newAddrs):
+            if addr is None:
+                log.warning("crazy address generated")
+                newAddrs[i] = CrazyAddress
+        addrs.extend(newAddrs)
+        for i, addr in enumerate(newAddrs):
+            self.indexAddress(addr, branch, start + i)
+        if branch == EXTERNAL_BRANCH:
+            self.lastExternalIndex = count - 1
+        else:
+            self.lastInternalIndex = count - 1
+        return newAddrs
     def getChangeAddress(self):
         """
         Return a new change address.
@@ -451,6 +723,7 @@ class Account(object):
             log.warning("crazy address generated")
             addr = CrazyAddress
         self.internalAddresses.append(addr)
+        self.indexAddress(addr, INTERNAL_BRANCH, idx)
         self.lastInternalIndex = idx
         return addr
     def allAddresses(self):
@@ -513,6 +786,7 @@ class Account(object):
             pw (byte-like): The user supplied password for this account. 
         """
         self.privKey = self.privateExtendedKey(pw)
+        self.keyCache = crypto.DerivationCache(self.privKey)
         pubX = self.privKey.neuter()
         self.extPub = pubX.child(EXTERNAL_BRANCH)
         self.intPub = pubX.child(INTERNAL_BRANCH)
@@ -520,13 +794,13 @@ class Account(object):
         """
         Close the account. Zero the keys.
         """
+        if self.keyCache:
+            self.keyCache.zero()
+        self.keyCache = None
         if self.privKey:
-            self.privKey.key.zero()
-            self.privKey.pubKey.zero()
-            self.extPub.key.zero()
-            self.extPub.pubKey.zero()            
-            self.intPub.key.zero()
-            self.intPub.pubKey.zero()
+            self.privKey.zero()
+            self.extPub.zero()
+            self.intPub.zero()
         self.privKey = None
         self.extPub = None
         self.intPub = None
@@ -537,14 +811,27 @@ class Account(object):
         Args:
             addr (str): Base-58 encoded address.
         """
-        branch, idx = None, None
-        if addr in self.externalAddresses:
-            branch = EXTERNAL_BRANCH
-            idx = self.externalAddresses.index(addr)
-        elif addr in self.internalAddresses:
-            branch = INTERNAL_BRANCH
-            idx = self.internalAddresses.index(addr)
-        return branch, idx
+        return self.addrIndex.get(addr, (None, None))
+    def indexAddress(self, addr, branch, idx):
+        """
+        Add the address to the address index. The first occurrence of an
+        address wins, and CrazyAddress placeholders are not indexed.
+
+        Args:
+            addr (str): Base-58 encoded address.
+            branch (int): EXTERNAL_BRANCH or INTERNAL_BRANCH.
+            idx (int): The address's index in the branch.
+        """
+        if addr != CrazyAddress:
+            self.addrIndex.setdefault(addr, (branch, idx))
+    def indexAddresses(self):
+        """
+        Rebuild the address index from the address lists.
+        """
+        self.addrIndex = {}
+        for branch, addrs in ((EXTERNAL_BRANCH, self.externalAddresses), (INTERNAL_BRANCH, self.internalAddresses)):
+            for idx, addr in enumerate(addrs):
+                self.indexAddress(addr, branch, idx)
     def getPrivKeyForAddress(self, addr):
         """
         Get the private key for the address.
@@ -556,9 +843,7 @@ class Account(object):
         if branch is None:
             raise Exception("unknown address")
 
-        branchKey = self.privKey.child(branch)
-        privKey = branchKey.child(idx)
-        return crypto.privKeyFromBytes(privKey.key)
+        return self.keyCache.derive(branch, idx).privateKey()
 
 tinyjson.register(Account)
 
@@ -888,6 +1173,108 @@ class TestAccounts(unittest.TestCase):
         self.assertEqual(utxocount(), 1)
         acct.spendUTXO(utxo)
         self.assertEqual(utxocount(), 0)
+    def test_utxo_set(self):
+        from tinydecred.pydecred import dcrdata
+        def utxo(txid, vout, address, satoshis):
+            return dcrdata.UTXO(
+                address = address,
+                txid = txid,
+                vout = vout,
+                scriptPubKey = ByteArray(0),
+                satoshis = satoshis,
+            )
+        a, b, c = utxo("tx1", 0, "addr1", 5), utxo("tx1", 1, "addr2", 7), utxo("tx2", 0, "addr1", 11)
+        utxos = UTXOSet([a, b, c])
+        self.assertEqual(len(utxos), 3)
+        self.assertEqual(utxos.total, 23)
+        self.assertEqual(utxos.forTxid("tx1"), [a, b])
+        self.assertEqual(utxos.forAddress("addr1"), [a, c])
+        self.assertEqual(utxos.forTxid("tx3"), [])
+        self.assertTrue(utxos.hasTxid("tx2"))
+        self.assertIs(utxos.get(c.key()), c)
+        self.assertIn(a.key(), utxos)
+        # Replacing a UTXO doesn't double count it.
+        a2 = utxo("tx1", 0, "addr3", 6)
+        utxos.add(a2)
+        self.assertEqual(utxos.total, 24)
+        self.assertEqual(utxos.forAddress("addr1"), [c])
+        self.assertEqual(utxos.forAddress("addr3"), [a2])
+        self.assertIs(utxos.pop(c.key()), c)
+        self.assertIsNone(utxos.pop(c.key()))
+        self.assertFalse(utxos.hasTxid("tx2"))
+        self.assertNotIn("addr1", utxos.addresses)
+        self.assertEqual(utxos.total, 13)
+        self.assertEqual(set(utxos), {a2, b})
+        self.assertEqual(utxos.sortedByValue(), [a2, b])
+        self.assertEqual(utxos.sortedByValue(lambda u: u.satoshis > 6), [b])
+        # The account serializes the UTXOs as a plain dict and re-indexes
+        # them on load.
+        pw = "abc".encode()
+        am = createNewAccountManager(testSeed, bytearray(0), pw, nets.mainnet)
+        acct = am.openAccount(0, pw)
+        for u in (a, b, c):
+            acct.addUTXO(u)
+        self.assertEqual(acct.addressUTXOs("addr1"), [a, c])
+        reloaded = tinyjson.load(tinyjson.dump(acct))
+        self.assertIsInstance(reloaded.utxos, UTXOSet)
+        self.assertEqual(reloaded.utxos.total, 23)
+        self.assertEqual([u.key() for u in reloaded.addressUTXOs("addr1")], [a.key(), c.key()])
+        self.assertTrue(reloaded.caresAboutTxid("tx1"))
+        self.assertFalse(reloaded.caresAboutTxid("tx3"))
+    def test_utxo_maturity(self):
+        from tinydecred.pydecred import dcrdata
+        import random
+        rand = random.Random(15)
+        utxos = UTXOSet()
+        def check(tipHeight):
+            utxos.setTip(tipHeight)
+            self.assertEqual((utxos.total, utxos.available), utxos.rescan(tipHeight))
+            self.assertEqual([u.satoshis for u in utxos.sortedByValue()], sorted(u.satoshis for u in utxos))
+        # Mature, immature and reorg'd tips, with UTXOs coming and going and
+        # being rescheduled in between. The full rescan is the reference.
+        tip = 0
+        for i in range(300):
+            action = rand.random()
+            if action < 0.5 or not len(utxos):
+                utxos.add(dcrdata.UTXO(
+                    address = "addr%d" % rand.randrange(5),
+                    txid = "tx%d" % i,
+                    vout = 0,
+                    scriptPubKey = ByteArray(0),
+                    satoshis = rand.randrange(1, 1000),
+                    maturity = rand.choice((None, tip + rand.randrange(-2, 20))),
+                ))
+            elif action < 0.7:
+                utxos.pop(rand.choice(list(utxos.utxos)))
+            elif action < 0.8:
+                utxos.setMaturity(rand.choice(list(utxos.utxos)), rand.choice((None, tip + rand.randrange(20))))
+            elif action < 0.95:
+                tip += rand.randrange(4)
+            else:
+                tip -= rand.randrange(1, 4)
+            check(tip)
+        # Confirming a coinbase transaction in the account schedules its
+        # outputs for maturity.
+        pw = "abc".encode()
+        am = createNewAccountManager(testSeed, bytearray(0), pw, nets.mainnet)
+        acct = am.openAccount(0, pw)
+        utxo = dcrdata.UTXO(
+            address = "addr",
+            txid = "cb",
+            vout = 0,
+            scriptPubKey = ByteArray(0),
+            satoshis = 5,
+        )
+        acct.addUTXO(utxo)
+        self.assertEqual(acct.calcBalance(10).available, 5)
+        class Coinbase:
+            txid = lambda self: "cb"
+            looksLikeCoinbase = lambda self: True
+        acct.confirmTx(Coinbase(), 10)
+        maturity = 10 + nets.mainnet.CoinbaseMaturity
+        self.assertEqual(acct.calcBalance(maturity - 1).available, 0)
+        self.assertEqual(acct.calcBalance(maturity).available, 5)
+        self.assertEqual(acct.calcBalance(maturity).total, 5)
     def test_newmaster(self):
         kpriv = newMaster(testSeed, nets.mainnet)
         # --extKey: f2418d00085be520c6449ddb94b25fe28a1944b5604193bd65f299168796f862
@@ -917,6 +1304,60 @@ class TestAccounts(unittest.TestCase):
         acct = acctManager.openAccount(0, pw)
         for i in range(10):
             acct.getChangeAddress()
+    def test_priv_key_cache(self):
+        pw = "abc".encode()
+        am = createNewAccountManager(testSeed, bytearray(0), pw, nets.mainnet)
+        acct = am.openAccount(0, pw)
+        acct.fillAddresses(EXTERNAL_BRANCH, 50)
+        privKeys = [acct.getPrivKeyForAddress(addr) for addr in acct.externalAddresses]
+        for i in (0, 49):
+            self.assertEqual(privKeys[i].key, acct.privKey.child(EXTERNAL_BRANCH).child(i).key)
+        # One branch derivation for all 50 keys.
+        self.assertEqual(acct.keyCache.misses, 51)
+        acct.getPrivKeyForAddress(acct.externalAddresses[3])
+        self.assertEqual(acct.keyCache.misses, 51)
+        cached = acct.keyCache.derive(EXTERNAL_BRANCH)
+        acct.close()
+        self.assertIsNone(acct.keyCache)
+        self.assertTrue(cached.key.iszero())
+        self.assertTrue(privKeys[0].key.iszero())
+    def test_address_index(self):
+        pw = "abc".encode()
+        am = createNewAccountManager(testSeed, bytearray(0), pw, nets.mainnet)
+        acct = am.openAccount(0, pw)
+        acct.fillAddresses(EXTERNAL_BRANCH, 5)
+        acct.generateNextPaymentAddress()
+        acct.fillAddresses(INTERNAL_BRANCH, 2)
+        change = acct.getChangeAddress()
+        self.assertEqual(acct.branchAndIndex(acct.externalAddresses[5]), (EXTERNAL_BRANCH, 5))
+        self.assertEqual(acct.branchAndIndex(acct.externalAddresses[0]), (EXTERNAL_BRANCH, 0))
+        self.assertEqual(acct.branchAndIndex(change), (INTERNAL_BRANCH, 2))
+        self.assertEqual(acct.branchAndIndex("notanaddress"), (None, None))
+        reloaded = tinyjson.load(tinyjson.dump(acct))
+        self.assertEqual(reloaded.addrIndex, acct.addrIndex)
+        self.assertEqual(len(reloaded.addrIndex), len(acct.externalAddresses) + len(acct.internalAddresses))
+        # The gap is measured from the highest external address with a
+        # transaction.
+        acct.txs[acct.externalAddresses[4]] = []
+        acct.txs[change] = []
+        acct.generateGapAddresses(3)
+        self.assertEqual(len(acct.externalAddresses), 7)
+    def test_fill_addresses(self):
+        pw = "abc".encode()
+        am = createNewAccountManager(testSeed, bytearray(0), pw, nets.mainnet)
+        acct = am.openAccount(0, pw)
+        start = len(acct.externalAddresses)
+        expected = [acct.extPub.deriveChildAddress(i, acct.net) for i in range(start + 12)]
+        self.assertEqual(acct.fillAddresses(EXTERNAL_BRANCH, start + 5), expected[start:start+5])
+        self.assertEqual(acct.fillAddresses(EXTERNAL_BRANCH, start + 3), [])
+        self.assertEqual(acct.extPub.deriveChildAddresses(start + 5, start + 12, acct.net, processes=2), expected[start+5:])
+        self.assertEqual(acct.lastExternalIndex, start + 4)
+        acct.generateGapAddresses(len(expected))
+        self.assertEqual(acct.externalAddresses, expected)
+        self.assertEqual(acct.lastExternalIndex, len(expected) - 1)
+        changeAddrs = acct.fillAddresses(INTERNAL_BRANCH, 4)
+        self.assertEqual(changeAddrs, [acct.intPub.deriveChildAddress(i, acct.net) for i in range(4)])
+        self.assertEqual(acct.getChangeAddress(), acct.intPub.deriveChildAddress(4, acct.net))
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
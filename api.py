@@ -17,8 +17,10 @@ class InsufficientFundsError(Exception):
 class UTXO:
     """
     Blockchain-implementing classes must know how to create and handle utxo 
-    objects. 
+    objects. Accounts can hold many UTXOs, so the fields are slots. Subclasses
+    should declare __slots__ for their own fields too.
     """
+    __slots__ = ("address", "txid", "vout")
     def __init__(self, address, txid, vout):
         """
         Args:
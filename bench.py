@@ -0,0 +1,286 @@
+"""
+Copyright (c) 2019, Brian Stafford
+Copyright (c) 2019, The Decred developers
+See LICENSE for details
+
+module bench
+    Timing for wallet-level operations. Run as a script.
+
+        python -m tinydecred.bench
+
+    See crypto/secp256k1/bench.py for the curve arithmetic.
+"""
+import os
+import timeit
+import tracemalloc
+from tempfile import TemporaryDirectory
+from tinydecred import accounts
+from tinydecred.crypto import crypto
+from tinydecred.crypto.bytearray import ByteArray
+from tinydecred.crypto.secp256k1.bench import timeOp
+from tinydecred.pydecred import dcrdata, headerchain, nets, simnet, txscript
+from tinydecred.pydecred.wire import msgblock, msgtx, wire
+
+PASSWORD = "abc".encode()
+
+def openTestAccount():
+    """
+    Create an account manager from the test seed and open its first account.
+
+    Returns:
+        Account: The open account.
+    """
+    am = accounts.createNewAccountManager(accounts.testSeed, bytearray(0), PASSWORD, nets.mainnet)
+    return am.openAccount(0, PASSWORD)
+
+def benchKeys(number=20):
+    """
+    Time the extended key derivations used when opening an account and when
+    signing.
+
+    Args:
+        number (int): The number of calls to average over.
+
+    Returns:
+        dict: Per-call time in seconds, keyed by operation name.
+    """
+    coinKey = accounts.newMaster(accounts.testSeed, nets.mainnet).deriveCoinTypeKey(nets.mainnet.SLIP0044CoinType)
+    acct = openTestAccount()
+    acct.fillAddresses(accounts.EXTERNAL_BRANCH, 10)
+    addr = acct.externalAddresses[5]
+    def coldPrivKey():
+        # A fresh cache, so the branch key is derived again.
+        acct.keyCache = crypto.DerivationCache(acct.privKey)
+        acct.getPrivKeyForAddress(addr)
+    return {
+        "deriveAccountKey": timeOp(lambda: coinKey.deriveAccountKey(0), number),
+        "getPrivKeyForAddress (empty cache)": timeOp(coldPrivKey, number),
+        "getPrivKeyForAddress (cached keys)": timeOp(lambda: acct.getPrivKeyForAddress(addr), number),
+    }
+
+def signingTx(nInputs):
+    """
+    An unsigned transaction with nInputs inputs and a single output.
+    """
+    tx = msgtx.MsgTx.new()
+    for i in range(nInputs):
+        op = msgtx.OutPoint(txHash=crypto.hashH(i.to_bytes(4, "big")), idx=0, tree=0)
+        tx.addTxIn(msgtx.TxIn(previousOutPoint=op, valueIn=int(1e8)))
+    tx.addTxOut(msgtx.TxOut(value=int(nInputs*1e8 - 1e6), pkScript=ByteArray("51")))
+    return tx
+
+def benchSigning(sizes=(1, 10, 100, 500)):
+    """
+    Time computing the signature hashes for every input of transactions of a
+    few sizes, with the prefix hashed for each input and with a shared
+    TxSigHashes, and the time to sign all of the inputs with the shared
+    TxSigHashes. Without the shared prefix, the hashing time grows with the
+    square of the input count, and a single run of 500 inputs takes about a
+    minute.
+
+    Args:
+        sizes (iterable(int)): The input counts.
+
+    Returns:
+        dict: Per-transaction time in seconds, keyed by operation name.
+    """
+    net = nets.mainnet
+    privKey = crypto.privKeyFromBytes(ByteArray("b78a743c0c6557f24a51192b82925942ebade0be86efd7dad58b9fa358d3857c"))
+    pkHash = crypto.hash160(privKey.pub.serializeCompressed().bytes())
+    addr = crypto.newAddressPubKeyHash(pkHash, net, crypto.STEcdsaSecp256k1)
+    pkScript = txscript.makePayToAddrScript(addr.string(), net)
+    def sigHashAll(tx, sigHashes):
+        for i in range(len(tx.txIn)):
+            cachedPrefix = sigHashes.prefix(txscript.SigHashAll) if sigHashes else None
+            txscript.calcSignatureHash(pkScript, txscript.SigHashAll, tx, i, cachedPrefix)
+    def signAll(tx):
+        sigHashes = txscript.TxSigHashes(tx)
+        for i in range(len(tx.txIn)):
+            txscript.signTxOutput(privKey, net, tx, i, pkScript, txscript.SigHashAll, None, crypto.STEcdsaSecp256k1, sigHashes)
+    results = {}
+    for n in sizes:
+        tx = signingTx(n)
+        # The larger transactions are only timed once.
+        time = (lambda f: timeOp(f, 10 // n)) if n < 10 else (lambda f: timeit.timeit(f, number=1))
+        results["signature hashes, %d inputs" % n] = time(lambda: sigHashAll(tx, None))
+        results["signature hashes, %d inputs (shared prefix)" % n] = time(lambda: sigHashAll(tx, txscript.TxSigHashes(tx)))
+        results["sign %d inputs (shared prefix)" % n] = time(lambda: signAll(tx))
+    return results
+
+def signedTx(nInputs):
+    """
+    A transaction with nInputs inputs, each with a signature script the size
+    of a P2PKH signature.
+    """
+    tx = signingTx(nInputs)
+    for txIn in tx.txIn:
+        txIn.signatureScript = ByteArray(bytearray(107))
+    return tx
+
+def benchEncode(sizes=(1, 10, 100, 1000)):
+    """
+    Time serializing transactions with many inputs. When the encoding was built
+    by appending each field to a ByteArray, 1000 inputs took about 60 ms,
+    growing with the square of the size.
+
+    Args:
+        sizes (iterable(int)): The input counts.
+
+    Returns:
+        dict: Per-call time in seconds, keyed by operation name.
+    """
+    results = {}
+    for n in sizes:
+        tx = signedTx(n)
+        results["encode tx, %d inputs" % n] = timeOp(lambda: tx.btcEncode(0), max(1, 100 // n))
+    return results
+
+def benchTxid(sizes=(1, 10, 100)):
+    """
+    Time the transaction ID of a new transaction, which hashes the prefix, and
+    of the same transaction again, which is memoized.
+
+    Args:
+        sizes (iterable(int)): The input counts.
+
+    Returns:
+        dict: Per-call time in seconds, keyed by operation name.
+    """
+    results = {}
+    for n in sizes:
+        tx = signedTx(n)
+        results["txid, %d inputs" % n] = timeOp(lambda: signedTx(n).txid(), max(1, 10 // n))
+        results["txid, %d inputs (memoized)" % n] = timeOp(tx.txid, 100)
+    return results
+
+def benchDecode(sizes=(1, 10, 100, 1000), batches=(100, 1000)):
+    """
+    Time decoding transactions with many inputs, each with a signature script
+    the size of a P2PKH signature, and decoding batches of block headers from a
+    single buffer. Decoding is linear in the size of the data. When every field
+    was popped off the front of a ByteArray, 1000 inputs took about 120 ms and
+    a batch of 1000 headers about 110 ms, growing with the square of the size.
+
+    Args:
+        sizes (iterable(int)): The input counts.
+        batches (iterable(int)): The header batch sizes.
+
+    Returns:
+        dict: Per-decode time in seconds, keyed by operation name.
+    """
+    results = {}
+    for n in sizes:
+        encoded = signedTx(n).serialize().bytes()
+        results["decode tx, %d inputs" % n] = timeOp(lambda: msgtx.MsgTx.deserialize(encoded), max(1, 100 // n))
+    # An all-zero header.
+    header = msgblock.BlockHeader.deserialize(bytearray(msgblock.MaxHeaderSize))
+    encoded = header.serialize().bytes()
+    for n in batches:
+        batch = encoded*n
+        def decodeBatch():
+            b = wire.ByteReader(batch)
+            while b.remaining():
+                msgblock.BlockHeader.btcDecode(b, 0)
+        results["decode %d headers" % n] = timeit.timeit(decodeBatch, number=1)
+    return results
+
+def benchHeaderStore(n=2000):
+    """
+    Time storing a run of n block headers, one saveBlockHeader call at a time
+    and in a single addHeaders call.
+
+    Args:
+        n (int): The number of headers.
+
+    Returns:
+        dict: Time in seconds, keyed by operation name.
+    """
+    headers = headerchain.makeChain(n)
+    encoded = headerchain.encodeHeaders(headers)
+    results = {}
+    with TemporaryDirectory() as tempDir:
+        blockchain = dcrdata.DcrdataBlockchain(os.path.join(tempDir, "save.sqlite"), simnet, None, skipConnect=True)
+        def saveAll():
+            for header in headers:
+                blockchain.saveBlockHeader(header)
+        results["saveBlockHeader x %d" % n] = timeit.timeit(saveAll, number=1)
+        blockchain = dcrdata.DcrdataBlockchain(os.path.join(tempDir, "add.sqlite"), simnet, None, skipConnect=True)
+        results["addHeaders, %d headers" % n] = timeit.timeit(lambda: blockchain.addHeaders(encoded), number=1)
+    return results
+
+def traced(build):
+    """
+    The memory allocated by build, and still held by its result.
+
+    Args:
+        build (func() -> obj): Builds the objects to measure.
+
+    Returns:
+        int: The bytes held.
+    """
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        held = build()
+        size = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    del held
+    return size
+
+def benchMemory(nUTXOs=100000, nHeaders=500000, nInputs=1000):
+    """
+    Measure the memory held per object by a UTXO set, a chain of decoded
+    block headers and a decoded transaction.
+
+    Args:
+        nUTXOs (int): The number of UTXOs in the set.
+        nHeaders (int): The number of headers in the chain.
+        nInputs (int): The number of transaction inputs.
+
+    Returns:
+        dict: Bytes per object, keyed by object type.
+    """
+    def utxoSet():
+        utxos = accounts.UTXOSet()
+        for i in range(nUTXOs):
+            utxos.add(dcrdata.UTXO(
+                address = "DsUxwT6Kbiur6Q5ZNjnnS7n1cZkuDV7wNn%04x" % (i % 0xffff),
+                txid = "%064x" % i,
+                vout = i % 4,
+                scriptPubKey = ByteArray(bytearray(25)),
+                height = i,
+                satoshis = i + 1,
+            ))
+        return utxos
+    encodedHeader = msgblock.BlockHeader.deserialize(bytearray(msgblock.MaxHeaderSize)).serialize().bytes()
+    def headers():
+        b = wire.ByteReader(encodedHeader*nHeaders)
+        return [msgblock.BlockHeader.btcDecode(b, 0) for _ in range(nHeaders)]
+    encodedTx = signedTx(nInputs).serialize().bytes()
+    def txIns():
+        return msgtx.MsgTx.deserialize(encodedTx).txIn
+    return {
+        "UTXO in a set of %d" % nUTXOs: traced(utxoSet) / nUTXOs,
+        "BlockHeader in a chain of %d" % nHeaders: traced(headers) / nHeaders,
+        "decoded TxIn, %d inputs" % nInputs: traced(txIns) / nInputs,
+    }
+
+def main():
+    for op, t in benchKeys().items():
+        print("%-45s %9.3f ms" % (op, t*1e3))
+    for op, t in benchSigning().items():
+        print("%-45s %9.3f ms" % (op, t*1e3))
+    for op, t in benchEncode().items():
+        print("%-45s %9.3f ms" % (op, t*1e3))
+    for op, t in benchTxid().items():
+        print("%-45s %9.3f ms" % (op, t*1e3))
+    for op, t in benchDecode().items():
+        print("%-45s %9.3f ms" % (op, t*1e3))
+    for op, t in benchHeaderStore().items():
+        print("%-45s %9.3f ms" % (op, t*1e3))
+    for obj, size in benchMemory().items():
+        print("%-45s %9.0f bytes" % (obj, size))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Copyright (c) 2019, Brian Stafford
+Copyright (c) 2019, The Decred developers
+See LICENSE for details
+
+module coinselect
+    Coin selection strategies. Each strategy picks UTXOs to fund a transaction
+    sending `target` atoms, with the transaction fee accounted for as inputs are
+    added, so that selection completes in a single pass over the candidates.
+
+    A strategy is a function
+
+        strategy(utxos, target, fees) -> list(UTXO) or None
+
+    where utxos is a list of UTXOs sorted by value, smallest first, such as
+    returned by UTXOSet.sortedByValue, and fees is an object implementing the
+    fee model for the transaction being built. See pydecred/dcrdata.TxFees.
+
+        fees.fee(nInputs, change=True) -> int
+            The fee, in atoms, for the transaction spending nInputs inputs, with
+            or without a change output.
+        fees.inputFee -> float
+            The fee for each additional input.
+        fees.changeCost -> int
+            The smallest excess worth creating a change output for. Excess
+            below changeCost is given up to fees rather than returned as
+            change.
+
+    Selections that fund the transaction with change satisfy
+    sum(values) >= target + fees.fee(len(selection)). Branch-and-bound instead
+    looks for a selection that needs no change output.
+"""
+import random
+import unittest
+
+# BNB_MAX_TRIES limits the number of nodes visited by branchAndBound.
+BNB_MAX_TRIES = 100000
+
+# KNAPSACK_ITERATIONS is the number of random subsets tried by knapsack.
+KNAPSACK_ITERATIONS = 1000
+
+# KNAPSACK_MAX_STEPS bounds the UTXOs visited by knapsack, over all iterations.
+KNAPSACK_MAX_STEPS = 200000
+
+def spendable(utxos, fees):
+    """
+    The UTXOs worth more than the fee to spend them. The others would only ever
+    reduce the amount available.
+    """
+    inputFee = fees.inputFee
+    return [u for u in utxos if u.satoshis > inputFee]
+
+def funded(selection, target, fees, change=True):
+    """
+    Whether the UTXOs cover the target and the fee.
+
+    Args:
+        selection (list(UTXO)): The selected UTXOs.
+        target (int): The amount to send, in atoms.
+        fees (obj): The fee model.
+        change (bool): Optional. Whether the transaction has a change output.
+            Default True.
+    """
+    return sum(u.satoshis for u in selection) >= target + fees.fee(len(selection), change)
+
+def accumulate(utxos, target, fees):
+    """
+    Select UTXOs in the order given until the target and fee are covered.
+
+    Args:
+        utxos (iterable(UTXO)): The candidate UTXOs, in order of preference.
+        target (int): The amount to send, in atoms.
+        fees (obj): The fee model.
+
+    Returns:
+        list(UTXO): The selected UTXOs, or None if there are not enough funds.
+    """
+    selection = []
+    total = 0
+    for utxo in utxos:
+        selection.append(utxo)
+        total += utxo.satoshis
+        if total >= target + fees.fee(len(selection)):
+            return selection
+    return None
+
+def smallestFirst(utxos, target, fees):
+    """
+    Spend the smallest UTXOs first, consolidating the wallet as it goes.
+    """
+    return accumulate(spendable(utxos, fees), target, fees)
+
+def largestFirst(utxos, target, fees):
+    """
+    Spend the largest UTXOs first, for the fewest inputs and smallest fee.
+    """
+    return accumulate(reversed(spendable(utxos, fees)), target, fees)
+
+def randomOrder(utxos, target, fees, rand=random):
+    """
+    Spend UTXOs in random order.
+
+    Args:
+        rand (random.Random): Optional. The source of randomness. Default is the
+            random module.
+    """
+    candidates = spendable(utxos, fees)
+    rand.shuffle(candidates)
+    return accumulate(candidates, target, fees)
+
+def branchAndBound(utxos, target, fees, maxTries=BNB_MAX_TRIES):
+    """
+    Search for a selection that funds the transaction without a change output,
+    wasting less than fees.changeCost on the excess. This is the depth-first
+    search of Erhardt's "An Evaluation of Coin Selection Strategies", as in
+    Bitcoin Core's SelectCoinsBnB. UTXOs are considered by effective value, the
+    value less the fee to spend it, largest first. Each one is first included
+    and then omitted, and a branch is abandoned as soon as it either overshoots
+    or can no longer reach the target.
+
+    Args:
+        maxTries (int): Optional. The maximum number of search nodes to visit.
+            Default BNB_MAX_TRIES.
+
+    Returns:
+        list(UTXO): The selected UTXOs, or None if no changeless selection was
+            found.
+    """
+    candidates = spendable(utxos, fees)[::-1]
+    inputFee = fees.inputFee
+    values = [u.satoshis - inputFee for u in candidates]
+    lower = target + fees.fee(0, False)
+    upper = lower + fees.changeCost
+    # available is the effective value of the UTXOs not yet decided on.
+    available = sum(values)
+    if available < lower:
+        return None
+    value = 0
+    # selected[i] is whether candidates[i] is included on the current branch.
+    selected = []
+    best = None
+    bestWaste = None
+    for _ in range(maxTries):
+        backtrack = False
+        if value + available < lower or value > upper:
+            backtrack = True
+        elif value >= lower:
+            backtrack = True
+            waste = value - lower
+            if best is None or waste < bestWaste:
+                best = [i for i, inc in enumerate(selected) if inc]
+                bestWaste = waste
+                if waste == 0:
+                    break
+        if backtrack:
+            # Return the omitted UTXOs at the end of the branch to available,
+            # then take the omission branch of the last included UTXO.
+            while selected and not selected[-1]:
+                selected.pop()
+                available += values[len(selected)]
+            if not selected:
+                break
+            selected[-1] = False
+            value -= values[len(selected) - 1]
+        else:
+            i = len(selected)
+            available -= values[i]
+            value += values[i]
+            selected.append(True)
+    if best is None:
+        return None
+    selection = [candidates[i] for i in best]
+    # The effective values are an estimate. Check the fee for the actual size.
+    if not funded(selection, target, fees, False):
+        return None
+    return selection
+
+def knapsack(utxos, target, fees, iterations=KNAPSACK_ITERATIONS, rand=random):
+    """
+    Bitcoin Core's pre-BnB selection. If there is a UTXO that covers the target
+    by itself, the smallest one is a candidate. The UTXOs smaller than the
+    target are then sampled randomly for the subset whose sum is closest to the
+    target, and the smaller of the two selections is used. The target includes
+    the fee for a change output. For large wallets, the number of samples is
+    reduced to keep the work under KNAPSACK_MAX_STEPS.
+
+    Args:
+        iterations (int): Optional. The number of random subsets to try.
+            Default KNAPSACK_ITERATIONS.
+        rand (random.Random): Optional. The source of randomness. Default is the
+            random module.
+
+    Returns:
+        list(UTXO): The selected UTXOs, or None if there are not enough funds.
+    """
+    inputFee = fees.inputFee
+    need = target + fees.fee(0)
+    smaller = []
+    lowestLarger = None
+    for utxo in spendable(utxos, fees):
+        value = utxo.satoshis - inputFee
+        if value >= need:
+            # utxos are sorted, so this is the smallest.
+            lowestLarger = utxo
+            break
+        smaller.append((value, utxo))
+    smallerTotal = sum(v for v, _ in smaller)
+    if smallerTotal < need:
+        return [lowestLarger] if lowestLarger else None
+    # Largest first, so that the random subsets tend to be small.
+    smaller.reverse()
+    values = [v for v, _ in smaller]
+    best = range(len(values))
+    bestTotal = smallerTotal
+    # Each sample is a pass or two over the UTXOs, so bound the total work.
+    iterations = max(1, min(iterations, KNAPSACK_MAX_STEPS // len(values)))
+    for _ in range(iterations):
+        if bestTotal == need:
+            break
+        included = [False]*len(values)
+        # The included indexes. Only the last one is ever removed.
+        chosen = []
+        total = 0
+        reached = False
+        # The first pass includes each UTXO with probability 1/2, the second
+        # includes everything left over, until the target is reached. Each
+        # time the target is reached, the last UTXO is dropped again to look
+        # for a closer sum among the smaller ones that follow.
+        for npass in range(2):
+            if reached:
+                break
+            for i, v in enumerate(values):
+                if included[i] or (npass == 0 and rand.random() < 0.5):
+                    continue
+                total += v
+                included[i] = True
+                chosen.append(i)
+                if total >= need:
+                    reached = True
+                    if total < bestTotal:
+                        bestTotal = total
+                        best = list(chosen)
+                    total -= v
+                    included[i] = False
+                    chosen.pop()
+    selection = [smaller[i][1] for i in best]
+    if lowestLarger and lowestLarger.satoshis - inputFee <= bestTotal:
+        selection = [lowestLarger]
+    if not funded(selection, target, fees):
+        # The effective values are an estimate. Fall back to topping up the
+        # selection in order.
+        rest = [u for u in spendable(utxos, fees)[::-1] if u not in selection]
+        return accumulate(selection + rest, target, fees)
+    return selection
+
+# DEFAULT_STRATEGIES are tried in order by select. A changeless match is used
+# when there is one. Otherwise the smallest UTXOs are spent first.
+DEFAULT_STRATEGIES = (branchAndBound, smallestFirst)
+
+def select(utxos, target, fees, strategies=DEFAULT_STRATEGIES):
+    """
+    Select UTXOs with the first strategy to find a selection.
+
+    Args:
+        utxos (list(UTXO)): The candidate UTXOs, sorted by value, smallest first.
+        target (int): The amount to send, in atoms, not including fees.
+        fees (obj): The fee model.
+        strategies (iterable(func)): Optional. The strategies to try, in order.
+            Default DEFAULT_STRATEGIES.
+
+    Returns:
+        list(UTXO): The selected UTXOs, or None if there are not enough funds.
+    """
+    for strategy in strategies:
+        selection = strategy(utxos, target, fees)
+        if selection:
+            return selection
+    return None
+
+class TestCoinSelect(unittest.TestCase):
+    class Coin:
+        def __init__(self, satoshis):
+            self.satoshis = satoshis
+        def __repr__(self):
+            return "Coin(%d)" % self.satoshis
+    class Fees:
+        """
+        A fee model where each input costs 10, a change output 5, and the rest of
+        the transaction 20.
+        """
+        inputFee = 10
+        changeCost = 8
+        def fee(self, nInputs, change=True):
+            return 20 + 10*nInputs + (5 if change else 0)
+    def coins(self, *values):
+        return [self.Coin(v) for v in sorted(values)]
+    def values(self, selection):
+        return sorted(u.satoshis for u in selection) if selection is not None else None
+    def test_accumulate(self):
+        fees = self.Fees()
+        utxos = self.coins(5, 40, 50, 100, 200)
+        # The 5 atom UTXO costs more to spend than it's worth.
+        self.assertEqual(self.values(smallestFirst(utxos, 40, fees)), [40, 50])
+        self.assertEqual(self.values(largestFirst(utxos, 40, fees)), [200])
+        self.assertEqual(self.values(largestFirst(utxos, 200, fees)), [100, 200])
+        self.assertIsNone(smallestFirst(utxos, 400, fees))
+        selection = randomOrder(utxos, 100, fees, random.Random(0))
+        self.assertTrue(funded(selection, 100, fees))
+    def test_branch_and_bound(self):
+        fees = self.Fees()
+        # Without change, the fee for 2 inputs is 40, so 140 is an exact match.
+        # 150 alone is 10 over, but changeCost is 8.
+        utxos = self.coins(30, 55, 85, 150, 500)
+        self.assertEqual(self.values(branchAndBound(utxos, 100, fees)), [55, 85])
+        # 50 and 95 waste 5 atoms, which is within changeCost.
+        utxos = self.coins(30, 50, 60, 95, 150, 500)
+        self.assertEqual(self.values(branchAndBound(utxos, 100, fees)), [50, 95])
+        utxos = self.coins(200, 500)
+        self.assertIsNone(branchAndBound(utxos, 100, fees))
+        self.assertEqual(self.values(select(utxos, 100, fees)), [200])
+        self.assertIsNone(select(utxos, 1000, fees))
+        # Every selection funds the transaction without change, wasting less than
+        # changeCost.
+        rand = random.Random(16)
+        for _ in range(50):
+            utxos = self.coins(*(rand.randrange(11, 200) for _ in range(20)))
+            target = rand.randrange(1, 1000)
+            selection = branchAndBound(utxos, target, fees)
+            if selection is None:
+                continue
+            excess = sum(u.satoshis for u in selection) - target - fees.fee(len(selection), False)
+            self.assertGreaterEqual(excess, 0)
+            self.assertLessEqual(excess, fees.changeCost)
+    def test_knapsack(self):
+        fees = self.Fees()
+        rand = random.Random(16)
+        # need is 100 + 25 after the per-input fees. The closest subset of the
+        # smaller UTXOs is 130, from the effective values 20 + 50 + 60.
+        utxos = self.coins(30, 40, 60, 70, 1000)
+        self.assertEqual(self.values(knapsack(utxos, 100, fees, rand=rand)), [30, 60, 70])
+        # Nothing smaller adds up, so the smallest larger UTXO is used.
+        self.assertEqual(self.values(knapsack(self.coins(20, 30, 40, 60, 1000), 100, fees, rand=rand)), [1000])
+        utxos = self.coins(20, 30, 500)
+        self.assertEqual(self.values(knapsack(utxos, 100, fees, rand=rand)), [500])
+        self.assertIsNone(knapsack(self.coins(20, 30), 100, fees, rand=rand))
+        for _ in range(20):
+            utxos = self.coins(*(rand.randrange(11, 200) for _ in range(20)))
+            target = rand.randrange(1, 1500)
+            selection = knapsack(utxos, target, fees, rand=rand)
+            if selection is not None:
+                self.assertTrue(funded(selection, target, fees))
+            else:
+                self.assertIsNone(smallestFirst(utxos, target, fees))
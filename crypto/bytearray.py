@@ -28,6 +28,29 @@ def decodeBA(b, copy=False):
 		return bytearray(b)
 	raise TypeError("decodeBA: unknown type %s" % type(b))
 
+def bytesProperty(slot, doc=None):
+	"""
+	A property that keeps its value as immutable bytes in the named slot, and
+	reads as a ByteArray. A bytes object takes a fraction of the memory of a
+	ByteArray, so classes with many instances store their byte fields this way
+	and convert only when the field is read. None is stored as is.
+
+	Args:
+		slot (str): The name of the attribute holding the bytes.
+		doc (str): Optional. The property's docstring.
+
+	Returns:
+		property: The property.
+	"""
+	def get(obj):
+		b = getattr(obj, slot)
+		return None if b is None else ByteArray(b)
+	def set(obj, v):
+		if v is not None and not isinstance(v, bytes):
+			v = bytes(decodeBA(v))
+		setattr(obj, slot, v)
+	return property(get, set, doc=doc)
+
 class ByteArray(object):
 	"""
 	ByteArray is a bytearray manager that also implements tinyjson marshalling. 
@@ -224,3 +247,17 @@ class TestByteArray(unittest.TestCase):
 		z = ByteArray(zero)
 		z[2] = 255
 		self.assertEqual(makeA(), z)
+	def test_bytes_property(self):
+		class Slotted:
+			__slots__ = ("_b",)
+			b = bytesProperty("_b")
+		obj = Slotted()
+		for v in (ByteArray("0102"), bytearray(b"\x01\x02"), b"\x01\x02", "0102"):
+			obj.b = v
+			self.assertIsInstance(obj._b, bytes)
+			self.assertEqual(obj.b, ByteArray("0102"))
+		# Reads are copies, so the stored bytes can't be changed in place.
+		obj.b[0] = 5
+		self.assertEqual(obj._b, b"\x01\x02")
+		obj.b = None
+		self.assertIsNone(obj.b)
@@ -7,9 +7,12 @@ Cryptographic functions.
 """
 import hashlib
 import hmac
+import multiprocessing
 import unittest
+from collections import OrderedDict
 from tinydecred.util import tinyjson
-from tinydecred.crypto.secp256k1.curve import curve as Curve, PublicKey, PrivateKey
+from tinydecred.crypto.secp256k1.curve import curve as Curve, FieldVal, PublicKey, PrivateKey
+from tinydecred.crypto.secp256k1 import scalar
 from tinydecred.crypto.rando import generateSeed
 from tinydecred.crypto.bytearray import ByteArray
 from blake256.blake256 import blake_hash
@@ -22,6 +25,9 @@ SERIALIZED_KEY_LENGTH = 4 + 1 + 4 + 4 + 32 + 33 # 78 bytes
 HARDENED_KEY_START = 2**31
 MAX_COIN_TYPE = HARDENED_KEY_START - 1
 MAX_ACCOUNT_NUM = HARDENED_KEY_START - 2
+# DERIVATION_CACHE_SIZE is the number of recently used keys, below the first
+# level, that a DerivationCache keeps.
+DERIVATION_CACHE_SIZE = 256
 RADIX = 58
 ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
 
@@ -138,27 +144,51 @@ def mac(key, msg):
 
 def egcd(a, b):
     """
-    Part of the `modInv` implementation.
+    The extended Euclidean algorithm. Computed iteratively, so large operands
+    can't exhaust the recursion limit.
+
+    Args:
+        a (int): integer
+        b (int): integer
+
+    Returns:
+        tuple(int, int, int): g, x, y such that a*x + b*y = g = gcd(a, b).
     """
-    if a == 0:
-        return (b, 0, 1)
-    else:
-        g, y, x = egcd(b % a, a)
-        return (g, x - (b // a) * y, y)
+    oldR, r = a, b
+    oldX, x = 1, 0
+    oldY, y = 0, 1
+    while r:
+        q = oldR // r
+        oldR, r = r, oldR - q*r
+        oldX, x = x, oldX - q*x
+        oldY, y = y, oldY - q*y
+    return oldR, oldX, oldY
 
 def modInv(a, m):
     """
-    Modular inverse based on https://stackoverflow.com/a/9758173/1124661.
-    
-    Args: 
+    Modular inverse. Uses the built-in pow where available. See
+    scalar.modInverse.
+
+    Args:
         a (int): integer
         m (int): modulus
     """
-    g, x, y = egcd(a, m)
-    if g != 1:
-        raise Exception('modular inverse does not exist')
-    else:
-        return x % m
+    return scalar.modInverse(a, m)
+
+def batchModInv(values, m):
+    """
+    Modular inverses of all of the values, computed with a single modular
+    inversion using Montgomery's trick. Each additional value costs three
+    modular multiplications.
+
+    Args:
+        values (list(int)): The integers to invert. None may be zero mod m.
+        m (int): modulus
+
+    Returns:
+        list(int): The inverse of each value, in order.
+    """
+    return scalar.batchInverse(values, m)
 
 def hashH(b):
     """
@@ -232,7 +262,7 @@ class ExtendedKey:
             pubVer (byte-like): Network version bytes for extended pub keys
             key (byte-like): The key. 
             pubKey (byte-like): Will be the same as `key` for public key. Will
-                be generated from key if zero is provided. 
+                be generated from key on first use if zero is provided. 
             chainCode (byte-like): Chain code for key derivation.
             parentFP (ByteArray): parent key fingerprint
             depth (int): Key depth. 
@@ -243,17 +273,41 @@ class ExtendedKey:
         self.privVer = ByteArray(privVer)
         self.pubVer = ByteArray(pubVer)
         self.key = ByteArray(key)
-        self.pubKey = ByteArray(pubKey)
-        if self.pubKey.iszero():
-            if isPrivate:
-                self.pubKey = Curve.publicKey(self.key.int()).serializeCompressed()
-            else:
-                self.pubKey = self.key
+        # The compressed public key. For private keys, computing it takes a
+        # scalar base multiplication, so it is put off until it is needed. See
+        # the pubKey property.
+        self.cachedPubKey = ByteArray(pubKey)
+        if self.cachedPubKey.iszero():
+            self.cachedPubKey = None if isPrivate else self.key
         self.chainCode = ByteArray(chainCode)
         self.parentFP = ByteArray(parentFP)
         self.depth = depth
         self.childNum = childNum
         self.isPrivate = isPrivate
+    @property
+    def pubKey(self):
+        """
+        The compressed public key. Computed from the private key on first
+        access.
+
+        Returns:
+            ByteArray: The 33-byte public key.
+        """
+        if self.cachedPubKey is None:
+            self.cachedPubKey = Curve.publicKey(self.key.int()).serializeCompressed()
+        return self.cachedPubKey
+    @pubKey.setter
+    def pubKey(self, pubKey):
+        self.cachedPubKey = pubKey
+    def zero(self):
+        """
+        Zero the key, the public key, if it has been computed, and the chain
+        code.
+        """
+        self.key.zero()
+        if self.cachedPubKey is not None:
+            self.cachedPubKey.zero()
+        self.chainCode.zero()
     # def __tojson__(self):
     #     return {
     #         "privVer": self.privVer,
@@ -541,6 +595,22 @@ class ExtendedKey:
         """
         child = self.child(i)
         return newAddressPubKeyHash(hash160(child.publicKey().serializeCompressed().b), net, STEcdsaSecp256k1).string()
+    def deriveChildAddresses(self, start, end, net, processes=None):
+        """
+        The base-58 encoded addresses for children start through end - 1. See
+        deriveChildAddresses.
+
+        Args:
+            start (int): The first child number.
+            end (int): One past the last child number.
+            net (obj): Network parameters.
+            processes (int): Optional. The process pool size.
+
+        Returns:
+            list(str): The addresses in child number order, with None for any
+                child number that does not derive to a usable child.
+        """
+        return deriveChildAddresses(self, start, end, net, processes)
     def privateKey(self):
         """
         A PrivateKey structure that can be used for signatures.
@@ -548,7 +618,11 @@ class ExtendedKey:
         Returns:
             PrivateKey: The private key structure.
         """
-        return privKeyFromBytes(self.key)
+        # Both the PrivateKey and the public key need k*G. Compute it once.
+        x, y = Curve.scalarBaseMult(self.key.int())
+        if self.cachedPubKey is None:
+            self.cachedPubKey = PublicKey(Curve, x, y).serializeCompressed()
+        return PrivateKey(Curve, self.key, x, y)
     def publicKey(self):
         """
         A PublicKey structure of the pubKey.
@@ -560,6 +634,152 @@ class ExtendedKey:
 
 # tinyjson.register(ExtendedKey)
 
+def deriveChildAddresses(extKey, start, end, net, processes=None):
+    """
+    Derive the pay-to-pubkey-hash addresses for children start through end - 1
+    of the extended key, such as an account branch key. The result is the same
+    as calling ExtendedKey.deriveChildAddress for each child number, but the
+    point conversions share a single field inversion, and with processes > 1
+    the range is split into contiguous chunks across a process pool. Only the
+    neutered key's public key and chain code are sent to the workers.
+
+    Args:
+        extKey (ExtendedKey): The parent key. Private keys are neutered first,
+            which doesn't change the children's public keys.
+        start (int): The first child number. Must not be hardened.
+        end (int): One past the last child number.
+        net (obj): Network parameters.
+        processes (int): Optional. If greater than 1, the size of the process
+            pool to derive with.
+
+    Returns:
+        list(str): The addresses in child number order, with None for any
+            child number that does not derive to a usable child.
+    """
+    if end > HARDENED_KEY_START:
+        raise ParameterRangeError("cannot generate hardened child from public extended key")
+    pubKey = extKey.neuter()
+    jobs = chunkChildRange(pubKey.pubKey.bytes(), pubKey.chainCode.bytes(), start, end, processes)
+    if len(jobs) > 1:
+        with multiprocessing.Pool(processes) as pool:
+            hashLists = pool.map(childPubKeyHashes, jobs)
+    else:
+        hashLists = [childPubKeyHashes(job) for job in jobs]
+    addrs = []
+    for pkHashes in hashLists:
+        for pkHash in pkHashes:
+            if pkHash is None:
+                addrs.append(None)
+                continue
+            addrs.append(newAddressPubKeyHash(ByteArray(pkHash), net, STEcdsaSecp256k1).string())
+    return addrs
+
+def chunkChildRange(pubKey, chainCode, start, end, processes):
+    """
+    Split the child numbers start through end - 1 into one contiguous job per
+    process for childPubKeyHashes.
+    """
+    if end <= start:
+        return []
+    if not processes or processes < 2:
+        return [(pubKey, chainCode, start, end)]
+    size = -(-(end - start) // processes)
+    return [(pubKey, chainCode, i, min(i + size, end)) for i in range(start, end, size)]
+
+def childPubKeyHashes(job):
+    """
+    The hash160 of the compressed public key of each child in the job's range.
+    Module-level so that it can be sent to a process pool. This is case #3 of
+    ExtendedKey.child, childKey = serP(point(parse256(Il)) + parentKey), for a
+    range of children at once.
+
+    Args:
+        job (tuple): (pubKey, chainCode, start, end). The parent's compressed
+            public key and chain code as bytes, and the child number range.
+
+    Returns:
+        list(bytes): The 20-byte hash for each child, or None if the child
+            number does not derive to a usable child.
+    """
+    pubKey, chainCode, start, end = job
+    parent = Curve.parsePubKey(pubKey)
+    px, py = Curve.bigAffineToField(parent.x, parent.y)
+    one = FieldVal().setInt(1)
+    valid, points = [], []
+    for i in range(start, end):
+        ilr = hmacDigest(chainCode, pubKey + i.to_bytes(4, byteorder="big"), hashlib.sha512)
+        il = int.from_bytes(ilr[:32], byteorder="big")
+        if il >= Curve.N or il == 0:
+            continue
+        qx, qy, qz = Curve.scalarBaseMultJacobian(il)
+        Curve.addJacobian(qx, qy, qz, px, py, one, qx, qy, qz)
+        valid.append(i)
+        points.append((qx, qy, qz))
+    pkHashes = [None]*(end - start)
+    for i, (x, y) in zip(valid, Curve.fieldJacobiansToBigAffine(points)):
+        if x == 0 and y == 0:
+            continue
+        pkHashes[i - start] = hash160(PublicKey(Curve, x, y).serializeCompressed().b).bytes()
+    return pkHashes
+
+class DerivationCache:
+    """
+    DerivationCache memoizes the derivation of descendants of a root extended
+    key, keyed by their path from the root. Keys at the first level, such as
+    an account's branch keys, are kept for the life of the cache. Deeper keys
+    are kept in a bounded least-recently-used map. Call zero when the keys are
+    no longer needed. The hits and misses attributes count derivations.
+    """
+    def __init__(self, root, size=DERIVATION_CACHE_SIZE):
+        """
+        Args:
+            root (ExtendedKey): The key to derive from.
+            size (int): Optional. The maximum number of deeper keys to keep.
+        """
+        self.root = root
+        self.size = size
+        self.branches = {}
+        self.keys = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    def derive(self, *path):
+        """
+        The descendant of the root key at the path.
+
+        Args:
+            *path (int): Child numbers, starting from the root's children.
+
+        Returns:
+            ExtendedKey: The derived key.
+        """
+        if not path:
+            return self.root
+        keys = self.branches if len(path) == 1 else self.keys
+        key = keys.get(path)
+        if key is not None:
+            self.hits += 1
+            if keys is self.keys:
+                keys.move_to_end(path)
+            return key
+        self.misses += 1
+        key = self.derive(*path[:-1]).child(path[-1])
+        keys[path] = key
+        if len(self.keys) > self.size:
+            # Evicted keys may still be held by the caller, so they are
+            # dropped rather than zeroed.
+            self.keys.popitem(last=False)
+        return key
+    def zero(self):
+        """
+        Zero and forget every cached key. The root key is left alone.
+        """
+        for key in self.branches.values():
+            key.zero()
+        for key in self.keys.values():
+            key.zero()
+        self.branches.clear()
+        self.keys.clear()
+
 def decodeExtendedKey(net, pw, key):
     """
     Decode an base58 ExtendedKey using the passphrase and network parameters.
@@ -782,6 +1002,99 @@ class TestCrypto(unittest.TestCase):
         self.assertTrue(a, aUnenc)
     def test_curve(self):
         pass
+    def test_batch_mod_inv(self):
+        values = [1, 2, 3, Curve.N - 1, 0xdeadbeef, Curve.Gx]
+        invs = batchModInv(values, Curve.N)
+        self.assertEqual(invs, [modInv(v, Curve.N) for v in values])
+        self.assertEqual(batchModInv([], Curve.N), [])
+    def test_mod_inv(self):
+        for a, m in ((3, 7), (0xdeadbeef, Curve.N), (Curve.N - 1, Curve.N), (Curve.Gx, Curve.P)):
+            g, x, y = egcd(a, m)
+            self.assertEqual(g, 1)
+            self.assertEqual(a*x + m*y, 1)
+            self.assertEqual(modInv(a, m) * a % m, 1)
+        self.assertEqual(egcd(12, 18)[0], 6)
+        self.assertRaises(Exception, modInv, 6, 9)
+        self.assertRaises(Exception, modInv, 0, Curve.N)
+    def test_child_pub_key_hashes(self):
+        extKey = ExtendedKey(
+            privVer = bytes(4),
+            pubVer = bytes(4),
+            key = ByteArray("eaf02ca348c524e6392655ba4d29603cd1a7347d9d65cfe93ce1ebffdca22694"),
+            pubKey = "",
+            chainCode = ByteArray("873dff81c02f525623fd1fe5167eac3a55a049de3d314bb42ee227ffed37d508"),
+            parentFP = bytes(4),
+            depth = 0,
+            childNum = 0,
+            isPrivate = True,
+        ).neuter()
+        job = (extKey.pubKey.bytes(), extKey.chainCode.bytes(), 3, 11)
+        expected = [hash160(extKey.child(i).pubKey.b).bytes() for i in range(3, 11)]
+        self.assertEqual(childPubKeyHashes(job), expected)
+        self.assertEqual(chunkChildRange(b"", b"", 3, 11, 3), [(b"", b"", 3, 6), (b"", b"", 6, 9), (b"", b"", 9, 11)])
+        self.assertEqual(chunkChildRange(b"", b"", 3, 11, None), [(b"", b"", 3, 11)])
+        self.assertEqual(chunkChildRange(b"", b"", 3, 3, 2), [])
+    def test_derivation_cache(self):
+        root = ExtendedKey(
+            privVer = bytes(4),
+            pubVer = bytes(4),
+            key = ByteArray("eaf02ca348c524e6392655ba4d29603cd1a7347d9d65cfe93ce1ebffdca22694"),
+            pubKey = "",
+            chainCode = ByteArray("873dff81c02f525623fd1fe5167eac3a55a049de3d314bb42ee227ffed37d508"),
+            parentFP = bytes(4),
+            depth = 0,
+            childNum = 0,
+            isPrivate = True,
+        )
+        cache = DerivationCache(root, size=3)
+        self.assertIs(cache.derive(), root)
+        branch = cache.derive(1)
+        self.assertEqual(branch.key, root.child(1).key)
+        for i in range(5):
+            self.assertEqual(cache.derive(1, i).key, root.child(1).child(i).key)
+        # One branch derivation and one for each child.
+        self.assertEqual((cache.hits, cache.misses), (5, 6))
+        self.assertIs(cache.derive(1), branch)
+        self.assertEqual(len(cache.keys), 3)
+        # The least recently used child was evicted.
+        self.assertNotIn((1, 0), cache.keys)
+        child = cache.derive(1, 4)
+        cache.zero()
+        self.assertTrue(branch.key.iszero())
+        self.assertTrue(child.key.iszero())
+        self.assertTrue(child.chainCode.iszero())
+        self.assertFalse(root.key.iszero())
+        self.assertEqual(len(cache.branches) + len(cache.keys), 0)
+    def test_lazy_pub_key(self):
+        root = ExtendedKey(
+            privVer = bytes(4),
+            pubVer = bytes(4),
+            key = ByteArray("eaf02ca348c524e6392655ba4d29603cd1a7347d9d65cfe93ce1ebffdca22694"),
+            pubKey = "",
+            chainCode = ByteArray("873dff81c02f525623fd1fe5167eac3a55a049de3d314bb42ee227ffed37d508"),
+            parentFP = bytes(4),
+            depth = 0,
+            childNum = 0,
+            isPrivate = True,
+        )
+        self.assertIsNone(root.cachedPubKey)
+        child = root.child(HARDENED_KEY_START)
+        # The hardened child needed the parent's fingerprint, but not its own
+        # public key.
+        self.assertIsNotNone(root.cachedPubKey)
+        self.assertIsNone(child.cachedPubKey)
+        expected = Curve.publicKey(child.key.int()).serializeCompressed()
+        privKey = child.privateKey()
+        self.assertEqual(child.cachedPubKey, expected)
+        self.assertEqual(child.pubKey, expected)
+        self.assertEqual((privKey.pub.x, privKey.pub.y), Curve.scalarBaseMult(child.key.int()))
+        self.assertEqual(child.neuter().key, expected)
+        other = root.child(HARDENED_KEY_START)
+        self.assertEqual(other.pubKey, expected)
+        other.zero()
+        self.assertTrue(other.key.iszero())
+        self.assertTrue(other.pubKey.iszero())
+        self.assertTrue(other.chainCode.iszero())
     def test_priv_keys(self):
         key = ByteArray("eaf02ca348c524e6392655ba4d29603cd1a7347d9d65cfe93ce1ebffdca22694")
         pk = privKeyFromBytes(key)
@@ -0,0 +1,179 @@
+"""
+Copyright (c) 2019, Brian Stafford
+Copyright (c) 2019, The Decred developers
+See LICENSE for details
+
+module bench
+	Timing for the secp256k1 curve operations and scalar inversion. Run as a
+	script to compare the field backends and inversion methods.
+
+		python -m tinydecred.crypto.secp256k1.bench
+
+	The field backend is chosen when the curve module is imported, so each
+	backend is timed in its own interpreter.
+"""
+import json
+import os
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+BACKENDS = ("limb", "int")
+
+# Arbitrary, fixed scalars so that runs are comparable.
+SCALARS = (
+	0xAA5E28D6A97A2479A65527F7290311A3624D4CC0FA1578598EE3C2613BF99522,
+	0x7E2B897B8CEBC6361663AD410835639826D590F393D90A9538881735256DFAE3,
+	0x6461E6DF0FE7DFD05329F41BF771B86578143D4DD1F7866FB4CA7E97C5FA945D,
+)
+
+# Scalars for the batched operations.
+BATCH_SIZE = 100
+BATCH = [SCALARS[0] + i for i in range(BATCH_SIZE)]
+
+def timeOp(func, number):
+	"""
+	The best per-call time, in seconds, over a few repetitions of `number` calls.
+	"""
+	return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+def benchCurve(number=10):
+	"""
+	Time scalarBaseMult, scalarMult and the batched scalarBaseMults with the
+	currently loaded field backend.
+
+	Args:
+		number (int): The number of calls to average over.
+
+	Returns:
+		dict: Per-call time in seconds, keyed by operation name.
+	"""
+	from tinydecred.crypto.secp256k1.curve import curve
+	px, py = curve.scalarBaseMult(SCALARS[0])
+	table = curve.pointTable(px, py)
+	pub = curve.publicKey(SCALARS[0])
+	u1, u2 = SCALARS[1], SCALARS[2]
+	curve.doubleScalarMult(u1, pub, u2)
+	return {
+		"scalarBaseMult": timeOp(lambda: [curve.scalarBaseMult(k) for k in SCALARS], number) / len(SCALARS),
+		"scalarMult": timeOp(lambda: [curve.scalarMult(px, py, k) for k in SCALARS], number) / len(SCALARS),
+		"scalarMult (cached table)": timeOp(lambda: [curve.scalarMult(px, py, k, table=table) for k in SCALARS], number) / len(SCALARS),
+		"u1*G + u2*P (separate)": timeOp(lambda: curve.add(*curve.scalarBaseMult(u1), *curve.scalarMult(px, py, u2)), number),
+		"u1*G + u2*P (doubleScalarMult)": timeOp(lambda: curve.doubleScalarMult(u1, pub, u2), number),
+		"scalarBaseMults (per key, batch of %d)" % BATCH_SIZE: timeOp(lambda: curve.scalarBaseMults(BATCH), number) / BATCH_SIZE,
+	}
+
+def fieldValSize(f):
+	"""
+	The memory held by a single field value, in bytes.
+	"""
+	size = sys.getsizeof(f)
+	if hasattr(f, "__dict__"):
+		size += sys.getsizeof(f.__dict__)
+	if isinstance(getattr(type(f), "n", None), property):
+		return size
+	return size + sys.getsizeof(f.n)
+
+def peakMemory(func):
+	"""
+	The peak traced memory allocated while running func, in bytes.
+	"""
+	tracemalloc.start()
+	try:
+		func()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+def benchMemory():
+	"""
+	Measure the size of a field value and the peak memory allocated by the
+	curve operations with the currently loaded field backend.
+
+	Returns:
+		dict: Sizes in bytes, keyed by measurement.
+	"""
+	from tinydecred.crypto.secp256k1.curve import curve, FieldVal
+	px, py = curve.scalarBaseMult(SCALARS[0])
+	table = curve.pointTable(px, py)
+	pub = curve.publicKey(SCALARS[0])
+	u1, u2 = SCALARS[1], SCALARS[2]
+	# Warm up the per-thread scratch registers and the base point tables.
+	curve.doubleScalarMult(u1, pub, u2)
+	return {
+		"FieldVal size": fieldValSize(FieldVal()),
+		"scalarBaseMult peak": peakMemory(lambda: curve.scalarBaseMult(u1)),
+		"scalarMult (cached table) peak": peakMemory(lambda: curve.scalarMult(px, py, u2, table=table)),
+		"doubleScalarMult peak": peakMemory(lambda: curve.doubleScalarMult(u1, pub, u2)),
+	}
+
+def recursiveInverse(a, m):
+	"""
+	The recursive extended Euclidean inverse that the crypto module used
+	before the scalar module was added. Kept here for comparison.
+	"""
+	def egcd(a, b):
+		if a == 0:
+			return (b, 0, 1)
+		g, y, x = egcd(b % a, a)
+		return (g, x - (b // a) * y, y)
+	g, x, _ = egcd(a, m)
+	if g != 1:
+		raise Exception("modular inverse does not exist")
+	return x % m
+
+def benchInverse(number=1000):
+	"""
+	Time a single inverse modulo N with each method, and the per-value cost of
+	a batched inversion.
+
+	Args:
+		number (int): The number of calls to average over.
+
+	Returns:
+		dict: Per-inversion time in seconds, keyed by method.
+	"""
+	from tinydecred.crypto.secp256k1 import scalar
+	N = scalar.order
+	return {
+		"recursive egcd": timeOp(lambda: [recursiveInverse(k, N) for k in SCALARS], number) / len(SCALARS),
+		"iterative egcd": timeOp(lambda: [scalar.egcdInverse(k, N) for k in SCALARS], number) / len(SCALARS),
+		"fermat": timeOp(lambda: [pow(k, N - 2, N) for k in SCALARS], number) / len(SCALARS),
+		"scalar.inverse": timeOp(lambda: [scalar.inverse(k) for k in SCALARS], number) / len(SCALARS),
+		"scalar.batchInverse (per value, batch of %d)" % BATCH_SIZE: timeOp(lambda: scalar.batchInverse(BATCH), number // 10) / BATCH_SIZE,
+	}
+
+def runBackend(backend, call):
+	"""
+	Run the bench module function call, e.g. "benchCurve(10)", in a fresh
+	interpreter with the given field backend.
+	"""
+	env = dict(os.environ, TINYDECRED_FIELD=backend)
+	out = subprocess.check_output([
+		sys.executable, "-c",
+		"import json; from tinydecred.crypto.secp256k1 import bench; print(json.dumps(bench.%s))" % call,
+	], env=env)
+	return json.loads(out.decode().strip().splitlines()[-1])
+
+def main(number=10):
+	results = {backend: runBackend(backend, "benchCurve(%d)" % number) for backend in BACKENDS}
+	base = results[BACKENDS[0]]
+	for op in sorted(base):
+		print("%s:" % op)
+		for backend in BACKENDS:
+			t = results[backend][op]
+			print("    %-6s %9.3f ms  %5.1fx" % (backend, t*1e3, base[op]/t))
+	memory = {backend: runBackend(backend, "benchMemory()") for backend in BACKENDS}
+	for item in memory[BACKENDS[0]]:
+		print("%s:" % item)
+		for backend in BACKENDS:
+			print("    %-6s %9d B" % (backend, memory[backend][item]))
+	print("modular inverse mod N:")
+	inverses = benchInverse()
+	base = inverses["recursive egcd"]
+	for method, t in inverses.items():
+		print("    %-44s %7.2f µs  %5.1fx" % (method, t*1e6, base/t))
+
+if __name__ == "__main__":
+	main()
@@ -7,11 +7,26 @@ module curve
 	Pure Python secp256k1 curve implementation. Based entirely on the Decred 
 	dcrd golang version. 
 """
-from tinydecred.crypto.secp256k1.field import FieldVal, BytePoints
+import os
+import threading
+from collections import OrderedDict
 from tinydecred.crypto.bytearray import ByteArray
 from tinydecred.crypto.rando import generateSeed
 import unittest
 
+# The field arithmetic backend is selected at import time with the
+# TINYDECRED_FIELD environment variable. "int" (the default) uses native
+# Python integers. "limb" uses the 10x26-bit word port of dcrd's fieldVal.
+FIELD_BACKEND = os.environ.get("TINYDECRED_FIELD", "int")
+if FIELD_BACKEND == "int":
+	from tinydecred.crypto.secp256k1.intfield import IntFieldVal as FieldVal
+elif FIELD_BACKEND == "limb":
+	from tinydecred.crypto.secp256k1.field import FieldVal
+else:
+	raise Exception("unknown secp256k1 field backend %s" % FIELD_BACKEND)
+from tinydecred.crypto.secp256k1.field import BytePoints, sqrt as fieldSqrt
+from tinydecred.crypto.secp256k1 import scalar
+
 COORDINATE_LEN = 32
 PUBKEY_COMPRESSED_LEN = COORDINATE_LEN + 1
 PUBKEY_LEN = 65
@@ -20,6 +35,18 @@ PUBKEY_UNCOMPRESSED = 0x04 # 0x04 x coord + y coord
 
 fieldOne = FieldVal.fromInt(1)
 
+# WNAF_WIDTH is the default window width for wNAF scalar multiplication. Each
+# precomputed point table holds 2^(WNAF_WIDTH-2) odd multiples per point.
+WNAF_WIDTH = 5
+
+# BASE_WNAF_WIDTH is the window width for the base point table used by
+# doubleScalarMult. The table is built once, so it can afford to be larger.
+BASE_WNAF_WIDTH = 7
+
+# PUBKEY_CACHE_SIZE is the number of decompressed public keys kept by
+# KoblitzCurve.parsePubKey. Each entry is a few hundred bytes.
+PUBKEY_CACHE_SIZE = 2048
+
 def isEven(i):
 	return i % 2 == 0
 
@@ -92,11 +119,63 @@ def NAF(k):
 		return retPos, retNeg
 	return retPos[1:], retNeg[1:]
 
+def wNAF(k, w):
+	"""
+	wNAF returns the width-w Non-Adjacent Form of the integer k as a list of
+	digits, least significant first. Every non-zero digit is odd and less than
+	2^(w-1) in absolute value, and of any w consecutive digits, at most one is
+	non-zero. This is algorithm 3.35 from [GECC]. A negative k produces the
+	negated digits of |k|.
+	"""
+	sign = 1
+	if k < 0:
+		sign, k = -1, -k
+	window = 1 << w
+	half = window >> 1
+	digits = []
+	while k > 0:
+		d = 0
+		if k & 1:
+			d = k & (window - 1)
+			if d >= half:
+				d -= window
+			k -= d
+		digits.append(sign * d)
+		k >>= 1
+	return digits
+
+class PointTable:
+	"""
+	PointTable holds precomputed odd multiples of a point for wNAF scalar
+	multiplication. See KoblitzCurve.pointTable.
+	"""
+	def __init__(self, w, p1, p2):
+		"""
+		Args:
+			w (int): The wNAF window width the table was built for.
+			p1 (list(tuple(FieldVal))): The affine (x, y, -y) odd multiples
+				P, 3P, 5P, ... of the point.
+			p2 (list(tuple(FieldVal))): The same odd multiples of ϕ(P).
+		"""
+		self.w = w
+		self.p1 = p1
+		self.p2 = p2
+
 class PublicKey:
 	def __init__(self, curve, x, y):
 		self.curve = curve
 		self.x = x
 		self.y = y
+		self.table = None
+	def pointTable(self):
+		"""
+		The wNAF PointTable for the key. It is built on first use and kept with
+		the key, so a key that is used in many scalar multiplications only pays
+		for the precomputation once.
+		"""
+		if self.table is None:
+			self.table = self.curve.pointTable(self.x, self.y)
+		return self.table
 	def serializeCompressed(self):
 		fmt = PUBKEY_COMPRESSED
 		if not isEven(self.y):
@@ -140,6 +219,79 @@ def generateKey(): # (*PrivateKey, error) {
 	x, y = curve.scalarBaseMult(k)
 	return PrivateKey(curve, k, x, y)
 
+class ScratchRegisters(threading.local):
+	"""
+	ScratchRegisters holds the temporary field values used by the point
+	addition and doubling formulas, so that they are allocated once rather
+	than on every call. The add routines are mutually exclusive and only fall
+	through to doubling, which has its own registers, so a single set of each
+	is enough. The registers are per thread, since the curve is shared.
+	"""
+	def __init__(self):
+		# The largest of the add routines, addGeneric, needs 15 temporaries.
+		self.add = tuple(FieldVal() for _ in range(15))
+		self.double = tuple(FieldVal() for _ in range(6))
+		# A Jacobian point for decoding byte points in scalarBaseMultJacobian.
+		self.point = tuple(FieldVal() for _ in range(3))
+
+class PointCache:
+	"""
+	PointCache is a bounded least-recently-used map of encoded public keys to
+	their affine points. Lookups and insertions are thread-safe. The hits and
+	misses attributes count lookups.
+	"""
+	def __init__(self, size=PUBKEY_CACHE_SIZE):
+		self.size = size
+		self.points = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+	def __len__(self):
+		return len(self.points)
+	def get(self, key):
+		"""
+		The cached (x, y) point for the key, or None.
+		"""
+		with self.lock:
+			point = self.points.get(key)
+			if point is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.points.move_to_end(key)
+			return point
+	def put(self, key, point):
+		"""
+		Cache the point, evicting the least recently used entry if full.
+		"""
+		with self.lock:
+			self.points[key] = point
+			self.points.move_to_end(key)
+			if len(self.points) > self.size:
+				self.points.popitem(last=False)
+	def clear(self):
+		"""
+		Empty the cache and reset the counters.
+		"""
+		with self.lock:
+			self.points.clear()
+			self.hits = 0
+			self.misses = 0
+	def info(self):
+		"""
+		The cache statistics.
+
+		Returns:
+			dict: hits, misses, the current number of entries and the
+				maximum size.
+		"""
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"entries": len(self.points),
+			"size": self.size,
+		}
+
 class KoblitzCurve:
 	def __init__(self, P, N, B, Gx, Gy, BitSize, H, q, byteSize, lamda, beta, a1, b1, a2, b2):
 		self.P = P
@@ -157,6 +309,12 @@ class KoblitzCurve:
 		self.b1 = b1
 		self.a2 = a2
 		self.b2 = b2
+		# The precomputed wNAF table for G. See baseTable.
+		self.gTable = None
+		self.scratch = ScratchRegisters()
+		# Decompressed points, keyed by the compressed public key encoding.
+		# See parsePubKey.
+		self.pubKeyCache = PointCache()
 
 	def scalarBaseMult(self, k):
 		"""
@@ -164,10 +322,17 @@ class KoblitzCurve:
 		big endian integer.
 		Part of the elliptic.Curve interface.
 		"""
+		qx, qy, qz = self.scalarBaseMultJacobian(k)
+		return self.fieldJacobianToBigAffine(qx, qy, qz)
+	def scalarBaseMultJacobian(self, k):
+		"""
+		scalarBaseMultJacobian computes k*G like scalarBaseMult, but returns the
+		result as a Jacobian point (x, y, z) of field values, leaving the
+		conversion to affine coordinates to the caller.
+		"""
 		kb = ByteArray(k % self.N)
 		diff = len(BytePoints) - len(kb)
 
-
 		# Point Q = ∞ (point at infinity).
 		qx, qy, qz = FieldVal(), FieldVal(), FieldVal()
 
@@ -176,47 +341,42 @@ class KoblitzCurve:
 		# expressing k in base-256 which it already sort of is.
 		# Each "digit" in the 8-bit window can be looked up using bytePoints
 		# and added together.
+		px, py, pz = self.scratch.point
 		for i, bidx in enumerate(kb.b):
-			p = BytePoints[diff+i][bidx]
-			self.addJacobian(qx, qy, qz, p[0], p[1], p[2], qx, qy, qz)
-		return self.fieldJacobianToBigAffine(qx, qy, qz)
+			x, y, z = BytePoints.coords(diff+i, bidx)
+			self.addJacobian(qx, qy, qz, px.setBytes(x), py.setBytes(y), pz.setBytes(z), qx, qy, qz)
+		return qx, qy, qz
+	def scalarBaseMults(self, ks):
+		"""
+		scalarBaseMults computes k*G for every k in ks. The conversions back to
+		affine coordinates share a single field inversion, so this is cheaper
+		than calling scalarBaseMult for each scalar.
+
+		Args:
+			ks (list(int)): The scalars.
+
+		Returns:
+			list(tuple(int, int)): The affine (x, y) result for each scalar.
+		"""
+		return self.fieldJacobiansToBigAffine([self.scalarBaseMultJacobian(k) for k in ks])
 	def splitK(self, k):
 		"""
-		splitK returns a balanced length-two representation of k and their signs.
-		This is algorithm 3.74 from [GECC].
-		
-		One thing of note about this algorithm is that no matter what c1 and c2 are,
-		the final equation of k = k1 + k2 * lambda (mod n) will hold.  This is
-		provable mathematically due to how a1/b1/a2/b2 are computed.
-		c1 and c2 are chosen to minimize the max(k1,k2).
-		"""
-		# At some point, it might be useful to write something similar to
-		# fieldVal but for N instead of P as the prime field if this ends up
-		# being a bottleneck.
-		# c1 = round(b2 * k / n) from step 4.
-		# Rounding isn't really necessary and costs too much, hence skipped
-		c1 = (self.b2 + k) // self.N
-		# c2 = round(b1 * k / n) from step 4 (sign reversed to optimize one step)
-		# Rounding isn't really necessary and costs too much, hence skipped
-		c2 = (self.b1 + k) // self.N
-		# k1 = k - c1 * a1 - c2 * a2 from step 5 (note c2's sign is reversed)
-		tmp1 = c1 * self.a1
-		tmp2 = c2 * self.a2
-		k1 = k - tmp1 + tmp2
-		# k2 = - c1 * b1 - c2 * b2 from step 5 (note c2's sign is reversed)
-		tmp1 = c1 * self.b1
-		tmp2 = c2 * self.b2
-		k2 = tmp2 - tmp1
-
-		return k1, k2
-	def scalarMult(self, Bx, By, k):
+		splitK returns a balanced length-two representation of k, k1 and k2
+		such that k = k1 + k2 * lambda (mod n). See scalar.splitK.
+		"""
+		return scalar.splitK(k)
+	def scalarMult(self, Bx, By, k, table=None):
 		"""
 		scalarMult returns k*(Bx, By) where k is a big endian integer.
 		Part of the elliptic.Curve interface.
+
+		A PointTable for (Bx, By), as returned by pointTable, can be provided to
+		skip the precomputation step. Callers that multiply the same point
+		repeatedly, such as a public key that is verified often, should build
+		the table once and reuse it.
 		"""
-		# Point Q = ∞ (point at infinity).
-		fv = FieldVal
-		qx, qy, qz = fv(), fv(), fv()
+		if table is None:
+			table = self.pointTable(Bx, By)
 
 		# Decompose K into k1 and k2 in order to halve the number of EC ops.
 		# See Algorithm 3.74 in [GECC].
@@ -225,96 +385,145 @@ class KoblitzCurve:
 		# The main equation here to remember is:
 		#   k * P = k1 * P + k2 * ϕ(P)
 		#
-		# P1 below is P in the equation, P2 below is ϕ(P) in the equation
-		p1x, p1y = curve.bigAffineToField(Bx, By)
-		p1yNeg = fv().negateVal(p1y, 1)
-		p1z = fv().setInt(1)
-
-		# NOTE: ϕ(x,y) = (βx,y).  The Jacobian z coordinate is 1, so this math
-		# goes through.
-		p2x = fv().mul2(p1x, curve.beta)
-		p2y = fv().set(p1y)
-		p2yNeg = fv().negateVal(p2y, 1)
-		p2z = fv().setInt(1)
-
-		# Flip the positive and negative values of the points as needed
-		# depending on the signs of k1 and k2.  As mentioned in the equation
-		# above, each of k1 and k2 are multiplied by the respective point.
-		# Since -k * P is the same thing as k * -P, and the group law for
-		# elliptic curves states that P(x, y) = -P(x, -y), it's faster and
-		# simplifies the code to just make the point negative.
-		if k1 < 0:
-			p1y, p1yNeg = p1yNeg, p1y
-		if k2 < 1:
-			p2y, p2yNeg = p2yNeg, p2y
-
-		# NAF versions of k1 and k2 should have a lot more zeros.
-		#
-		# The Pos version of the bytes contain the +1s and the Neg versions
-		# contain the -1s.
-		k1PosNAF, k1NegNAF = NAF(ByteArray(k1))
-		k2PosNAF, k2NegNAF = NAF(ByteArray(k2))
-		k1Len = len(k1PosNAF)
-		k2Len = len(k2PosNAF)
-
-		m = k1Len
-		if m < k2Len:
-			m = k2Len
-
-		# Add left-to-right using the NAF optimization.  See algorithm 3.77
-		# from [GECC].  This should be faster overall since there will be a lot
-		# more instances of 0, hence reducing the number of Jacobian additions
-		# at the cost of 1 possible extra doubling.
-		for i in range(m):
-			# Since we're going left-to-right, pad the front with 0s.
-			if i < m-k1Len:
-				k1BytePos = 0
-				k1ByteNeg = 0
-			else:
-				k1BytePos = k1PosNAF[i-(m-k1Len)]
-				k1ByteNeg = k1NegNAF[i-(m-k1Len)]
-			if i < m-k2Len:
-				k2BytePos = 0
-				k2ByteNeg = 0
-			else:
-				k2BytePos = k2PosNAF[i-(m-k2Len)]
-				k2ByteNeg = k2NegNAF[i-(m-k2Len)]
-
-			for j in range(7, -1, -1):
-				# Q = 2 * Q
-				curve.doubleJacobian(qx, qy, qz, qx, qy, qz)
-
-				if k1BytePos&0x80 == 0x80:
-					curve.addJacobian(qx, qy, qz, p1x, p1y, p1z, qx, qy, qz)
-				elif k1ByteNeg&0x80 == 0x80:
-					curve.addJacobian(qx, qy, qz, p1x, p1yNeg, p1z, qx, qy, qz)
-
-				if k2BytePos&0x80 == 0x80:
-					curve.addJacobian(qx, qy, qz, p2x, p2y, p2z, qx, qy, qz)
-				elif k2ByteNeg&0x80 == 0x80:
-					curve.addJacobian(qx, qy, qz, p2x, p2yNeg, p2z, qx, qy, qz)
-				k1BytePos = k1BytePos << 1
-				k1ByteNeg = k1ByteNeg << 1
-				k2BytePos = k2BytePos << 1
-				k2ByteNeg = k2ByteNeg << 1
-
-		# Convert the Jacobian coordinate field values back to affine big.Ints.
-		return curve.fieldJacobianToBigAffine(qx, qy, qz)
+		# The table holds the odd multiples of both P and ϕ(P), so each half is
+		# evaluated with its width-w NAF, which has at most one non-zero digit
+		# in any w consecutive digits. The sign of each digit (and of k1 and
+		# k2) selects between the y and -y entries of the table.
+		return self.fieldJacobianToBigAffine(*self.wnafMult(((wNAF(k1, table.w), table.p1), (wNAF(k2, table.w), table.p2))))
+	def doubleScalarMult(self, u1, pub, u2):
+		"""
+		doubleScalarMult returns u1*G + u2*P, where G is the base point and P is
+		the PublicKey pub. Both products are evaluated with interleaved (Straus)
+		wNAF in a single chain of shared doublings in Jacobian coordinates, and
+		only the sum is converted back to affine coordinates. This is the
+		operation at the heart of ECDSA verification.
+
+		Args:
+			u1 (int): The base point scalar.
+			pub (PublicKey): The point P. Its PointTable is built and cached on
+				first use.
+			u2 (int): The scalar for P.
+
+		Returns:
+			tuple(int, int): The affine sum, (0, 0) for the point at infinity.
+		"""
+		gTable = self.baseTable()
+		pTable = pub.pointTable()
+		k1, k2 = self.splitK(u1 % self.N)
+		k3, k4 = self.splitK(u2 % self.N)
+		return self.fieldJacobianToBigAffine(*self.wnafMult((
+			(wNAF(k1, gTable.w), gTable.p1),
+			(wNAF(k2, gTable.w), gTable.p2),
+			(wNAF(k3, pTable.w), pTable.p1),
+			(wNAF(k4, pTable.w), pTable.p2),
+		)))
+	def baseTable(self):
+		"""
+		The PointTable for the base point G, built on first use. It uses a wider
+		window than the default since it is shared by every verification.
+		"""
+		if self.gTable is None:
+			self.gTable = self.pointTable(self.Gx, self.Gy, w=BASE_WNAF_WIDTH)
+		return self.gTable
+	def wnafMult(self, terms):
+		"""
+		wnafMult evaluates the sum d1*P1 + d2*P2 + ... for the (digits, multiples)
+		terms with a single chain of doublings, adding from left to right. See
+		algorithm 3.36 from [GECC]. Each digits list is a width-w NAF as produced
+		by wNAF, and each multiples list holds the affine odd multiples
+		(x, y, -y) of the corresponding point, as in PointTable.
+
+		Returns:
+			tuple(FieldVal): The Jacobian result (x, y, z).
+		"""
+		# Point Q = ∞ (point at infinity).
+		qx, qy, qz = FieldVal(), FieldVal(), FieldVal()
+		one = FieldVal().setInt(1)
+		m = max(len(digits) for digits, _ in terms)
+		for i in range(m-1, -1, -1):
+			# Q = 2 * Q
+			self.doubleJacobian(qx, qy, qz, qx, qy, qz)
+			for digits, multiples in terms:
+				if i >= len(digits):
+					continue
+				d = digits[i]
+				if d > 0:
+					x, y, _ = multiples[d >> 1]
+					self.addJacobian(qx, qy, qz, x, y, one, qx, qy, qz)
+				elif d < 0:
+					x, _, yNeg = multiples[-d >> 1]
+					self.addJacobian(qx, qy, qz, x, yNeg, one, qx, qy, qz)
+		return qx, qy, qz
+	def pointTable(self, Bx, By, w=WNAF_WIDTH):
+		"""
+		pointTable precomputes the odd multiples P, 3P, ..., (2^(w-1) - 1)P of the
+		point P = (Bx, By), along with the same multiples of ϕ(P), for use with
+		scalarMult.
+
+		Args:
+			Bx (int): The x coordinate.
+			By (int): The y coordinate.
+			w (int): The wNAF window width. The table holds 2^(w-2) multiples
+				of each point.
+
+		Returns:
+			PointTable: The precomputed table.
+		"""
+		fv = FieldVal
+		count = 1 << (w - 2)
+		p1x, p1y = self.bigAffineToField(Bx, By)
+		one = fv().setInt(1)
+
+		# Compute the odd multiples in Jacobian coordinates by repeatedly adding
+		# 2P, then convert them to affine together to share a single inversion.
+		dx, dy, dz = fv(), fv(), fv()
+		self.doubleJacobian(p1x, p1y, one, dx, dy, dz)
+		jacobians = [(fv().set(p1x), fv().set(p1y), fv().setInt(1))]
+		for _ in range(count - 1):
+			px, py, pz = jacobians[-1]
+			qx, qy, qz = fv(), fv(), fv()
+			self.addJacobian(px, py, pz, dx, dy, dz, qx, qy, qz)
+			jacobians.append((qx, qy, qz))
+
+		p1, p2 = [], []
+		for x, y in self.fieldJacobiansToBigAffine(jacobians):
+			fx, fy = self.bigAffineToField(x, y)
+			fyNeg = fv().negateVal(fy, 1).normalize()
+			p1.append((fx, fy, fyNeg))
+			# NOTE: ϕ(x,y) = (βx,y), and ϕ(jP) = jϕ(P).
+			p2.append((fv().mul2(fx, self.beta).normalize(), fy, fyNeg))
+		return PointTable(w, p1, p2)
 	def publicKey(self, k):
 		"""
 		Create a public key from integer private key k.
 		"""
 		x, y = self.scalarBaseMult(k)
 		return PublicKey(self, x, y)
+	def publicKeys(self, ks):
+		"""
+		Create public keys for a list of integer private keys. See
+		scalarBaseMults.
+		"""
+		return [PublicKey(self, x, y) for x, y in self.scalarBaseMults(ks)]
 	def parsePubKey(self, pubKeyStr):
 		"""
 		parsePubKey parses a public key for a koblitz curve from a bytestring into a
 		ecdsa.Publickey, verifying that it is valid. It supports compressed and
 		uncompressed signature formats, but not the hybrid format.
+
+		Decompressing a point requires a modular square root, so the points for
+		compressed keys are cached. See pubKeyCache.
 		"""
 		if len(pubKeyStr) == 0:
 			raise Exception("empty pubkey string")
 
+		cacheKey = None
+		if len(pubKeyStr) == PUBKEY_COMPRESSED_LEN:
+			cacheKey = pubKeyStr.bytes() if isinstance(pubKeyStr, ByteArray) else bytes(pubKeyStr)
+			point = self.pubKeyCache.get(cacheKey)
+			if point:
+				return PublicKey(self, *point)
+
 		fmt = pubKeyStr[0]
 		ybit = (fmt & 0x1) == 0x1
 		fmt &= 0xff^0x01
@@ -345,6 +554,8 @@ class KoblitzCurve:
 			raise Exception("pubkey Y parameter is >= to P")
 		if not self.isAffineOnCurve(x, y):
 			raise Exception("pubkey [%d, %d] isn't on secp256k1 curve" % (x, y))
+		if cacheKey:
+			self.pubKeyCache.put(cacheKey, (x, y))
 		return PublicKey(self, x, y)
 	def decompressPoint(self, x, ybit):
 		"""
@@ -360,7 +571,8 @@ class KoblitzCurve:
 		# This code used to do a full sqrt based on tonelli/shanks,
 		# but this was replaced by the algorithms referenced in
 		# https://bitcointalk.org/index.php?topic=162805.msg1712294#msg1712294
-		y = pow(x3, self.q, self.P) #(x3**self.q) % self.P
+		# fieldSqrt computes x3^q, q = (P+1)/4, with an addition chain.
+		y = fieldSqrt(x3)
 
 		if ybit == isEven(y):
 			y = self.P - y
@@ -477,9 +689,7 @@ class KoblitzCurve:
 
 		# Calculate X3, Y3, and Z3 according to the intermediate elements
 		# breakdown above.
-		fv = FieldVal
-		h, i, j, r, v = fv(), fv(), fv(), fv(), fv()
-		negJ, neg2V, negX3 = fv(), fv(), fv()
+		h, i, j, r, v, negJ, neg2V, negX3 = self.scratch.add[:8]
 		h.set(x1).negate(1).add(x2)                # H = X2-X1 (mag: 3)
 		i.squareVal(h).mulInt(4)                  # I = 4*H^2 (mag: 4)
 		j.mul2(h, i)                             # J = H*I (mag: 1)
@@ -544,9 +754,7 @@ class KoblitzCurve:
 
 		# Calculate X3, Y3, and Z3 according to the intermediate elements
 		# breakdown above.
-		fv = FieldVal
-		a, b, c, d, e, f = fv(), fv(), fv(), fv(), fv(), fv()
-		negX1, negY1, negE, negX3 = fv(), fv(), fv(), fv()
+		a, b, c, d, e, f, negX1, negY1, negE, negX3 = self.scratch.add[:10]
 		negX1.set(x1).negate(1)                # negX1 = -X1 (mag: 2)
 		negY1.set(y1).negate(1)                # negY1 = -Y1 (mag: 2)
 		a.set(negX1).add(x2)                  # A = X2-X1 (mag: 3)
@@ -595,8 +803,7 @@ class KoblitzCurve:
 		# point, the x and y values need to be converted to like terms.  Due to
 		# the assumption made for this function that the second point has a z
 		# value of 1 (z2=1), the first point is already "converted".
-		fv = FieldVal
-		z1z1, u2, s2 = fv(), fv(), fv()
+		z1z1, u2, s2, h, hh, i, j, r, rr, v, negX1, negY1, negX3 = self.scratch.add[:13]
 		x1.normalize()
 		y1.normalize()
 		z1z1.squareVal(z1)                        # Z1Z1 = Z1^2 (mag: 1)
@@ -619,8 +826,6 @@ class KoblitzCurve:
 
 		# Calculate X3, Y3, and Z3 according to the intermediate elements
 		# breakdown above.
-		h, hh, i, j, r, rr, v = fv(), fv(), fv(), fv(), fv(), fv(), fv()
-		negX1, negY1, negX3 = fv(), fv(), fv()
 		negX1.set(x1).negate(1)               # negX1 = -X1 (mag: 2)
 		h.add2(u2, negX1)                     # H = U2-X1 (mag: 3)
 		hh.squareVal(h)                       # HH = H^2 (mag: 1)
@@ -673,8 +878,7 @@ class KoblitzCurve:
 
 		# This results in a cost of 1 field multiplication, 5 field squarings,
 		# 6 field additions, and 5 integer multiplications.
-		fv = FieldVal
-		a, b, c, d, e, f = fv(), fv(), fv(), fv(), fv(), fv()
+		a, b, c, d, e, f = self.scratch.double
 		z3.set(y1).mulInt(2)                     # Z3 = 2*Y1 (mag: 2)
 		a.squareVal(x1)                          # A = X1^2 (mag: 1)
 		b.squareVal(y1)                          # B = Y1^2 (mag: 1)
@@ -746,8 +950,7 @@ class KoblitzCurve:
 		# infinity.  Since any number of Jacobian coordinates can represent the
 		# same affine point, the x and y values need to be converted to like
 		# terms.
-		fv = FieldVal
-		z1z1, z2z2, u1, u2, s1, s2 = fv(), fv(), fv(), fv(), fv(), fv()
+		z1z1, z2z2, u1, u2, s1, s2, h, i, j, r, rr, v, negU1, negS1, negX3 = self.scratch.add
 		z1z1.squareVal(z1)                        # Z1Z1 = Z1^2 (mag: 1)
 		z2z2.squareVal(z2)                        # Z2Z2 = Z2^2 (mag: 1)
 		u1.set(x1).mul(z2z2).normalize()          # U1 = X1*Z2Z2 (mag: 1)
@@ -771,8 +974,6 @@ class KoblitzCurve:
 
 		# Calculate X3, Y3, and Z3 according to the intermediate elements
 		# breakdown above.
-		h, i, j, r, rr, v = fv(), fv(), fv(), fv(), fv(), fv()
-		negU1, negS1, negX3 = fv(), fv(), fv()
 		negU1.set(u1).negate(1)               # negU1 = -U1 (mag: 2)
 		h.add2(u2, negU1)                     # H = U2-U1 (mag: 3)
 		i.set(h).mulInt(2).square()           # I = (2*H)^2 (mag: 2)
@@ -823,8 +1024,7 @@ class KoblitzCurve:
 		
 		# This results in a cost of 1 field multiplication, 5 field squarings,
 		# 6 field additions, and 5 integer multiplications.
-		fv = FieldVal
-		a, b, c, d, e, f = fv(), fv(), fv(), fv(), fv(), fv()
+		a, b, c, d, e, f = self.scratch.double
 		z3.mul2(y1, z1).mulInt(2)               # Z3 = 2*Y1*Z1 (mag: 2)
 		a.squareVal(x1)                         # A = X1^2 (mag: 1)
 		b.squareVal(y1)                         # B = Y1^2 (mag: 1)
@@ -866,6 +1066,50 @@ class KoblitzCurve:
 
 		# Convert the field values for the now affine point to big.Ints.
 		return ByteArray(x.bytes()).int(), ByteArray(y.bytes()).int()
+	def fieldJacobiansToBigAffine(self, points):
+		"""
+		fieldJacobiansToBigAffine converts a list of Jacobian points (x, y, z) as
+		field values to affine points as big integers. It uses Montgomery's
+		simultaneous inversion trick, so the whole list costs a single field
+		inversion plus three multiplications per point, rather than an
+		inversion per point as with fieldJacobianToBigAffine. The points are
+		normalized to z = 1 in place.
+		"""
+		# Accumulate the running products z0, z0*z1, ..., z0*...*zn. A point at
+		# infinity has no inverse, so it is left out of the products and
+		# converted to (0, 0), matching fieldJacobianToBigAffine.
+		products = []
+		acc = FieldVal().setInt(1)
+		for _, _, z in points:
+			if not z.normalize().isZero():
+				acc.mul(z)
+			products.append(FieldVal().set(acc))
+
+		# Invert the full product once, then walk backwards, peeling off one z
+		# at a time.
+		# inv = (z0*...*zi)^-1, so zi^-1 = inv * (z0*...*z(i-1)), and
+		# (z0*...*z(i-1))^-1 = inv * zi.
+		inv = acc.inverse()
+		zInv, tempZ = FieldVal(), FieldVal()
+		affine = [None]*len(points)
+		for i in range(len(points)-1, -1, -1):
+			x, y, z = points[i]
+			if z.isZero():
+				affine[i] = (0, 0)
+				continue
+			if i > 0:
+				zInv.mul2(inv, products[i-1]) # zInv = Z^-1
+			else:
+				zInv.set(inv)
+			inv.mul(z)
+			tempZ.squareVal(zInv)   # tempZ = Z^-2
+			x.mul(tempZ)            # X = X/Z^2 (mag: 1)
+			y.mul(tempZ.mul(zInv))  # Y = Y/Z^3 (mag: 1)
+			z.setInt(1)             # Z = 1 (mag: 1)
+			x.normalize()
+			y.normalize()
+			affine[i] = (ByteArray(x.bytes()).int(), ByteArray(y.bytes()).int())
+		return affine
 
 def fromHex(hx):
 	return int(hx, 16)
@@ -876,7 +1120,7 @@ class Curve(KoblitzCurve):
 		p = fromHex("FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F")
 		super().__init__(
 			P = p,
-			N = fromHex("FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141"),
+			N = scalar.order,
 			B = fromHex("0000000000000000000000000000000000000000000000000000000000000007"),
 			Gx = fromHex("79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798"),
 			Gy = fromHex("483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8"),
@@ -886,18 +1130,13 @@ class Curve(KoblitzCurve):
 			# Provided for convenience since this gets computed repeatedly.
 			# lambda is a reserved keyword in Python, so misspelling on purpose.
 			byteSize = bitSize / 8,
-			# Next 6 constants are from Hal Finney's bitcointalk.org post:
-			# https://bitcointalk.org/index.php?topic=3238.msg45565#msg45565
-			# May he rest in peace.
-			#
-			# They have also been independently derived from the code in the
-			# EndomorphismVectors function in gensecp256k1.go.
-			lamda = fromHex("5363AD4CC05C30E0A5261C028812645A122E22EA20816678DF02967C1B23BD72"),
+			# The endomorphism constants. See the scalar module.
+			lamda = scalar.lamda,
 			beta = FieldVal.fromHex("7AE96A2B657C07106E64479EAC3434E99CF0497512F58995C1396C28719501EE"),
-			a1 = fromHex("3086D221A7D46BCDE86C90E49284EB15"),
-			b1 = fromHex("-E4437ED6010E88286F547FA90ABFE4C3"),
-			a2 = fromHex("114CA50F7A8E2F3F657C1108D9D44CFD8"),
-			b2 = fromHex("3086D221A7D46BCDE86C90E49284EB15"),
+			a1 = scalar.a1,
+			b1 = scalar.b1,
+			a2 = scalar.a2,
+			b2 = scalar.b2,
 		)
 	def bigAffineToField(self, x, y):
 		"""
@@ -1253,6 +1492,115 @@ class TestCurve(unittest.TestCase):
 			px, py = curve.scalarBaseMult(fromHex(k))
 			self.assertEqual(px, fromHex(x))
 			self.assertEqual(py, fromHex(y))
+	def test_batch_affine(self):
+		"""
+		Batched affine conversion should match the one-at-a-time conversion,
+		including for the point at infinity.
+		"""
+		ks = [fromHex("AA5E28D6A97A2479A65527F7290311A3624D4CC0FA1578598EE3C2613BF99522"), 1, 0, 2, curve.N - 1, 12345]
+		expected = [curve.scalarBaseMult(k) for k in ks]
+		self.assertEqual(expected[2], (0, 0))
+		self.assertEqual(curve.scalarBaseMults(ks), expected)
+		self.assertEqual([(pub.x, pub.y) for pub in curve.publicKeys(ks)], expected)
+		self.assertEqual(curve.scalarBaseMults([]), [])
+	def test_wnaf(self):
+		for k in (0, 1, -1, 7, 0xff, -0xbeef, curve.N - 1, fromHex("AA5E28D6A97A2479A65527F7290311A3624D4CC0FA1578598EE3C2613BF99522")):
+			for w in (2, 4, 5, 6):
+				digits = wNAF(k, w)
+				self.assertEqual(sum(d << i for i, d in enumerate(digits)), k)
+				nonZero = [i for i, d in enumerate(digits) if d != 0]
+				for d in digits:
+					self.assertTrue(d == 0 or (d % 2 == 1 and abs(d) < 1 << (w-1)))
+				for a, b in zip(nonZero, nonZero[1:]):
+					self.assertGreaterEqual(b - a, w)
+	def test_split_k(self):
+		for k in (1, 2, curve.N - 1, curve.lamda, fromHex("6461E6DF0FE7DFD05329F41BF771B86578143D4DD1F7866FB4CA7E97C5FA945D")):
+			k1, k2 = curve.splitK(k)
+			self.assertEqual((k1 + k2*curve.lamda) % curve.N, k)
+			self.assertLess(abs(k1).bit_length(), 130)
+			self.assertLess(abs(k2).bit_length(), 130)
+	def test_scalar_mult(self):
+		"""
+		Multiplying the base point should agree with scalarBaseMult, with and
+		without a precomputed table.
+		"""
+		ks = [
+			1, 2, 3, curve.N - 1, curve.N + 5, curve.lamda,
+			fromHex("AA5E28D6A97A2479A65527F7290311A3624D4CC0FA1578598EE3C2613BF99522"),
+			fromHex("1B22644A7BE026548810C378D0B2994EEFA6D2B9881803CB02CEFF865287D1B9"),
+		]
+		pub = PublicKey(curve, curve.Gx, curve.Gy)
+		for k in ks:
+			expected = curve.scalarBaseMult(k)
+			self.assertEqual(curve.scalarMult(curve.Gx, curve.Gy, k), expected)
+			self.assertEqual(curve.scalarMult(curve.Gx, curve.Gy, k, table=pub.pointTable()), expected)
+			table = curve.pointTable(curve.Gx, curve.Gy, w=3)
+			self.assertEqual(curve.scalarMult(curve.Gx, curve.Gy, k, table=table), expected)
+		self.assertEqual(curve.scalarMult(curve.Gx, curve.Gy, curve.N), (0, 0))
+		# A point other than the generator.
+		px, py = curve.scalarBaseMult(ks[6])
+		self.assertEqual(curve.scalarMult(px, py, ks[7]), curve.scalarBaseMult(ks[6] * ks[7]))
+	def test_double_scalar_mult(self):
+		ks = [
+			0, 1, 2, curve.N - 1, curve.lamda,
+			fromHex("AA5E28D6A97A2479A65527F7290311A3624D4CC0FA1578598EE3C2613BF99522"),
+			fromHex("1B22644A7BE026548810C378D0B2994EEFA6D2B9881803CB02CEFF865287D1B9"),
+		]
+		priv = fromHex("376A3A2CDCD12581EFFF13EE4AD44C4044B8A0524C42422A7E1E181E4DEECCEC")
+		pub = curve.publicKey(priv)
+		for u1 in ks:
+			for u2 in ks:
+				expected = curve.scalarBaseMult(u1 + u2*priv)
+				self.assertEqual(curve.doubleScalarMult(u1, pub, u2), expected)
+		# u1*G + u2*P is the point at infinity when u1 = -u2*priv.
+		self.assertEqual(curve.doubleScalarMult(curve.N - priv, pub, 1), (0, 0))
+	def test_scratch_registers(self):
+		self.assertFalse(hasattr(FieldVal(), "__dict__"))
+		ks = [fromHex("AA5E28D6A97A2479A65527F7290311A3624D4CC0FA1578598EE3C2613BF99522") + i for i in range(8)]
+		expected = [curve.scalarBaseMult(k) for k in ks]
+		# Each thread gets its own registers, so concurrent multiplications
+		# can't clobber each other's temporaries.
+		results = [None]*len(ks)
+		def run(i):
+			results[i] = curve.scalarBaseMult(ks[i])
+		threads = [threading.Thread(target=run, args=(i,)) for i in range(len(ks))]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(results, expected)
+	def test_pub_key_cache(self):
+		cache = curve.pubKeyCache
+		privs = [fromHex("376A3A2CDCD12581EFFF13EE4AD44C4044B8A0524C42422A7E1E181E4DEECCEC") + i for i in range(3)]
+		pubs = [curve.publicKey(k) for k in privs]
+		encoded = [pub.serializeCompressed() for pub in pubs]
+		size = cache.size
+		try:
+			cache.clear()
+			cache.size = 2
+			for pub, b in zip(pubs, encoded):
+				parsed = curve.parsePubKey(b)
+				self.assertEqual((parsed.x, parsed.y), (pub.x, pub.y))
+			self.assertEqual(cache.info(), {"hits": 0, "misses": 3, "entries": 2, "size": 2})
+			# A hit returns the same point, from bytes or ByteArray.
+			parsed = curve.parsePubKey(encoded[2].bytes())
+			self.assertEqual((parsed.x, parsed.y), (pubs[2].x, pubs[2].y))
+			self.assertEqual(cache.hits, 1)
+			# The first key was evicted.
+			curve.parsePubKey(encoded[0])
+			self.assertEqual(cache.misses, 4)
+			# Uncompressed keys bypass the cache.
+			curve.parsePubKey(pubs[1].serializeUncompressed())
+			self.assertEqual((cache.hits, cache.misses), (1, 4))
+			# Invalid keys aren't cached.
+			bad = ByteArray(encoded[0])
+			bad[32] ^= 0x01
+			self.assertRaises(Exception, curve.parsePubKey, bad)
+			self.assertRaises(Exception, curve.parsePubKey, bad)
+			self.assertEqual(cache.misses, 6)
+		finally:
+			cache.size = size
+			cache.clear()
 	def test_add_affine(self):
 		""" TestAddAffine tests addition of points in affine coordinates."""
 		tests = [
@@ -5,9 +5,13 @@ See LICENSE for details
 """
 from base64 import b64decode
 from zlib import decompress as zdecompress
+import hashlib
+import mmap
+import os
+import struct
 import unittest
+from tempfile import TemporaryDirectory
 from tinydecred.crypto.bytearray import ByteArray
-from tinydecred.crypto.secp256k1.bytepoints import secp256k1BytePoints
 
 # Constants used to make the code more readable.
 twoBitsMask   = 0x03
@@ -37,6 +41,9 @@ fieldMSBBits = 256 - (fieldBase * (fieldWords - 1))
 # needed to represent the value.
 fieldMSBMask = (1 << fieldMSBBits) - 1
 
+# fieldPrime is the secp256k1 prime, 2^256 - 2^32 - 977.
+fieldPrime = 0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffefffffc2f
+
 # fieldPrimeWordZero is word zero of the secp256k1 prime in the
 # internal field representation.  It is used during negation.
 fieldPrimeWordZero = 0x3fffc2f
@@ -45,6 +52,9 @@ fieldPrimeWordZero = 0x3fffc2f
 # internal field representation.  It is used during negation.
 fieldPrimeWordOne = 0x3ffffbf
 
+# zeroWords is copied into the words of a field value to clear it.
+zeroWords = (0,)*fieldWords
+
 """
 fieldVal implements optimized fixed-precision arithmetic over the
 secp256k1 finite field.  This means all arithmetic is performed modulo
@@ -79,10 +89,14 @@ doing sum(n[i] * 2^(26i)) like so:
 """
 
 class FieldVal:
+	# The limbs are a plain list that every operation updates in place, so a
+	# FieldVal holds the same list for its whole life. __slots__ drops the
+	# per-instance dict.
+	__slots__ = ("n",)
 	def __init__(self):
-		self.zero()
+		self.n = [0]*fieldWords
 	def zero(self):
-		self.n = [0]*10
+		self.n[:] = zeroWords
 	@staticmethod
 	def fromHex(hexString): # string) *fieldVal {
 		"""
@@ -109,7 +123,8 @@ class FieldVal:
 	def equals(self, f):
 		return all((x == y for x, y in zip(f.n, self.n)))
 	def setBytes(self, b):
-		b = ByteArray(b, length=32, copy=False)
+		if not isinstance(b, bytes) or len(b) != 32:
+			b = ByteArray(b, length=32, copy=False)
 		self.n[0] = b[31] | b[30]<<8 | b[29]<<16 |	(b[28]&twoBitsMask)<<24
 		self.n[1] = b[28]>>2 | b[27]<<6 | b[26]<<14 | (b[25]&fourBitsMask)<<22
 		self.n[2] = b[25]>>4 | b[24]<<4 | b[23]<<12 | (b[22]&sixBitsMask)<<20
@@ -120,10 +135,11 @@ class FieldVal:
 		self.n[7] = b[9]>>6 | b[8]<<2 | b[7]<<10 |	b[6]<<18
 		self.n[8] = b[5] | b[4]<<8 | b[3]<<16 | (b[2]&twoBitsMask)<<24
 		self.n[9] = b[2]>>2 | b[1]<<6 | b[0]<<14
+		return self
 	def isZero(self):
 		return all((x == 0 for x in self.n))
 	def set(self, f):
-		self.n = [x for x in f.n]
+		self.n[:] = f.n
 		return self
 	def normalize(self): # *fieldVal {
 		"""
@@ -894,48 +910,230 @@ class FieldVal:
 		f.square().square().square().square().square() # f = a^(2^256 - 4294968320)
 		return f.mul(a45)                              # f = a^(2^256 - 4294968275) = a^(p-2)
 
-BytePoints = []
-
-def loadS256BytePoints():
+def squareN(a, n):
+	"""
+	a^(2^n) mod p by n repeated squarings.
+	"""
+	for _ in range(n):
+		a = a * a % fieldPrime
+	return a
+
+def sqrt(a):
+	"""
+	sqrt computes a candidate square root of the integer a modulo the secp256k1
+	prime. Since p = 3 mod 4, the candidate is a^((p+1)/4), which is a square
+	root of a if one exists. The caller must check the result when a is not
+	known to be a quadratic residue.
+
+	(p+1)/4 is 2^254 - 2^30 - 244, which in binary is 223 ones, a zero, 22 ones,
+	four zeros, two ones and two zeros. Building those runs of ones from smaller
+	runs takes 253 squarings and 13 multiplications, fewer multiplications than
+	the generic windowed exponentiation done by pow.
+
+	Args:
+		a (int): The integer to find the square root of.
+
+	Returns:
+		int: The candidate square root, in [0, p).
+	"""
+	p = fieldPrime
+	a %= p
+	# xN = a^(2^N - 1), a run of N ones.
+	x2 = squareN(a, 1) * a % p
+	x3 = squareN(x2, 1) * a % p
+	x6 = squareN(x3, 3) * x3 % p
+	x9 = squareN(x6, 3) * x3 % p
+	x11 = squareN(x9, 2) * x2 % p
+	x22 = squareN(x11, 11) * x11 % p
+	x44 = squareN(x22, 22) * x22 % p
+	x88 = squareN(x44, 44) * x44 % p
+	x176 = squareN(x88, 88) * x88 % p
+	x220 = squareN(x176, 44) * x44 % p
+	x223 = squareN(x220, 3) * x3 % p
+	# 223 ones, a zero and 22 ones.
+	r = squareN(x223, 23) * x22 % p
+	# Four zeros and two ones.
+	r = squareN(r, 6) * x2 % p
+	# Two zeros.
+	return squareN(r, 2)
+
+# Geometry of the precomputed byte points table. For each of the 32 bytes of a
+# scalar, the table holds the Jacobian point for each of the 256 byte values.
+bytePointRows = 32
+bytePointCols = 256
+coordinateSize = 32
+bytePointSize = 3 * coordinateSize
+bytePointsTableSize = bytePointRows * bytePointCols * bytePointSize
+
+def decodeS256BytePoints():
+	"""
+	Decode the compressed table of pre-computed byte points from the bytepoints
+	module. The dcrd encoding stores each coordinate as 10 little-endian 32-bit
+	field words. The coordinates are returned as 32-byte big-endian values,
+	which any field implementation can read with setBytes.
+
+	Returns:
+		bytes: The table, row by row, with the x, y and z coordinates of each
+			point concatenated.
+	"""
+	# Importing the encoded table is itself costly, so defer it until the
+	# table is actually needed.
+	from tinydecred.crypto.secp256k1.bytepoints import secp256k1BytePoints
 	if len(secp256k1BytePoints) == 0:
 		raise Exception("basepoint string empty")
 
 	# Decompress the pre-computed table used to accelerate scalar base
 	# multiplication.
-	compressed = b64decode(secp256k1BytePoints)
-	serialized = zdecompress(compressed)
-
-	# Deserialize the precomputed byte points and set the curve to them.
-	offset = 0
-	# var bytePoints [32][256][3]fieldVal
-	ifunc = lambda b: int.from_bytes(b, byteorder="big")
-	global BytePoints
-	BytePoints = []
-	for byteNum in range(32):
-		row = []
-		BytePoints.append(row)
-		for i in range(256):
-			col = []
-			row.append(col)
-			px = FieldVal()
-			py = FieldVal()
-			pz = FieldVal()
-			col.append(px)
-			col.append(py)
-			col.append(pz)
-			for j in range(10):
-				px.n[j] = ifunc(serialized[offset+3:offset-1:-1])
-				offset += 4
-			for j in range(10):
-				py.n[j] = ifunc(serialized[offset+3:offset-1:-1])
-				offset += 4
-			for j in range(10):
-				pz.n[j] = ifunc(serialized[offset+3:offset-1:-1])
-				offset += 4
-
-loadS256BytePoints()
+	serialized = zdecompress(b64decode(secp256k1BytePoints))
+	coords = bytePointRows * bytePointCols * 3
+	words = struct.unpack("<%dI" % (coords * fieldWords), serialized)
+	out = bytearray(bytePointsTableSize)
+	for i in range(coords):
+		v = 0
+		for j in range(fieldWords-1, -1, -1):
+			v = (v << fieldBase) + words[i*fieldWords+j]
+		out[i*coordinateSize:(i+1)*coordinateSize] = (v % fieldPrime).to_bytes(coordinateSize, byteorder="big")
+	return bytes(out)
+
+class BytePointTable:
+	"""
+	BytePointTable is the table of pre-computed points used to accelerate
+	scalar base multiplication. Nothing is decoded until the first lookup.
+	The table is then held as a single flat buffer of big-endian coordinates,
+	and field values are only created for the points that are looked up.
+
+	If a cache path is set, the decoded table is written to that file once and
+	memory-mapped on later loads, so the decoding is skipped and the pages are
+	shared between processes. The file starts with a SHA-256 digest of the
+	table, and a file that doesn't match is regenerated.
+	"""
+	def __init__(self, cachePath=None):
+		"""
+		Args:
+			cachePath (str): Optional. A path for the binary cache file.
+		"""
+		self.cachePath = cachePath
+		self.buf = None
+	def __len__(self):
+		return bytePointRows
+	def setCachePath(self, cachePath):
+		"""
+		Set the cache file path. Has no effect if the table is already loaded.
+		"""
+		self.cachePath = cachePath
+	def loaded(self):
+		return self.buf is not None
+	def load(self):
+		"""
+		Load the table, from the cache file if possible.
+		"""
+		if self.buf is not None:
+			return
+		if self.cachePath:
+			self.buf = self.mapCache()
+			if self.buf is not None:
+				return
+			writeBytePointsCache(self.cachePath, decodeS256BytePoints())
+			self.buf = self.mapCache()
+			if self.buf is not None:
+				return
+		self.buf = decodeS256BytePoints()
+	def mapCache(self):
+		"""
+		Memory-map the cache file, returning None if it is missing or invalid.
+		"""
+		digestSize = hashlib.sha256().digest_size
+		try:
+			with open(self.cachePath, "rb") as f:
+				mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except (OSError, ValueError):
+			return None
+		if len(mapped) != digestSize + bytePointsTableSize:
+			mapped.close()
+			return None
+		table = memoryview(mapped)[digestSize:]
+		if hashlib.sha256(table).digest() != mapped[:digestSize]:
+			table.release()
+			mapped.close()
+			return None
+		return table
+	def coords(self, byteNum, byteVal):
+		"""
+		The coordinates of the point for byte value byteVal at byte position
+		byteNum, as three 32-byte big-endian values.
+
+		Returns:
+			tuple(bytes): The x, y and z coordinates.
+		"""
+		if self.buf is None:
+			self.load()
+		start = (byteNum*bytePointCols + byteVal) * bytePointSize
+		buf = self.buf
+		return (
+			bytes(buf[start:start+coordinateSize]),
+			bytes(buf[start+coordinateSize:start+2*coordinateSize]),
+			bytes(buf[start+2*coordinateSize:start+bytePointSize]),
+		)
+
+def writeBytePointsCache(path, table):
+	"""
+	Write the decoded byte points table, prefixed with its SHA-256 digest, to
+	the file at path. The file is written under a temporary name and then
+	renamed, so concurrent readers never see a partial file.
+	"""
+	tmpPath = "%s.%d.tmp" % (path, os.getpid())
+	with open(tmpPath, "wb") as f:
+		f.write(hashlib.sha256(table).digest())
+		f.write(table)
+	os.replace(tmpPath, path)
+
+# The shared table. Set TINYDECRED_BYTEPOINTS_CACHE to a file path to use a
+# memory-mapped cache.
+BytePoints = BytePointTable(os.environ.get("TINYDECRED_BYTEPOINTS_CACHE"))
+
+class TestBytePoints(unittest.TestCase):
+	def test_table(self):
+		"""
+		The points in the table are (byteVal * 256^(31-byteNum)) * G.
+		"""
+		gx = 0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798
+		table = BytePointTable()
+		self.assertFalse(table.loaded())
+		x, y, z = (int.from_bytes(c, byteorder="big") for c in table.coords(bytePointRows-1, 1))
+		self.assertTrue(table.loaded())
+		self.assertEqual(x * pow(z, fieldPrime-3, fieldPrime) % fieldPrime, gx)
+		self.assertEqual(table.coords(0, 0), (bytes(32),)*3)
+	def test_cache(self):
+		with TemporaryDirectory() as tmpDir:
+			path = os.path.join(tmpDir, "bytepoints.bin")
+			table = BytePointTable(path)
+			table.load()
+			self.assertTrue(os.path.isfile(path))
+			self.assertEqual(os.path.getsize(path), 32 + bytePointsTableSize)
+			expected = [table.coords(i, 255-i) for i in range(bytePointRows)]
+
+			# A second table maps the existing file.
+			mapped = BytePointTable(path)
+			self.assertIsNotNone(mapped.mapCache())
+			mapped.load()
+			self.assertEqual([mapped.coords(i, 255-i) for i in range(bytePointRows)], expected)
+
+			# A corrupted file is rejected and regenerated.
+			with open(path, "r+b") as f:
+				f.seek(1000)
+				f.write(b"\x01\x02\x03")
+			self.assertIsNone(BytePointTable(path).mapCache())
+			regenerated = BytePointTable(path)
+			regenerated.load()
+			self.assertEqual([regenerated.coords(i, 255-i) for i in range(bytePointRows)], expected)
+			self.assertIsNotNone(BytePointTable(path).mapCache())
 
 class TestField(unittest.TestCase):
+	# The field implementation under test. Alternative backends reuse these
+	# vectors by overriding fieldVal and assertLimbs.
+	fieldVal = FieldVal
+	def assertLimbs(self, limbs, f, msg=None):
+		self.assertListEqual(limbs, f.n, msg=msg)
 	def test_set_int(self):
 		"""
 		TestSetInt ensures that setting a field value to various native integers
@@ -949,18 +1147,18 @@ class TestField(unittest.TestCase):
 		]
 
 		for i, v in tests:
-			f = FieldVal()
+			f = self.fieldVal()
 			f.setInt(i)
-			self.assertListEqual(v, f.n)
+			self.assertLimbs(v, f)
 	def test_zero(self):
 		"""TestZero ensures that zeroing a field value zero works as expected."""
-		f = FieldVal()
+		f = self.fieldVal()
 		f.setInt(2)
 		f.zero()
 		self.assertTrue(all((x == 0 for x in f.n)))
 	def test_is_zero(self):
 		"""TestIsZero ensures that checking if a field IsZero works as expected."""
-		f = FieldVal()
+		f = self.fieldVal()
 		self.assertTrue(f.isZero())
 
 		f.setInt(1)
@@ -1123,10 +1321,10 @@ class TestField(unittest.TestCase):
 		]
 
 		for i, (raw, normalized) in enumerate(tests):
-			f = FieldVal()
+			f = self.fieldVal()
 			f.n = raw
 			f.normalize()
-			self.assertListEqual(normalized, f.n, msg="test %i" % i)
+			self.assertLimbs(normalized, f, msg="test %i" % i)
 	def test_equals(self):
 		"""
 		TestEquals ensures that checking two field values for equality via Equals
@@ -1146,8 +1344,8 @@ class TestField(unittest.TestCase):
 			("1", "fffffffffffffffffffffffffffffffffffffffffffffffffffffffefffffc30", True),
 		]
 		for i, (a, b, eq) in enumerate(tests):
-			fa = FieldVal.fromHex(a).normalize()
-			fb = FieldVal.fromHex(b).normalize()
+			fa = self.fieldVal.fromHex(a).normalize()
+			fb = self.fieldVal.fromHex(b).normalize()
 			self.assertEqual(fa.equals(fb), eq, msg="test %i" % i)
 	def test_negate(self):
 		"""TestNegate ensures that negating field values via Negate works as expected."""
@@ -1182,8 +1380,8 @@ class TestField(unittest.TestCase):
 		]
 
 		for i, (a, b) in enumerate(tests):
-			fa = FieldVal.fromHex(a).normalize().negate(1).normalize()
-			fb = FieldVal.fromHex(b).normalize()
+			fa = self.fieldVal.fromHex(a).normalize().negate(1).normalize()
+			fb = self.fieldVal.fromHex(b).normalize()
 			self.assertTrue(fa.equals(fb), msg="test %i" % i)
 	def test_add(self):
 		""" TestAdd ensures that adding two field values together via Add works as expected."""
@@ -1219,9 +1417,9 @@ class TestField(unittest.TestCase):
 		]
 
 		for i, (a, b, res) in enumerate(tests):
-			fa = FieldVal.fromHex(a).normalize()
-			fb = FieldVal.fromHex(b).normalize()
-			fres = FieldVal.fromHex(res).normalize()
+			fa = self.fieldVal.fromHex(a).normalize()
+			fb = self.fieldVal.fromHex(b).normalize()
+			fres = self.fieldVal.fromHex(res).normalize()
 			result = fa.add(fb).normalize()
 			self.assertTrue(fres.equals(result), msg="test %i" % i)
 	def test_add2(self):
@@ -1260,9 +1458,9 @@ class TestField(unittest.TestCase):
 		]
 
 		for i, (a, b, res) in enumerate(tests):
-			fa = FieldVal.fromHex(a).normalize()
-			fb = FieldVal.fromHex(b).normalize()
-			fres = FieldVal.fromHex(res).normalize()
+			fa = self.fieldVal.fromHex(a).normalize()
+			fb = self.fieldVal.fromHex(b).normalize()
+			fres = self.fieldVal.fromHex(res).normalize()
 			result = fa.add2(fa, fb).normalize()
 			self.assertTrue(fres.equals(result), msg="test %i" % i)
 	def test_mul(self):
@@ -1316,9 +1514,9 @@ class TestField(unittest.TestCase):
 		]
 
 		for i, (a, b, res) in enumerate(tests):
-			fa = FieldVal.fromHex(a).normalize()
-			fb = FieldVal.fromHex(b).normalize()
-			fres = FieldVal.fromHex(res).normalize()
+			fa = self.fieldVal.fromHex(a).normalize()
+			fb = self.fieldVal.fromHex(b).normalize()
+			fres = self.fieldVal.fromHex(res).normalize()
 			result = fa.mul(fb).normalize()
 			self.assertTrue(fres.equals(result), msg="test %i" % i)
 	def test_square(self):
@@ -1352,8 +1550,8 @@ class TestField(unittest.TestCase):
 		]
 
 		for i, (a, res) in enumerate(tests):
-			f = FieldVal.fromHex(a).normalize().square().normalize()
-			expected = FieldVal.fromHex(res).normalize()
+			f = self.fieldVal.fromHex(a).normalize().square().normalize()
+			expected = self.fieldVal.fromHex(res).normalize()
 			self.assertTrue(f.equals(expected), msg="test %i" % i)
 	def test_string(self):
 		""" TestStringer ensures the stringer returns the appropriate hex string."""
@@ -1426,7 +1624,7 @@ class TestField(unittest.TestCase):
 		]
 
 		for i, (a, res) in enumerate(tests):
-			f = FieldVal.fromHex(a)
+			f = self.fieldVal.fromHex(a)
 			self.assertEqual(res, f.string(), msg="test %i" % i)
 	def test_inverse(self):
 		"""
@@ -1468,7 +1666,15 @@ class TestField(unittest.TestCase):
 		]
 
 		for i, (a, e) in enumerate(tests):
-			f = FieldVal.fromHex(a).normalize()
-			expected = FieldVal.fromHex(e).normalize()
+			f = self.fieldVal.fromHex(a).normalize()
+			expected = self.fieldVal.fromHex(e).normalize()
 			result = f.inverse().normalize()
-			self.assertTrue(result.equals(expected))
\ No newline at end of file
+			self.assertTrue(result.equals(expected))
+	def test_sqrt(self):
+		q = (fieldPrime + 1) // 4
+		for a in (0, 1, 4, 7, fieldPrime - 1, fieldPrime + 9, 0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798**3 + 7):
+			self.assertEqual(sqrt(a), pow(a, q, fieldPrime))
+		# Squares have a root.
+		for r in (2, 3, 0xdeadbeef, fieldPrime - 5):
+			root = sqrt(r*r)
+			self.assertEqual(root*root % fieldPrime, r*r % fieldPrime)
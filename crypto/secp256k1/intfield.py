@@ -0,0 +1,162 @@
+"""
+Copyright (c) 2019, Brian Stafford
+Copyright (c) 2019, The Decred developers
+See LICENSE for details
+
+module intfield
+	A drop-in alternative to field.FieldVal that stores each field element as a
+	single native Python integer rather than ten 26-bit words. CPython's
+	arbitrary-precision integers perform a full 256-bit multiplication and
+	reduction in one C-level operation, which is far cheaper than the hundreds
+	of interpreted word operations needed by the dcrd port. The curve module
+	selects between the two implementations at import time.
+"""
+import unittest
+from tinydecred.crypto.bytearray import ByteArray
+from tinydecred.crypto.secp256k1 import field
+
+fieldPrime = field.fieldPrime
+
+class IntFieldVal:
+	"""
+	IntFieldVal implements the FieldVal API over the secp256k1 finite field
+	using a native integer. Like FieldVal, additions, negations and small
+	integer multiplications are allowed to leave the value un-reduced, and
+	normalize must be called before comparing values or reading the bytes.
+	Multiplication and squaring always reduce.
+	"""
+	__slots__ = ("v",)
+	def __init__(self):
+		self.v = 0
+	def zero(self):
+		self.v = 0
+	@property
+	def n(self):
+		"""
+		The value in the 10x26-bit word representation used by FieldVal.
+		Provided for interoperability with code and tests that work with the
+		words directly. Values wider than 256 bits are left in the most
+		significant word, mirroring FieldVal's overflow bits.
+		"""
+		v = self.v
+		words = []
+		for _ in range(field.fieldWords - 1):
+			words.append(v & field.fieldBaseMask)
+			v >>= field.fieldBase
+		words.append(v)
+		return words
+	@n.setter
+	def n(self, words):
+		v = 0
+		for i, word in enumerate(words):
+			v += word << (field.fieldBase*i)
+		self.v = v
+	@staticmethod
+	def fromHex(hexString):
+		"""
+		Decode the big-endian hex string into a field value. Only the first
+		32 bytes are used.
+		"""
+		if len(hexString) % 2 != 0:
+			hexString = "0" + hexString
+		f = IntFieldVal()
+		f.setBytes(ByteArray(hexString))
+		return f
+	@staticmethod
+	def fromInt(i):
+		f = IntFieldVal()
+		return f.setInt(i)
+	def setInt(self, i):
+		self.v = i
+		return self
+	def equals(self, f):
+		return self.v == f.v
+	def setBytes(self, b):
+		"""
+		Set the value from a big-endian byte-like value of at most 32 bytes.
+		"""
+		if isinstance(b, ByteArray):
+			b = b.b
+		self.v = int.from_bytes(b, byteorder="big")
+		return self
+	def isZero(self):
+		return self.v == 0
+	def set(self, f):
+		self.v = f.v
+		return self
+	def normalize(self):
+		"""
+		Reduce the value modulo the secp256k1 prime.
+		"""
+		self.v %= fieldPrime
+		return self
+	def negate(self, magnitude):
+		"""
+		Negate the field value. The magnitude is accepted for compatibility with
+		FieldVal, but is not needed since the result is always reduced.
+		"""
+		return self.negateVal(self, magnitude)
+	def negateVal(self, val, magnitude):
+		"""
+		Negate the passed value and store the result in f.
+		"""
+		self.v = -val.v % fieldPrime
+		return self
+	def add(self, val):
+		self.v += val.v
+		return self
+	def add2(self, val, val2):
+		self.v = val.v + val2.v
+		return self
+	def mulInt(self, val):
+		self.v *= val
+		return self
+	def square(self):
+		self.v = self.v * self.v % fieldPrime
+		return self
+	def squareVal(self, val):
+		self.v = val.v * val.v % fieldPrime
+		return self
+	def mul(self, f):
+		self.v = self.v * f.v % fieldPrime
+		return self
+	def mul2(self, val, val2):
+		self.v = val.v * val2.v % fieldPrime
+		return self
+	def putBytes(self, b):
+		"""
+		Unpack the field value into the passed 32-byte buffer, big-endian. The
+		field value must be normalized.
+		"""
+		raw = self.v.to_bytes(32, byteorder="big")
+		if isinstance(b, ByteArray):
+			b = b.b
+		b[:32] = raw
+	def bytes(self):
+		"""
+		The field value as a 32-byte big-endian ByteArray. The field value must
+		be normalized.
+		"""
+		return ByteArray(self.v.to_bytes(32, byteorder="big"))
+	def string(self):
+		"""String returns the field value as a human-readable hex string."""
+		return (self.v % fieldPrime).to_bytes(32, byteorder="big").hex()
+	def inverse(self):
+		"""
+		Inverse finds the modular multiplicative inverse of the field value via
+		Fermat's little theorem, a^(p-2) = a^-1 (mod p). The existing field value
+		is modified.
+		"""
+		self.v = pow(self.v, fieldPrime - 2, fieldPrime)
+		return self
+
+class TestIntField(field.TestField):
+	fieldVal = IntFieldVal
+	def assertLimbs(self, limbs, f, msg=None):
+		"""
+		IntFieldVal has no notion of word overflow, so compare the represented
+		values instead of the words themselves.
+		"""
+		expected = IntFieldVal()
+		expected.n = limbs
+		self.assertEqual(expected.v, f.v, msg=msg)
@@ -0,0 +1,182 @@
+"""
+Copyright (c) 2019, Brian Stafford
+Copyright (c) 2019, The Decred developers
+See LICENSE for details
+
+module scalar
+	Arithmetic modulo the secp256k1 group order, N. Private keys, nonces,
+	signature components and the scalars passed to the curve's point
+	multiplication routines all live in this field, where field.py covers the
+	coordinates, which live modulo the field prime P.
+"""
+import sys
+import unittest
+
+# order is the order of the secp256k1 group, N.
+order = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+
+# halfOrder is N/2, rounded down. Canonical (low-S) signatures have s <= halfOrder.
+halfOrder = order >> 1
+
+# lamda is the eigenvalue of the secp256k1 endomorphism ϕ(x, y) = (βx, y), so
+# that ϕ(P) = lamda*P. lambda is a reserved keyword in Python, so misspelling
+# on purpose.
+lamda = 0x5363AD4CC05C30E0A5261C028812645A122E22EA20816678DF02967C1B23BD72
+
+# The next 4 constants are the basis vectors used to decompose a scalar for
+# the endomorphism. They are from Hal Finney's bitcointalk.org post:
+# https://bitcointalk.org/index.php?topic=3238.msg45565#msg45565
+# May he rest in peace.
+#
+# They have also been independently derived from the code in the
+# EndomorphismVectors function in gensecp256k1.go.
+a1 = 0x3086D221A7D46BCDE86C90E49284EB15
+b1 = -0xE4437ED6010E88286F547FA90ABFE4C3
+a2 = 0x114CA50F7A8E2F3F657C1108D9D44CFD8
+b2 = 0x3086D221A7D46BCDE86C90E49284EB15
+
+def reduce(k):
+	"""
+	k modulo N.
+	"""
+	return k % order
+
+def isValid(k):
+	"""
+	Whether k is a valid private key or signature component, 0 < k < N.
+	"""
+	return 0 < k < order
+
+def add(a, b):
+	return (a + b) % order
+
+def mul(a, b):
+	return (a * b) % order
+
+def negate(k):
+	return -k % order
+
+def egcdInverse(a, m):
+	"""
+	The modular inverse of a modulo m by the iterative extended Euclidean
+	algorithm, for Python versions where pow can't compute inverses.
+
+	Args:
+		a (int): integer
+		m (int): modulus
+	"""
+	oldR, r = a % m, m
+	oldS, s = 1, 0
+	while r:
+		q = oldR // r
+		oldR, r = r, oldR - q*r
+		oldS, s = s, oldS - q*s
+	if oldR != 1:
+		raise Exception("modular inverse does not exist")
+	return oldS % m
+
+if sys.version_info >= (3, 8):
+	def modInverse(a, m):
+		"""
+		The modular inverse of a modulo m.
+
+		Args:
+			a (int): integer
+			m (int): modulus
+		"""
+		try:
+			return pow(a, -1, m)
+		except ValueError:
+			raise Exception("modular inverse does not exist")
+else:
+	modInverse = egcdInverse
+
+def inverse(k):
+	"""
+	The inverse of k modulo N. An Exception is raised if k is 0 mod N.
+	"""
+	return modInverse(k, order)
+
+def batchInverse(values, m=order):
+	"""
+	Modular inverses of all of the values, computed with a single inversion
+	using Montgomery's trick. Each additional value costs three modular
+	multiplications.
+
+	Args:
+		values (list(int)): The integers to invert. None may be zero mod m.
+		m (int): Optional. The modulus. Default N.
+
+	Returns:
+		list(int): The inverse of each value, in order.
+	"""
+	# Running products v0, v0*v1, ..., v0*...*vn.
+	products = []
+	acc = 1
+	for v in values:
+		acc = acc * v % m
+		products.append(acc)
+	if not products:
+		return []
+	inv = modInverse(acc, m)
+	# Walking backwards, inv is the inverse of the running product at i, so
+	# inv * products[i-1] is the inverse of values[i].
+	invs = [0]*len(values)
+	for i in range(len(values)-1, 0, -1):
+		invs[i] = inv * products[i-1] % m
+		inv = inv * values[i] % m
+	invs[0] = inv
+	return invs
+
+def splitK(k):
+	"""
+	splitK returns a balanced length-two representation of k, k1 and k2 such
+	that k = k1 + k2 * lamda (mod N), where k1 and k2 are roughly half the
+	size of N and may be negative. This is algorithm 3.74 from [GECC].
+
+	One thing of note about this algorithm is that no matter what c1 and c2 are,
+	the final equation of k = k1 + k2 * lambda (mod n) will hold.  This is
+	provable mathematically due to how a1/b1/a2/b2 are computed.
+	c1 and c2 are chosen to minimize the max(k1,k2).
+	"""
+	# c1 = round(b2 * k / n) from step 4.
+	# Rounding isn't really necessary and costs too much, hence skipped
+	c1 = (b2 * k) // order
+	# c2 = round(b1 * k / n) from step 4 (sign reversed to optimize one step)
+	# Rounding isn't really necessary and costs too much, hence skipped
+	c2 = (b1 * k) // order
+	# k1 = k - c1 * a1 - c2 * a2 from step 5 (note c2's sign is reversed)
+	k1 = k - c1*a1 + c2*a2
+	# k2 = - c1 * b1 - c2 * b2 from step 5 (note c2's sign is reversed)
+	k2 = c2*b2 - c1*b1
+	return k1, k2
+
+class TestScalar(unittest.TestCase):
+	def test_inverse(self):
+		for k in (1, 2, 3, order - 1, halfOrder, lamda, 0xdeadbeef):
+			self.assertEqual(inverse(k) * k % order, 1)
+			self.assertEqual(egcdInverse(k, order), inverse(k))
+		self.assertRaises(Exception, inverse, 0)
+		self.assertRaises(Exception, inverse, order)
+		self.assertRaises(Exception, egcdInverse, 0, order)
+		self.assertRaises(Exception, modInverse, 6, 9)
+	def test_batch_inverse(self):
+		values = [1, 2, 3, order - 1, 0xdeadbeef, lamda]
+		self.assertEqual(batchInverse(values), [inverse(v) for v in values])
+		self.assertEqual(batchInverse([3, 5], 7), [5, 3])
+		self.assertEqual(batchInverse([]), [])
+	def test_split_k(self):
+		for k in (0, 1, 2, order - 1, lamda, 0x6461E6DF0FE7DFD05329F41BF771B86578143D4DD1F7866FB4CA7E97C5FA945D):
+			k1, k2 = splitK(k)
+			self.assertEqual((k1 + k2*lamda) % order, k)
+			self.assertLess(abs(k1).bit_length(), 130)
+			self.assertLess(abs(k2).bit_length(), 130)
+	def test_helpers(self):
+		self.assertEqual(reduce(order + 5), 5)
+		self.assertEqual(add(order - 1, 2), 1)
+		self.assertEqual(mul(order - 1, order - 1), 1)
+		self.assertEqual(negate(1), order - 1)
+		self.assertEqual(negate(0), 0)
+		self.assertTrue(isValid(1))
+		self.assertFalse(isValid(0))
+		self.assertFalse(isValid(order))
@@ -21,9 +21,9 @@ import websocket
 from tempfile import TemporaryDirectory
 from tinydecred.util import tinyjson, helpers, database
 from tinydecred.crypto import opcode, crypto
-from tinydecred.crypto.bytearray import ByteArray
+from tinydecred.crypto.bytearray import ByteArray, bytesProperty
 from tinydecred.api import InsufficientFundsError
-from tinydecred.pydecred import txscript, simnet
+from tinydecred.pydecred import txscript, simnet, headerchain
 from tinydecred.pydecred.wire import msgtx, wire, msgblock
 from tinydecred.util.database import KeyValueDatabase
 
@@ -79,6 +79,14 @@ generatedTxVersion = 1
 #   - OP_CHECKSIG
 P2PKHPkScriptSize = 1 + 1 + 1 + 20 + 1 + 1
 
+# MaxStandardTxSize is the largest transaction that dcrd's default mempool policy
+# will relay.
+MaxStandardTxSize = 100000
+
+# MinSweepInputs is the fewest UTXOs worth spending in a consolidation
+# transaction.
+MinSweepInputs = 2
+
 formatTraceback = helpers.formatTraceback
 
 def getUri(uri):
@@ -419,8 +427,11 @@ class UTXO(object):
     """
     The UTXO is the only class fully implemented by the wallet API. BlockChains
     must know how to create and parse UTXO objects and fill fields as required
-    by the Wallet.
+    by the Wallet. An account can hold many UTXOs, so the fields are slots, and
+    the scriptPubKey is stored as bytes and reads as a ByteArray.
     """
+    __slots__ = ("address", "txid", "vout", "ts", "_scriptPubKey", "height", "amount", "satoshis", "maturity")
+    scriptPubKey = bytesProperty("_scriptPubKey")
     def __init__(self, address, txid, vout, ts=None, scriptPubKey=None, 
                  height=-1, amount=0, satoshis=0, maturity=None):
         self.address = address
@@ -721,6 +732,130 @@ def isDustAmount(amount, scriptSize, relayFeePerKb): #amount dcrutil.Amount, scr
     # (output size + input size) is greater than 1/3 of the relay fee.
     return amount*1000/(3*totalSize) < relayFeePerKb
 
+class TxFees(object):
+    """
+    The fee model for a transaction paying to a fixed set of outputs from P2PKH
+    inputs, for use with tinydecred.coinselect. The serialized size is worked
+    out the same way as estimateSerializeSize, but in constant time for any
+    number of inputs.
+    """
+    def __init__(self, outputs, relayFeePerKb, changeScriptSize=P2PKHPkScriptSize):
+        """
+        Args:
+            outputs (list(TxOut)): The transaction outputs, not including change.
+            relayFeePerKb (float): The fee per kilobyte.
+            changeScriptSize (int): Optional. The size of the change script.
+                Default P2PKHPkScriptSize.
+        """
+        self.relayFeePerKb = relayFeePerKb
+        self.outputCount = len(outputs)
+        self.outputsSize = sumOutputSerializeSizes(outputs)
+        self.inputSize = estimateInputSize(RedeemP2PKHSigScriptSize)
+        self.changeSize = estimateOutputSize(changeScriptSize)
+        # inputFee is the marginal fee for each input.
+        self.inputFee = relayFeePerKb * self.inputSize / 1000
+        # An excess smaller than the fee for the change output plus the smallest
+        # non-dust change is better given up to fees.
+        changeFee = relayFeePerKb * self.changeSize / 1000
+        dustLimit = relayFeePerKb * 3 * (self.changeSize + 165) / 1000
+        self.changeCost = round(changeFee + dustLimit)
+    def serializeSize(self, nInputs, change=True):
+        """
+        The worst case serialized size of the signed transaction.
+
+        Args:
+            nInputs (int): The number of inputs.
+            change (bool): Optional. Whether the transaction has a change
+                output. Default True.
+
+        Returns:
+            int: The size, in bytes.
+        """
+        outputCount = self.outputCount
+        size = self.outputsSize + nInputs*self.inputSize
+        if change:
+            outputCount += 1
+            size += self.changeSize
+        return 12 + 2*wire.varIntSerializeSize(nInputs) + wire.varIntSerializeSize(outputCount) + size
+    def fee(self, nInputs, change=True):
+        """
+        The minimum relay fee for the signed transaction.
+
+        Args:
+            nInputs (int): The number of inputs.
+            change (bool): Optional. Whether the transaction has a change
+                output. Default True.
+
+        Returns:
+            int: The fee, in atoms.
+        """
+        return calcMinRequiredTxRelayFee(self.relayFeePerKb, self.serializeSize(nInputs, change))
+
+def sweepBatches(utxos, fees, maxTxSize=MaxStandardTxSize):
+    """
+    Split the UTXOs into batches for consolidation transactions, each paying
+    to a single P2PKH output and no larger than maxTxSize. UTXOs that cost more
+    to spend than they are worth are left out, as are batches too small to
+    reduce the UTXO count or whose output would be dust.
+
+    Args:
+        utxos (list(UTXO)): The UTXOs to sweep, in the order to spend them.
+        fees (TxFees): The fee model, for a transaction with no outputs other
+            than the change output.
+        maxTxSize (int): Optional. The maximum serialized transaction size.
+            Default MaxStandardTxSize.
+
+    Returns:
+        list(list(UTXO)): The batches.
+    """
+    # The largest batch that fits.
+    n = max(0, (maxTxSize - fees.serializeSize(0)) // fees.inputSize)
+    while n > 0 and fees.serializeSize(n) > maxTxSize:
+        n -= 1
+    if n < MinSweepInputs:
+        raise Exception("maximum transaction size %d is too small to sweep" % maxTxSize)
+    utxos = [u for u in utxos if u.satoshis > fees.inputFee]
+    batches = []
+    for i in range(0, len(utxos), n):
+        batch = utxos[i:i+n]
+        if len(batch) < MinSweepInputs:
+            continue
+        value = sum(u.satoshis for u in batch) - fees.fee(len(batch))
+        if value <= 0 or isDustAmount(value, P2PKHPkScriptSize, fees.relayFeePerKb):
+            continue
+        batches.append(batch)
+    return batches
+
+def batchOutputs(outputs, maxTxSize=MaxStandardTxSize):
+    """
+    Split transaction outputs into batches for as few transactions as possible.
+    Each batch's outputs take up at most half of maxTxSize, leaving the rest for
+    the inputs and change.
+
+    Args:
+        outputs (list(TxOut)): The outputs.
+        maxTxSize (int): Optional. The maximum serialized transaction size.
+            Default MaxStandardTxSize.
+
+    Returns:
+        list(list(int)): The indices of the outputs in each batch, in order.
+    """
+    budget = maxTxSize // 2
+    batches = []
+    batch = []
+    size = 0
+    for i, txOut in enumerate(outputs):
+        outSize = txOut.serializeSize()
+        if batch and size + outSize > budget:
+            batches.append(batch)
+            batch = []
+            size = 0
+        batch.append(i)
+        size += outSize
+    if batch:
+        batches.append(batch)
+    return batches
+
 class DcrdataBlockchain(object):
     """
     DcrdataBlockchain implements the Blockchain API from tinydecred.api.
@@ -745,7 +880,13 @@ class DcrdataBlockchain(object):
         self.heightMap = self.db.getBucket("height", datatypes=("INTEGER", "BLOB"))
         self.headerDB = self.db.getBucket("header")
         self.txBlockMap = self.db.getBucket("blocklink")
+        # headerChain holds contiguous runs of headers added with addHeaders.
+        # Other headers are kept in headerDB, indexed by heightMap.
+        self.headerChain = headerchain.HeaderChain(self.db)
         self.tip = None
+        # signingProcesses is the size of the process pool used to sign
+        # transaction inputs. Signing is sequential unless it is set above 1.
+        self.signingProcesses = None
         if not skipConnect:
             self.connect()
 
@@ -921,6 +1062,9 @@ class DcrdataBlockchain(object):
         Returns: 
             BlockHeader: An object which implements the BlockHeader API.
         """
+        header = self.headerChain.headerByHash(hashFromHex(hexHash))
+        if header:
+            return header
         with self.headerDB as headers:
             try:
                 serialized = headers[hashFromHex(hexHash).bytes()]
@@ -945,6 +1089,9 @@ class DcrdataBlockchain(object):
         Returns:
             BlockHeader: The block header.
         """
+        header = self.headerChain.header(height)
+        if header:
+            return header
         with self.heightMap as heightMap, self.headerDB as headers:
             try:
                 hashKey = heightMap[height]
@@ -983,13 +1130,30 @@ class DcrdataBlockchain(object):
             int: Atoms per kB of encoded transaction.
         """
         return  DefaultRelayFeePerKb
+    def addHeaders(self, b):
+        """
+        Add a contiguous run of raw block headers to the header chain, in a
+        single database transaction. See HeaderChain.addHeaders.
+
+        Args:
+            b (ByteArray-like): The headers, each encoded in MaxHeaderSize bytes.
+
+        Returns:
+            list(BlockHeader): The decoded headers.
+        """
+        return self.headerChain.addHeaders(b)
     def saveBlockHeader(self, header):
         """
-        Save the block header to the database.
+        Save the block header to the database. A header that extends the
+        header chain is added to it.
 
         Args:
             header (BlockHeader): The block header to save.
         """
+        tipHeight = self.headerChain.tipHeight()
+        if tipHeight is not None and header.height == tipHeight + 1 and header.prevBlock == self.headerChain.hashAt(tipHeight):
+            self.headerChain.addHeaders(header.serialize())
+            return
         bHash = header.hash().bytes()
         with self.heightMap as heightMap, self.headerDB as headers:
             heightMap[header.height] = bHash
@@ -1003,17 +1167,73 @@ class DcrdataBlockchain(object):
             address str: The base-58 encoded address.
             keysource func(str) -> PrivateKey: A function that returns the 
                 private key for an address.
-            utxosource func(int, func(UTXO) -> bool) -> list(UTXO): A function 
-                that takes an amount in atoms, and an optional filtering 
-                function. utxosource returns a list of UTXOs that sum to >= the 
-                amount. If the filtering function is provided, UTXOs for which 
-                the  function return a falsey value will not be included in the
-                returned UTXO list.
+            utxosource func(int, func(UTXO) -> bool, TxFees) -> list(UTXO), bool:
+                A function that takes an amount in atoms, an optional filtering
+                function and the fee model for the transaction. utxosource
+                returns a list of UTXOs that cover the amount and the fee, and
+                whether it was successful. If the filtering function is
+                provided, UTXOs for which the function return a falsey value
+                will not be included in the returned UTXO list.
             MsgTx: The newly created transaction on success, `False` on failure.
         """
         self.updateTip()
         outputs = makeOutputs([(address, value)], self.params)
         return self.sendOutputs(outputs, keysource, utxosource, feeRate)
+    def sendMany(self, pairs, keysource, utxosource, feeRate=None, maxTxSize=MaxStandardTxSize):
+        """
+        Send to many addresses, with as few transactions as will fit the
+        outputs. Each transaction makes one coin selection and has at most one
+        change output. A failure affects only the recipients in the
+        transaction that failed.
+
+        Args:
+            pairs (list(tuple(str, int))): The base-58 encoded addresses and the
+                amounts to send to each, in atoms.
+            keysource (KeySource): A source for private keys and change
+                addresses.
+            utxosource func(int, func(UTXO) -> bool, TxFees) -> list(UTXO), bool:
+                See sendOutputs.
+            feeRate (float): Optional. The fee rate, in atoms/byte.
+            maxTxSize (int): Optional. The maximum serialized transaction size.
+                Default MaxStandardTxSize.
+
+        Returns:
+            list(tuple): A (list(int), MsgTx, list(UTXO), list(UTXO), Exception)
+                tuple for each transaction attempted. The list(int) is the
+                indices into pairs of the recipients paid by the transaction.
+                The transaction, spent UTXOs and change UTXOs are as returned by
+                sendOutputs. On failure, they are None and the Exception is set.
+                Recipients with invalid addresses or amounts are reported in a
+                transaction-less tuple of their own.
+        """
+        self.updateTip()
+        results = []
+        outputs = []
+        indices = []
+        for i, pair in enumerate(pairs):
+            try:
+                txOut = makeOutputs([pair], self.params)[0]
+                checkOutput(txOut, 0)
+                outputs.append(txOut)
+                indices.append(i)
+            except Exception as e:
+                results.append(([i], None, None, None, e))
+        # UTXOs spent by earlier transactions in the batch are still in the
+        # source until the caller records the results.
+        spent = set()
+        def source(amt, approve, fees):
+            return utxosource(amt, lambda u: approve(u) and u.key() not in spent, fees)
+        for batch in batchOutputs(outputs, maxTxSize):
+            paid = [indices[j] for j in batch]
+            try:
+                tx, spentUTXOs, newUTXOs = self.sendOutputs([outputs[j] for j in batch], keysource, source, feeRate)
+            except Exception as e:
+                log.error("failed to pay %d recipients: %s" % (len(paid), formatTraceback(e)))
+                results.append((paid, None, None, None, e))
+                continue
+            spent.update(u.key() for u in spentUTXOs)
+            results.append((paid, tx, spentUTXOs, newUTXOs, None))
+        return results
     def broadcast(self, txHex):
         """
         Broadcast the hex encoded transaction to dcrdata.
@@ -1080,6 +1300,112 @@ class DcrdataBlockchain(object):
         except:
             pass
         return False
+    def inputForUTXO(self, utxo):
+        """
+        Create the transaction input that spends the UTXO.
+
+        Args:
+            utxo (UTXO): The UTXO to spend.
+
+        Returns:
+            TxIn: The unsigned transaction input.
+            ByteArray: The pubkey script of the output being spent.
+        """
+        tx = self.tx(utxo.txid)
+        # header = self.blockHeaderByHeight(utxo["height"])
+        txout = tx.txOut[utxo.vout]
+
+        opCodeClass = getP2PKHOpCode(txout.pkScript)
+        tree = wire.TxTreeRegular if opCodeClass == opNonstake else wire.TxTreeStake
+        op = msgtx.OutPoint(
+            txHash=tx.hash(), 
+            idx=utxo.vout, 
+            tree=tree
+        )
+        return msgtx.TxIn(previousOutPoint=op, valueIn=txout.value), txout.pkScript
+    def signTx(self, tx, scripts, keysource):
+        """
+        Sign the transaction's inputs in place. If signingProcesses is set, the
+        inputs are signed in a process pool of that size.
+
+        Args:
+            tx (MsgTx): The transaction.
+            scripts (list(ByteArray)): The pubkey scripts of the outputs spent
+                by each input.
+            keysource (KeySource): A source for the private keys.
+        """
+        if len(tx.txIn) != len(scripts):
+            raise Exception("tx.TxIn and prevPkScripts slices must have equal length")
+        inputs = []
+        for pkScript in scripts:
+            scriptClass, addrs, numAddrs = txscript.extractPkScriptAddrs(0, pkScript, self.params)
+            inputs.append((keysource.priv(addrs[0].string()), pkScript))
+        sigScripts = txscript.signTxInputs(tx, inputs, self.params, txscript.SigHashAll, self.signingProcesses)
+        for txin, script in zip(tx.txIn, sigScripts):
+            txin.signatureScript = script
+    def sweep(self, utxos, keysource, address=None, feeRate=None, maxTxSize=MaxStandardTxSize):
+        """
+        Build and sign transactions consolidating the UTXOs. Each transaction
+        spends as many UTXOs as fit in maxTxSize to a single output. The
+        transactions are not broadcast.
+
+        Args:
+            utxos (list(UTXO)): The UTXOs to sweep, in the order to spend them.
+            keysource (KeySource): A source for private keys and change
+                addresses.
+            address (str): Optional. The base-58 encoded address to sweep to.
+                By default, each transaction pays to a new change address.
+            feeRate (float): Optional. The fee rate, in atoms/byte. Default is
+                the network's relay fee.
+            maxTxSize (int): Optional. The maximum serialized transaction
+                size. Default MaxStandardTxSize.
+
+        Returns:
+            list(tuple): A (MsgTx, list(UTXO), UTXO) tuple for each
+                transaction, holding the signed transaction, the UTXOs it spends
+                and the new UTXO.
+        """
+        relayFeePerKb = feeRate * 1e3 if feeRate else self.relayFee()
+        fees = TxFees([], relayFeePerKb)
+        maxTxSize = min(maxTxSize, self.params.MaxTxSize)
+        sweeps = []
+        for batch in sweepBatches(utxos, fees, maxTxSize):
+            inputs = []
+            scripts = []
+            total = 0
+            for utxo in batch:
+                txIn, pkScript = self.inputForUTXO(utxo)
+                total += txIn.valueIn
+                inputs.append(txIn)
+                scripts.append(pkScript)
+            # The size estimate assumes P2PKH inputs and output.
+            scriptSizes = [spendScriptSize(pkScript) for pkScript in scripts]
+            payTo = address if address else keysource.change()
+            pkScript = txscript.makePayToAddrScript(payTo, self.params)
+            signedSize = estimateSerializeSize(scriptSizes, [], len(pkScript))
+            value = round(total - calcMinRequiredTxRelayFee(relayFeePerKb, signedSize))
+            txOut = msgtx.TxOut(value=value, pkScript=pkScript)
+            checkOutput(txOut, relayFeePerKb)
+            newTx = msgtx.MsgTx(
+                serType =  wire.TxSerializeFull,
+                version =  generatedTxVersion,
+                txIn =     inputs,
+                txOut =    [txOut],
+                lockTime = 0,
+                expiry =   0,
+                cachedHash = None,
+            )
+            self.signTx(newTx, scripts, keysource)
+            sweeps.append((newTx, batch, UTXO(
+                address = payTo,
+                txid = newTx.txid(),
+                vout = 0,
+                ts = time.time(),
+                scriptPubKey = pkScript,
+                amount = value*1e-8,
+                satoshis = value,
+            )))
+        return sweeps
     def sendOutputs(self, outputs, keysource, utxosource, feeRate=None): # , minconf=1, randomizeChangeIdx=True):
         """
         Send the `TxOut`s to the address. 
@@ -1093,12 +1419,13 @@ class DcrdataBlockchain(object):
             outputs (list(TxOut)): The transaction outputs to send.
             keysource func(str) -> PrivateKey: A function that returns the 
                 private key for an address.
-            utxosource func(int, func(UTXO) -> bool) -> list(UTXO): A function 
-                that takes an amount in atoms, and an optional filtering 
-                function. utxosource returns a list of UTXOs that sum to >= the 
-                amount. If the filtering function is provided, UTXOs for which 
-                the  function return a falsey value will not be included in the
-                returned UTXO list.
+            utxosource func(int, func(UTXO) -> bool, TxFees) -> list(UTXO), bool:
+                A function that takes an amount in atoms, an optional filtering
+                function and the fee model for the transaction. utxosource
+                returns a list of UTXOs that cover the amount and the fee, and
+                whether it was successful. If the filtering function is
+                provided, UTXOs for which the function return a falsey value
+                will not be included in the returned UTXO list.
 
         Returns:
             MsgTx: The sent transaction.
@@ -1119,94 +1446,110 @@ class DcrdataBlockchain(object):
         for txout in outputs:
             checkOutput(txout, relayFeePerKb)
 
-        signedSize = estimateSerializeSize([RedeemP2PKHSigScriptSize], outputs, changeScriptSize)
-        targetFee = calcMinRequiredTxRelayFee(relayFeePerKb, signedSize)
+        # The fee is accounted for during coin selection, so a single request
+        # returns enough to cover it.
+        fees = TxFees(outputs, relayFeePerKb, changeScriptSize)
         targetAmount = sum(txo.value for txo in outputs)
+        utxos, enough = utxosource(targetAmount, self.approveUTXO, fees)
+        if not enough:
+            raise InsufficientFundsError("insufficient funds")
+        for utxo in utxos:
+            txIn, pkScript = self.inputForUTXO(utxo)
+            total += txIn.valueIn
+            inputs.append(txIn)
+            scripts.append(pkScript)
+            scriptSizes.append(spendScriptSize(pkScript))
+
+        signedSize = estimateSerializeSize(scriptSizes, outputs, changeScriptSize)
+        requiredFee = calcMinRequiredTxRelayFee(relayFeePerKb, signedSize)
+        remainingAmount = total - targetAmount
+        # A selection with no change output only has to cover the smaller fee.
+        if remainingAmount < calcMinRequiredTxRelayFee(relayFeePerKb, estimateSerializeSize(scriptSizes, outputs, 0)):
+            raise InsufficientFundsError("insufficient funds")
+
+        newTx = msgtx.MsgTx(
+            serType =  wire.TxSerializeFull,
+            version =  generatedTxVersion,
+            txIn =     inputs,
+            txOut =    outputs,
+            lockTime = 0,
+            expiry =   0,
+            cachedHash = None,
+        )
 
-        while True:
-            utxos, enough = utxosource(targetAmount + targetFee, self.approveUTXO)
-            if not enough:
-                raise InsufficientFundsError("insufficient funds")
-            for utxo in utxos:
-                tx = self.tx(utxo.txid)
-                # header = self.blockHeaderByHeight(utxo["height"])
-                txout = tx.txOut[utxo.vout]
-
-                opCodeClass = getP2PKHOpCode(txout.pkScript)
-                tree = wire.TxTreeRegular if opCodeClass == opNonstake else wire.TxTreeStake
-                op = msgtx.OutPoint(
-                    txHash=tx.hash(), 
-                    idx=utxo.vout, 
-                    tree=tree
-                )
-                txIn = msgtx.TxIn(previousOutPoint=op, valueIn=txout.value)
-
-                total += txout.value
-                inputs.append(txIn)
-                scripts.append(txout.pkScript)
-                scriptSizes.append(spendScriptSize(txout.pkScript))
-
-            signedSize = estimateSerializeSize(scriptSizes, outputs, changeScriptSize)
-            requiredFee = calcMinRequiredTxRelayFee(relayFeePerKb, signedSize)
-            remainingAmount = total - targetAmount
-            if remainingAmount < requiredFee:
-                targetFee = requiredFee
-                continue
-
-            newTx = msgtx.MsgTx(
-                serType =  wire.TxSerializeFull,
-                version =  generatedTxVersion,
-                txIn =     inputs,
-                txOut =    outputs,
-                lockTime = 0,
-                expiry =   0,
-                cachedHash = None,
+        change = None
+        newUTXOs = []
+        changeVout = -1
+        changeAmount = round(total - targetAmount - requiredFee)
+        if changeAmount > 0 and not isDustAmount(changeAmount, changeScriptSize, relayFeePerKb):
+            if len(changeScript) > txscript.MaxScriptElementSize:
+                raise Exception("script size exceed maximum bytes pushable to the stack")
+            change = msgtx.TxOut(
+                value =    changeAmount,
+                version =  changeScriptVersion,
+                pkScript = changeScript,
             )
-
-            change = None
-            newUTXOs = []
-            changeVout = -1
-            changeAmount = round(total - targetAmount - requiredFee)
-            if changeAmount != 0 and not isDustAmount(changeAmount, changeScriptSize, relayFeePerKb):
-                if len(changeScript) > txscript.MaxScriptElementSize:
-                    raise Exception("script size exceed maximum bytes pushable to the stack")
-                change = msgtx.TxOut(
-                    value =    changeAmount,
-                    version =  changeScriptVersion,
-                    pkScript = changeScript,
-                )
-                changeVout = len(newTx.txOut)
-                newTx.txOut.append(change)
-            else:
-                signedSize = estimateSerializeSize(scriptSizes, newTx.txOut, 0)
-
-            # dcrwallet conditionally randomizes the change position here
-            if len(newTx.txIn) != len(scripts):
-                raise Exception("tx.TxIn and prevPkScripts slices must have equal length")
-
-            # Sign the inputs
-            for i, txin in enumerate(newTx.txIn):
-                pkScript = scripts[i]
-                sigScript = txin.signatureScript
-                scriptClass, addrs, numAddrs = txscript.extractPkScriptAddrs(0, pkScript, self.params)
-                privKey = keysource.priv(addrs[0].string())
-                script = txscript.signTxOutput(privKey, self.params, newTx, i, pkScript, txscript.SigHashAll, sigScript, crypto.STEcdsaSecp256k1)
-                txin.signatureScript = script
-            self.broadcast(newTx.txHex())
-            if change:
-                newUTXOs.append(UTXO(
-                    address = changeAddress,
-                    txid = newTx.txid(),
-                    vout = changeVout,
-                    ts = time.time(),
-                    scriptPubKey = changeScript,
-                    amount = changeAmount*1e-8,
-                    satoshis = changeAmount,
-                ))
-
-            return newTx, utxos, newUTXOs
+            changeVout = len(newTx.txOut)
+            newTx.txOut.append(change)
+        else:
+            signedSize = estimateSerializeSize(scriptSizes, newTx.txOut, 0)
+
+        # dcrwallet conditionally randomizes the change position here
+        self.signTx(newTx, scripts, keysource)
+        self.broadcast(newTx.txHex())
+        if change:
+            newUTXOs.append(UTXO(
+                address = changeAddress,
+                txid = newTx.txid(),
+                vout = changeVout,
+                ts = time.time(),
+                scriptPubKey = changeScript,
+                amount = changeAmount*1e-8,
+                satoshis = changeAmount,
+            ))
+
+        return newTx, utxos, newUTXOs
 
 class TestDcrdata(unittest.TestCase):
+    def test_batch_outputs(self):
+        outputs = makeOutputs([("SsUYTr1PBd2JMbaUfiRqxUoRcYHj1a1DKY9", i + 1) for i in range(100)], simnet)
+        outSize = outputs[0].serializeSize()
+        batches = batchOutputs(outputs, outSize*60)
+        self.assertEqual([len(b) for b in batches], [30, 30, 30, 10])
+        self.assertEqual([i for b in batches for i in b], list(range(100)))
+        self.assertEqual(batchOutputs(outputs), [list(range(100))])
+        self.assertEqual(batchOutputs([]), [])
+    def test_sweep_batches(self):
+        class Coin:
+            def __init__(self, satoshis):
+                self.satoshis = satoshis
+        fees = TxFees([], DefaultRelayFeePerKb)
+        # Room for 10 inputs.
+        maxTxSize = fees.serializeSize(10)
+        self.assertEqual(estimateSerializeSize([RedeemP2PKHSigScriptSize]*10, [], P2PKHPkScriptSize), maxTxSize)
+        utxos = [Coin(1e5) for _ in range(25)]
+        # A UTXO not worth spending is left out.
+        utxos.insert(3, Coin(fees.inputFee))
+        batches = sweepBatches(utxos, fees, maxTxSize)
+        self.assertEqual([len(b) for b in batches], [10, 10, 5])
+        self.assertNotIn(utxos[3], [u for b in batches for u in b])
+        # A single left over UTXO isn't worth a transaction.
+        self.assertEqual([len(b) for b in sweepBatches(utxos[:22], fees, maxTxSize)], [10, 10])
+        # Neither is a batch that would only produce dust.
+        self.assertEqual(sweepBatches([Coin(fees.inputFee + 1)]*5, fees, maxTxSize), [])
+        self.assertRaises(Exception, sweepBatches, utxos, fees, fees.serializeSize(1))
+    def test_tx_fees(self):
+        outputs = makeOutputs([("SsUYTr1PBd2JMbaUfiRqxUoRcYHj1a1DKY9", int(1e8))], simnet)
+        relayFeePerKb = DefaultRelayFeePerKb
+        fees = TxFees(outputs, relayFeePerKb)
+        for n in (0, 1, 2, 252, 253, 1000):
+            for changeScriptSize in (P2PKHPkScriptSize, 0):
+                size = estimateSerializeSize([RedeemP2PKHSigScriptSize]*n, outputs, changeScriptSize)
+                self.assertEqual(fees.serializeSize(n, changeScriptSize > 0), size)
+                self.assertEqual(fees.fee(n, changeScriptSize > 0), calcMinRequiredTxRelayFee(relayFeePerKb, size))
+        changeFee = fees.fee(1) - fees.fee(1, False)
+        self.assertTrue(isDustAmount(fees.changeCost - changeFee - 1, P2PKHPkScriptSize, relayFeePerKb))
+        self.assertFalse(isDustAmount(fees.changeCost - changeFee + 1, P2PKHPkScriptSize, relayFeePerKb))
     def test_post(self):
         dcrdata = DcrdataClient("http://localhost:7777", customPaths={
             "/tx/send",
@@ -1249,3 +1592,16 @@ class TestDcrdata(unittest.TestCase):
             blockchain.connect()
             blockchain.blockHeader("00000e0cae637353e73ad85fc0073ebb7ed00a0668b068b376a6aef2812e1bf3")
 
+    def test_header_chain(self):
+        with TemporaryDirectory() as tempDir:
+            blockchain = DcrdataBlockchain(os.path.join(tempDir, "db.db"), simnet, "http://localhost:7777", skipConnect=True)
+            headers = headerchain.makeChain(4, height=10)
+            blockchain.addHeaders(headerchain.encodeHeaders(headers[:2]))
+            # A header extending the chain is added to it. Others are not.
+            blockchain.saveBlockHeader(headers[2])
+            stray = headerchain.makeChain(1, height=20)[0]
+            blockchain.saveBlockHeader(stray)
+            self.assertEqual(blockchain.headerChain.tipHeight(), 12)
+            for header in headers[:3] + [stray]:
+                self.assertEqual(blockchain.blockHeaderByHeight(header.height).hash(), header.hash())
+                self.assertEqual(blockchain.blockHeader(header.id()).hash(), header.hash())
@@ -0,0 +1,259 @@
+"""
+Copyright (c) 2019, Brian Stafford
+Copyright (c) 2019, The Decred developers
+See LICENSE for details
+
+A locally stored chain of block headers.
+"""
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from threading import get_ident as threadID
+from tinydecred.crypto.bytearray import ByteArray
+from tinydecred.crypto.crypto import hashH
+from tinydecred.util import helpers
+from tinydecred.util.database import KeyValueDatabase
+from tinydecred.pydecred.wire import msgblock, wire
+
+# chainhash.HashSize in go
+HASH_SIZE = 32
+
+ChainTable = "CREATE TABLE IF NOT EXISTS {tablename} (height INTEGER PRIMARY KEY, hash BLOB NOT NULL, header BLOB NOT NULL);"
+
+ChainHashIndex = "CREATE UNIQUE INDEX IF NOT EXISTS {tablename}_hash ON {tablename}(hash);"
+
+ChainHashes = "SELECT height, hash FROM {tablename} ORDER BY height;"
+
+ChainInsert = "INSERT INTO {tablename}(height, hash, header) VALUES(?, ?, ?);"
+
+ChainHeaderByHeight = "SELECT header FROM {tablename} WHERE height = ?;"
+
+ChainHeightByHash = "SELECT height FROM {tablename} WHERE hash = ?;"
+
+class HeaderChain:
+    """
+    HeaderChain stores a contiguous chain of block headers in a database table
+    keyed by height. Headers are added in runs of raw, MaxHeaderSize-byte
+    encodings. A run is checked to extend the tip, each header linking to the
+    one before it by prevBlock, and is then written in a single transaction.
+
+    The block hashes are also held in memory, packed end to end in a
+    bytearray, as a height -> hash index taking 32 bytes per block.
+    """
+    def __init__(self, db, name="headerchain"):
+        """
+        Args:
+            db (KeyValueDatabase): The database to store the chain in.
+            name (str): Optional. The table name. Default "headerchain".
+        """
+        self.db = db
+        self.createQuery = ChainTable.format(tablename=name)
+        self.indexQuery = ChainHashIndex.format(tablename=name)
+        self.hashesQuery = ChainHashes.format(tablename=name)
+        self.insertQuery = ChainInsert.format(tablename=name)
+        self.headerQuery = ChainHeaderByHeight.format(tablename=name)
+        self.heightQuery = ChainHeightByHash.format(tablename=name)
+        self.tid = None
+        self.conn = None
+        # The height of the first header, or None if the chain is empty.
+        self.rootHeight = None
+        # The hash of the block at rootHeight + i is at hashes[32*i:32*(i+1)].
+        self.hashes = bytearray()
+        conn = self.connection()
+        cursor = conn.cursor()
+        cursor.execute(self.createQuery)
+        cursor.execute(self.indexQuery)
+        conn.commit()
+        for height, bHash in cursor.execute(self.hashesQuery):
+            if self.rootHeight is None:
+                self.rootHeight = height
+            self.hashes += bHash
+    def connection(self):
+        """
+        The database connection for the calling thread. As with Bucket, each
+        thread gets its own connection.
+        """
+        tid = threadID()
+        if self.tid != tid:
+            self.conn = self.db.openDB()
+            self.tid = tid
+        return self.conn
+    def __len__(self):
+        return len(self.hashes) // HASH_SIZE
+    def tipHeight(self):
+        """
+        The height of the last header.
+
+        Returns:
+            int: The tip height, or None if the chain is empty.
+        """
+        if self.rootHeight is None:
+            return None
+        return self.rootHeight + len(self) - 1
+    def hashAt(self, height):
+        """
+        The block hash at the height.
+
+        Args:
+            height (int): The block height.
+
+        Returns:
+            ByteArray: The block hash, or None if the height is not in the
+                chain.
+        """
+        if self.rootHeight is None or height < self.rootHeight or height > self.tipHeight():
+            return None
+        start = (height - self.rootHeight) * HASH_SIZE
+        return ByteArray(self.hashes[start:start+HASH_SIZE], copy=False)
+    def heightOf(self, bHash):
+        """
+        The height of the block with the hash.
+
+        Args:
+            bHash (ByteArray-like): The block hash.
+
+        Returns:
+            int: The block height, or None if the block is not in the chain.
+        """
+        cursor = self.connection().cursor()
+        cursor.execute(self.heightQuery, (ByteArray(bHash).bytes(), ))
+        row = cursor.fetchone()
+        return None if row is None else row[0]
+    def header(self, height):
+        """
+        The block header at the height.
+
+        Args:
+            height (int): The block height.
+
+        Returns:
+            BlockHeader: The header, or None if the height is not in the chain.
+        """
+        cursor = self.connection().cursor()
+        cursor.execute(self.headerQuery, (height, ))
+        row = cursor.fetchone()
+        return None if row is None else msgblock.BlockHeader.deserialize(row[0])
+    def headerByHash(self, bHash):
+        """
+        The block header with the hash.
+
+        Args:
+            bHash (ByteArray-like): The block hash.
+
+        Returns:
+            BlockHeader: The header, or None if the block is not in the chain.
+        """
+        height = self.heightOf(bHash)
+        return None if height is None else self.header(height)
+    def addHeaders(self, b):
+        """
+        Add a contiguous run of headers to the tip of the chain. The first
+        header of an empty chain sets the root height. Nothing is stored
+        unless every header in the run is at the next height and links to the
+        header before it.
+
+        Args:
+            b (ByteArray-like): The headers, each encoded in MaxHeaderSize bytes.
+
+        Returns:
+            list(BlockHeader): The decoded headers.
+        """
+        reader = wire.ByteReader(b)
+        view = reader.view
+        headers = msgblock.decodeHeaders(reader)
+        if not headers:
+            return headers
+        tipHeight = self.tipHeight()
+        if tipHeight is None:
+            height = headers[0].height
+            prevHash = None
+        else:
+            height = tipHeight + 1
+            prevHash = self.hashes[-HASH_SIZE:]
+        rows = []
+        hashes = bytearray()
+        for i, header in enumerate(headers):
+            if header.height != height:
+                raise Exception("HeaderChain.addHeaders: header %d has height %d, expected %d" % (i, header.height, height))
+            if prevHash is not None and header.prevBlock != prevHash:
+                raise Exception("HeaderChain.addHeaders: header %d at height %d does not link to the previous block" % (i, height))
+            encoded = bytes(view[i*msgblock.MaxHeaderSize:(i+1)*msgblock.MaxHeaderSize])
+            bHash = hashH(encoded).bytes()
+            rows.append((height, bHash, encoded))
+            hashes += bHash
+            prevHash = bHash
+            height += 1
+        conn = self.connection()
+        # The connection context commits the run, or rolls it back on error.
+        with conn:
+            conn.executemany(self.insertQuery, rows)
+        if self.rootHeight is None:
+            self.rootHeight = headers[0].height
+        self.hashes += hashes
+        return headers
+
+def makeChain(n, height=0, prevBlock=None):
+    """
+    A run of n linked headers, for testing.
+
+    Returns:
+        list(BlockHeader): The headers.
+    """
+    headers = []
+    for i in range(n):
+        header = msgblock.BlockHeader.deserialize(bytearray(msgblock.MaxHeaderSize))
+        header.height = height + i
+        header.prevBlock = headers[-1].hash() if headers else (prevBlock or bytes(HASH_SIZE))
+        headers.append(header)
+    return headers
+
+def encodeHeaders(headers):
+    return ByteArray(b"".join(h.serialize().bytes() for h in headers))
+
+class TestHeaderChain(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        helpers.prepareLogger("TestHeaderChain")
+    def test_header_chain(self):
+        with TemporaryDirectory() as tempDir:
+            db = KeyValueDatabase(os.path.join(tempDir, "headers.sqlite"))
+            chain = HeaderChain(db)
+            self.assertIsNone(chain.tipHeight())
+            self.assertIsNone(chain.hashAt(0))
+            self.assertEqual(chain.addHeaders(b""), [])
+
+            headers = makeChain(10, height=5)
+            chain.addHeaders(encodeHeaders(headers[:6]))
+            chain.addHeaders(encodeHeaders(headers[6:]).bytes())
+            self.assertEqual(chain.tipHeight(), 14)
+            self.assertEqual(len(chain), 10)
+
+            def checkChain(chain):
+                self.assertIsNone(chain.hashAt(4))
+                self.assertIsNone(chain.hashAt(15))
+                for header in headers:
+                    bHash = header.hash()
+                    self.assertEqual(chain.hashAt(header.height), bHash)
+                    self.assertEqual(chain.heightOf(bHash), header.height)
+                    self.assertEqual(chain.header(header.height).serialize(), header.serialize())
+                    self.assertEqual(chain.headerByHash(bHash).height, header.height)
+                self.assertIsNone(chain.header(15))
+                self.assertIsNone(chain.heightOf(bytes(HASH_SIZE)))
+            checkChain(chain)
+            # The index is reloaded from the database.
+            checkChain(HeaderChain(db))
+
+            # A run that doesn't start at the next height, or doesn't link,
+            # is rejected, and none of it is stored.
+            more = makeChain(3, height=15, prevBlock=headers[-1].hash())
+            badLink = makeChain(3, height=15)
+            badHeight = makeChain(3, height=16, prevBlock=headers[-1].hash())
+            broken = more[:1] + makeChain(2, height=16)
+            for run in (badLink, badHeight, broken):
+                with self.assertRaises(Exception):
+                    chain.addHeaders(encodeHeaders(run))
+                self.assertEqual(chain.tipHeight(), 14)
+                self.assertIsNone(chain.header(15))
+            chain.addHeaders(encodeHeaders(more))
+            self.assertEqual(chain.tipHeight(), 17)
+            self.assertEqual(HeaderChain(db).hashAt(17), more[-1].hash())
@@ -5,11 +5,14 @@ See LICENSE for details
 
 Based on dcrd txscript.
 """
+import importlib
+import multiprocessing
 import unittest
-from tinydecred.crypto.bytearray import ByteArray
+from tinydecred.crypto.bytearray import ByteArray, decodeBA
 from tinydecred.pydecred.wire import wire, msgtx # A couple of usefule serialization functions.
 from tinydecred.crypto import opcode, crypto
-from tinydecred.crypto.secp256k1.curve import curve as Curve
+from tinydecred.crypto.secp256k1.curve import curve as Curve, PublicKey
+from tinydecred.crypto.secp256k1 import scalar
 
 HASH_SIZE = 32
 SHA256_SIZE = 32
@@ -50,9 +53,6 @@ SigHashSerializePrefix = 1
 # witness data.
 SigHashSerializeWitness = 3
 
-# from chaincfg
-SigHashOptimization = False
-
 varIntSerializeSize = wire.varIntSerializeSize
 
 # These are the constants specified for maximums in individual scripts.
@@ -512,21 +512,148 @@ def verifySig(pub, inHash, r, s):
 
     e = hashToInt(inHash)
 
-    w = crypto.modInv(s, N)
+    w = scalar.inverse(s)
 
     u1 = (e * w) % N
     u2 = (r * w) % N
 
-
-    x1, y1 = Curve.scalarBaseMult(u1)
-    x2, y2 = Curve.scalarMult(pub.x, pub.y, u2)
-    x, y = Curve.add(x1, y1, x2, y2)
+    x, y = Curve.doubleScalarMult(u1, pub, u2)
 
     if x == 0 and y == 0:
         return False
     x = x % N
     return x == r
 
+def verifySigs(batch, processes=None):
+    """
+    verifySigs verifies a batch of signatures. It is equivalent to calling
+    verifySig for each item, but the s inverses are computed together with a
+    single modular inversion, and signatures by the same public key share that
+    key's precomputed point table.
+
+    Args:
+        batch (list(tuple)): (pub, inHash, r, s) tuples, with the same meaning
+            as the verifySig arguments.
+        processes (int): Optional. If greater than 1, the curve arithmetic is
+            split across a process pool of this size.
+
+    Returns:
+        list(bool): Whether each signature verifies.
+    """
+    results = [False]*len(batch)
+    chunks = chunkSigJobs([(i, job) for i, job in enumerate(sigJobs(batch)) if job], processes)
+    jobLists = [[job for _, job in chunk] for chunk in chunks]
+    if len(chunks) > 1:
+        with multiprocessing.Pool(processes) as pool:
+            verdicts = pool.map(verifySigJobs, jobLists)
+    else:
+        pubs = batchPubs(batch)
+        verdicts = [verifySigJobs(jobs, pubs) for jobs in jobLists]
+    for chunk, chunkVerdicts in zip(chunks, verdicts):
+        for (i, _), ok in zip(chunk, chunkVerdicts):
+            results[i] = ok
+    return results
+
+def allSigsValid(batch, processes=None):
+    """
+    allSigsValid is the fast path of verifySigs for when only the verdict for
+    the whole batch is needed. It stops at the first invalid signature.
+
+    Args:
+        batch (list(tuple)): (pub, inHash, r, s) tuples. See verifySigs.
+        processes (int): Optional. Process pool size. See verifySigs.
+
+    Returns:
+        bool: True if every signature in the batch verifies.
+    """
+    jobs = sigJobs(batch)
+    if not all(jobs):
+        return False
+    chunks = chunkSigJobs(list(enumerate(jobs)), processes)
+    if len(chunks) > 1:
+        with multiprocessing.Pool(processes) as pool:
+            jobLists = [[job for _, job in chunk] for chunk in chunks]
+            return all(all(verdicts) for verdicts in pool.imap_unordered(verifySigJobs, jobLists))
+    pubs = batchPubs(batch)
+    return all(verifySigJob(job, pubs) for job in jobs)
+
+def sigJobs(batch):
+    """
+    Reduce the (pub, inHash, r, s) batch to the integers needed for the curve
+    arithmetic, using a batch inversion for all of the s values. See [NSA] 3.4.2.
+
+    Returns:
+        list(tuple): (x, y, u1, u2, r) for each signature, or None where the
+            signature is rejected outright.
+    """
+    N = Curve.N
+    jobs = [None]*len(batch)
+    accepted = [i for i, (_, _, r, s) in enumerate(batch) if 0 < r < N and 0 < s < N]
+    ws = scalar.batchInverse([batch[i][3] for i in accepted])
+    for i, w in zip(accepted, ws):
+        pub, inHash, r, _ = batch[i]
+        e = hashToInt(inHash)
+        jobs[i] = (pub.x, pub.y, (e * w) % N, (r * w) % N, r)
+    return jobs
+
+def chunkSigJobs(indexedJobs, processes):
+    """
+    Split the (index, job) pairs into one chunk per process. Jobs are sorted by
+    public key first so that signatures by the same key land in the same chunk
+    and share its point table.
+    """
+    if not indexedJobs:
+        return []
+    if not processes or processes < 2:
+        return [indexedJobs]
+    indexedJobs = sorted(indexedJobs, key=lambda pair: (pair[1][0], pair[1][1]))
+    size = -(-len(indexedJobs) // processes)
+    return [indexedJobs[i:i+size] for i in range(0, len(indexedJobs), size)]
+
+def batchPubs(batch):
+    """
+    The batch's public keys keyed by (x, y), for use as the verifySigJob key
+    cache. Starting from the caller's PublicKey objects means any point table
+    they already hold is reused, and any table built here stays with them.
+    """
+    return {(pub.x, pub.y): pub for pub, _, _, _ in batch}
+
+def verifySigJobs(jobs, pubs=None):
+    """
+    Verify a list of jobs from sigJobs. Module-level so that it can be sent to
+    a process pool.
+
+    Args:
+        jobs (list(tuple)): Jobs from sigJobs.
+        pubs (dict): Optional. The PublicKey cache. See verifySigJob.
+
+    Returns:
+        list(bool): The result for each job.
+    """
+    pubs = {} if pubs is None else pubs
+    return [verifySigJob(job, pubs) for job in jobs]
+
+def verifySigJob(job, pubs):
+    """
+    Check a single job from sigJobs.
+
+    Args:
+        job (tuple): (x, y, u1, u2, r).
+        pubs (dict): PublicKey cache keyed by (x, y), so that repeated keys
+            reuse their point table.
+
+    Returns:
+        bool: True if the signature verifies.
+    """
+    x, y, u1, u2, r = job
+    pub = pubs.get((x, y))
+    if pub is None:
+        pub = pubs[(x, y)] = PublicKey(Curve, x, y)
+    rx, ry = Curve.doubleScalarMult(u1, pub, u2)
+    if rx == 0 and ry == 0:
+        return False
+    return rx % Curve.N == r
+
 def signRFC6979(privateKey, inHash):
     """
     signRFC6979 generates a deterministic ECDSA signature according to RFC 6979
@@ -535,7 +662,7 @@ def signRFC6979(privateKey, inHash):
     N = Curve.N
     k = nonceRFC6979(privateKey, inHash, ByteArray(b''), ByteArray(b''))
 
-    inv = crypto.modInv(k, N)
+    inv = scalar.inverse(k)
     r = Curve.scalarBaseMult(k)[0] % N
 
     if r == 0:
@@ -609,7 +736,40 @@ def addData(data):
     b += data
     return b
 
-def signatureScript(tx, idx, subscript, hashType, privKey, compress):
+class TxSigHashes(object):
+    """
+    TxSigHashes caches the parts of the signature hash that are shared by all of
+    a transaction's inputs, so that signing n inputs hashes the transaction
+    prefix once rather than n times. The cache is only valid while the
+    transaction's inputs and outputs are unchanged, other than their signature
+    scripts.
+    """
+    def __init__(self, tx):
+        """
+        Args:
+            tx (MsgTx): The transaction being signed.
+        """
+        self.tx = tx
+        self.prefixHash = None
+    def prefix(self, hashType):
+        """
+        The cached prefix hash to pass to calcSignatureHash for the hash type.
+
+        Args:
+            hashType (int): The signature hash type.
+
+        Returns:
+            ByteArray: The prefix hash, or None if the hash type commits to a
+                different prefix for each input.
+        """
+        if hashType&sigHashMask != SigHashAll or hashType&SigHashAnyOneCanPay != 0:
+            return None
+        if self.prefixHash is None:
+            # With SigHashAll, the prefix hash is the transaction hash.
+            self.prefixHash = self.tx.hash()
+        return self.prefixHash
+
+def signatureScript(tx, idx, subscript, hashType, privKey, compress, sigHashes=None):
     """
     SignatureScript creates an input signature script for tx to spend coins sent
     from a previous output to the owner of privKey. tx must include all
@@ -619,9 +779,10 @@ def signatureScript(tx, idx, subscript, hashType, privKey, compress):
     as the idx'th input. privKey is serialized in either a compressed or
     uncompressed format based on compress. This format must match the same format
     used to generate the payment address, or the script validation will fail.
+    sigHashes is an optional TxSigHashes for tx.
     """
 
-    sig = rawTxInSignature(tx, idx, subscript, hashType, privKey.key)
+    sig = rawTxInSignature(tx, idx, subscript, hashType, privKey.key, sigHashes)
 
     pubKey = privKey.pub
 
@@ -635,16 +796,18 @@ def signatureScript(tx, idx, subscript, hashType, privKey, compress):
 
     return script
 
-def rawTxInSignature(tx, idx, subScript, hashType, key):
+def rawTxInSignature(tx, idx, subScript, hashType, key, sigHashes=None):
     """
     rawTxInSignature returns the serialized ECDSA signature for the input idx of
-    the given transaction, with hashType appended to it.
+    the given transaction, with hashType appended to it. sigHashes is an
+    optional TxSigHashes for tx.
     
     NOTE: This function is only valid for version 0 scripts.  Since the function
     does not accept a script version, the results are undefined for other script
     versions.
     """
-    sigHash = calcSignatureHash(subScript, hashType, tx, idx, None)
+    cachedPrefix = sigHashes.prefix(hashType) if sigHashes else None
+    sigHash = calcSignatureHash(subScript, hashType, tx, idx, cachedPrefix)
     sig = signRFC6979(key, sigHash).serialize()
     return sig + ByteArray(hashType)
 
@@ -732,9 +895,9 @@ def calcSignatureHash(script, hashType, tx, idx, cachedPrefix):
     # can be reused because only the witness data has been modified, so
     # the wasteful extra O(N^2) hash can be avoided.
     prefixHash = ByteArray(b'')
-    if (SigHashOptimization and not cachedPrefix is None and
+    if (cachedPrefix is not None and
         hashType&sigHashMask == SigHashAll and
-        (hashType&SigHashAnyOneCanPay).iszero()):
+        hashType&SigHashAnyOneCanPay == 0):
 
         prefixHash = cachedPrefix
     else:
@@ -827,26 +990,25 @@ def calcSignatureHash(script, hashType, tx, idx, cachedPrefix):
     #    b) prevout pkscript (as unmodified bytes)
 
     expectedSize = sigHashWitnessSerializeSize(txIns, script)
-    witnessBuf = ByteArray(b'')
 
     # Commit to the version and hash serialization type.
     version = ByteArray(tx.version, length=4) | (SigHashSerializeWitness<<16)
-    witnessBuf += version.littleEndian()
-
-    # Commit to the relevant transaction inputs.
-    witnessBuf += putVarInt(len(txIns))
-    for txInIdx in range(len(txIns)):
-        # Commit to the input script at the index corresponding to the
-        # input index being signed.  Otherwise, commit to a nil script
-        # instead.
-        commitScript = script
-        if txInIdx != signTxInIdx:
-            commitScript = b''
-        witnessBuf += putVarInt(len(commitScript))
-        witnessBuf += commitScript
+
+    # Commit to the relevant transaction inputs.  Commit to the input script at
+    # the index corresponding to the input index being signed.  Otherwise,
+    # commit to a nil script instead, which serializes as a single zero byte
+    # for the length.
+    witnessBuf = b''.join((
+        version.littleEndian().b,
+        putVarInt(len(txIns)).b,
+        bytes(signTxInIdx),
+        putVarInt(len(script)).b,
+        decodeBA(script),
+        bytes(len(txIns) - signTxInIdx - 1),
+    ))
     if len(witnessBuf) != expectedSize:
         raise Exception("incorrect witness serialization size %i != %i" % (len(witnessBuf), expectedSize))
-    witnessHash = hashH(witnessBuf.bytes())
+    witnessHash = hashH(witnessBuf)
 
     # The final signature hash (message to sign) is the hash of the
     # serialization of the following fields:
@@ -946,13 +1108,13 @@ def extractPkScriptAddrs(version, pkScript, chainParams):
     # EVERYTHING AFTER TIHS IS UN-IMPLEMENTED
     raise Exception("Not a pay-to-pubkey-hash script")
 
-def sign(privKey, chainParams, tx, idx, subScript, hashType, sigType):
+def sign(privKey, chainParams, tx, idx, subScript, hashType, sigType, sigHashes=None):
     scriptClass, addresses, nrequired = extractPkScriptAddrs(DefaultScriptVersion, subScript, chainParams)
 
     if scriptClass == PubKeyHashTy:
         # look up key for address
         # key = acct.getPrivKeyForAddress(addresses[0])
-        script = signatureScript(tx, idx, subScript, hashType, privKey, True)
+        script = signatureScript(tx, idx, subScript, hashType, privKey, True, sigHashes)
     else:
         raise Exception("un-implemented script class")
 
@@ -1019,7 +1181,7 @@ def mergeScripts(chainParams, tx, idx, pkScript, scriptClass, addresses, nRequir
             return sigScript
         return prevScript
 
-def signTxOutput(privKey, chainParams, tx, idx, pkScript, hashType, previousScript, sigType):
+def signTxOutput(privKey, chainParams, tx, idx, pkScript, hashType, previousScript, sigType, sigHashes=None):
     """
     signTxOutput signs output idx of the given tx to resolve the script given in
     pkScript with a signature type of hashType. Any keys required will be
@@ -1027,14 +1189,16 @@ def signTxOutput(privKey, chainParams, tx, idx, pkScript, hashType, previousScri
     Any pay-to-script-hash signatures will be similarly looked up by calling
     getScript. If previousScript is provided then the results in previousScript
     will be merged in a type-dependent manner with the newly generated.
-    signature script.
+    signature script. When signing several inputs of tx, pass the same
+    TxSigHashes as sigHashes to compute the shared part of the signature hash
+    only once.
             
     NOTE: This function is only valid for version 0 scripts.  Since the function
     does not accept a script version, the results are undefined for other script
     versions.
     """
 
-    sigScript, scriptClass, addresses, nrequired = sign(privKey, chainParams, tx, idx, pkScript, hashType, sigType)
+    sigScript, scriptClass, addresses, nrequired = sign(privKey, chainParams, tx, idx, pkScript, hashType, sigType, sigHashes)
 
     isStakeType = (scriptClass == StakeSubmissionTy or
         scriptClass == StakeSubChangeTy or
@@ -1063,6 +1227,70 @@ def signTxOutput(privKey, chainParams, tx, idx, pkScript, hashType, previousScri
     mergedScript = mergeScripts(chainParams, tx, idx, pkScript, scriptClass, addresses, nrequired, sigScript, previousScript)
     return mergedScript
 
+def signTxInputs(tx, inputs, chainParams, hashType=SigHashAll, processes=None):
+    """
+    Signature scripts for every input of the transaction, as produced by calling
+    signTxOutput for each input with a shared TxSigHashes. If processes is
+    greater than 1, the inputs are split between a process pool of that size.
+    Each worker is sent the serialized transaction, the shared prefix hash and,
+    for each of its inputs, the index, the pubkey script and the private key
+    bytes. Signatures are deterministic (RFC 6979), so the scripts are the same
+    either way.
+
+    Args:
+        tx (MsgTx): The transaction.
+        inputs (list(tuple(PrivateKey, ByteArray))): The private key and the
+            pubkey script of the output being spent, for each input in order.
+        chainParams (module): Network parameters.
+        hashType (int): Optional. The signature hash type. Default SigHashAll.
+        processes (int): Optional. The process pool size.
+
+    Returns:
+        list(ByteArray): The signature script for each input.
+    """
+    if len(inputs) != len(tx.txIn):
+        raise Exception("one private key and pubkey script is needed per input")
+    sigHashes = TxSigHashes(tx)
+    if not processes or processes < 2 or len(inputs) < 2:
+        return [
+            signTxOutput(privKey, chainParams, tx, i, pkScript, hashType, tx.txIn[i].signatureScript, crypto.STEcdsaSecp256k1, sigHashes)
+            for i, (privKey, pkScript) in enumerate(inputs)
+        ]
+    txBytes = tx.serialize().bytes()
+    prefix = sigHashes.prefix(hashType)
+    prefix = prefix.bytes() if prefix else None
+    jobs = [(i, pkScript.bytes(), privKey.key.bytes()) for i, (privKey, pkScript) in enumerate(inputs)]
+    size = -(-len(jobs) // processes)
+    chunks = [(txBytes, prefix, hashType, chainParams.__name__, jobs[i:i+size]) for i in range(0, len(jobs), size)]
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(signTxInputJobs, chunks)
+    return [ByteArray(script) for scripts in results for script in scripts]
+
+def signTxInputJobs(chunk):
+    """
+    The process pool worker for signTxInputs.
+
+    Args:
+        chunk (tuple): The serialized transaction, the prefix hash bytes or
+            None, the hash type, the name of the network parameters module and
+            a list of (input index, pubkey script bytes, private key bytes).
+
+    Returns:
+        list(bytes): The signature scripts.
+    """
+    txBytes, prefix, hashType, netModule, jobs = chunk
+    tx = msgtx.MsgTx.deserialize(ByteArray(txBytes))
+    chainParams = importlib.import_module(netModule)
+    sigHashes = TxSigHashes(tx)
+    if prefix:
+        sigHashes.prefixHash = ByteArray(prefix)
+    scripts = []
+    for i, pkScript, keyBytes in jobs:
+        privKey = crypto.privKeyFromBytes(ByteArray(keyBytes))
+        script = signTxOutput(privKey, chainParams, tx, i, ByteArray(pkScript), hashType, tx.txIn[i].signatureScript, crypto.STEcdsaSecp256k1, sigHashes)
+        scripts.append(script.bytes())
+    return scripts
+
 class TestTxScript(unittest.TestCase):
     def test_var_int_serialize(self):
         """
@@ -1119,6 +1347,17 @@ class TestTxScript(unittest.TestCase):
         msg3 = calcSignatureHash(script, SigHashAll, tx, 1, prefixHash)
 
         self.assertNotEqual(msg1, msg3)
+
+        # The cached prefix is only used by the hash types that share it.
+        sigHashes = TxSigHashes(tx)
+        for hashType in (SigHashAll, SigHashNone, SigHashAll|SigHashAnyOneCanPay):
+            for idx in range(2):
+                self.assertEqual(
+                    calcSignatureHash(script, hashType, tx, idx, sigHashes.prefix(hashType)),
+                    calcSignatureHash(script, hashType, tx, idx, None),
+                )
+        self.assertIsNone(sigHashes.prefix(SigHashNone))
+        self.assertEqual(sigHashes.prefix(SigHashAll), prefixHash)
     def test_script_tokenizer(self):
         """
         TestScriptTokenizer ensures a wide variety of behavior provided by the script
@@ -1312,6 +1551,50 @@ class TestTxScript(unittest.TestCase):
             # Ensure the final index is the expected value.
             tokenizerIdx = tokenizer.offset
             self.assertEqual(tokenizerIdx, test_finalIdx, msg="%s: unexpected final byte index -- got %d, want %d" % (test_name, tokenizerIdx, test_finalIdx))
+    def test_verify_sig(self):
+        """
+        Signatures from signRFC6979 should verify against the signing key only.
+        """
+        privKey = crypto.privKeyFromBytes(ByteArray("b78a743c0c6557f24a51192b82925942ebade0be86efd7dad58b9fa358d3857c"))
+        otherKey = crypto.privKeyFromBytes(ByteArray("a00616c21b117ba621d4c72faf30d30cd665416bdc3c24e549de2348ac68cfb8"))
+        inHash = crypto.hashH(b"verify me")
+        sig = signRFC6979(privKey.key, inHash)
+        self.assertTrue(verifySig(privKey.pub, inHash, sig.r, sig.s))
+        self.assertFalse(verifySig(otherKey.pub, inHash, sig.r, sig.s))
+        self.assertFalse(verifySig(privKey.pub, crypto.hashH(b"not me"), sig.r, sig.s))
+        self.assertFalse(verifySig(privKey.pub, inHash, sig.r, sig.s + 1))
+        self.assertFalse(verifySig(privKey.pub, inHash, 0, sig.s))
+        self.assertFalse(verifySig(privKey.pub, inHash, sig.r, Curve.N))
+    def test_verify_sigs(self):
+        keys = [crypto.privKeyFromBytes(ByteArray(k)) for k in (
+            "b78a743c0c6557f24a51192b82925942ebade0be86efd7dad58b9fa358d3857c",
+            "a00616c21b117ba621d4c72faf30d30cd665416bdc3c24e549de2348ac68cfb8",
+        )]
+        batch = []
+        for i in range(6):
+            privKey = keys[i % 2]
+            inHash = crypto.hashH(ByteArray(i, length=4).bytes())
+            sig = signRFC6979(privKey.key, inHash)
+            batch.append((privKey.pub, inHash, sig.r, sig.s))
+        self.assertEqual(verifySigs(batch), [True]*6)
+        self.assertTrue(allSigsValid(batch))
+        self.assertTrue(allSigsValid([]))
+        self.assertEqual(verifySigs([]), [])
+
+        # Wrong key, out of range s, and a tampered hash.
+        pub, inHash, r, s = batch[1]
+        batch[1] = (keys[0].pub, inHash, r, s)
+        pub, inHash, r, s = batch[2]
+        batch[2] = (pub, inHash, r, Curve.N)
+        pub, inHash, r, s = batch[5]
+        batch[5] = (pub, crypto.hashH(b"tampered"), r, s)
+        expected = [True, False, False, True, True, False]
+        self.assertEqual(verifySigs(batch), expected)
+        self.assertEqual([verifySig(*item) for item in batch], expected)
+        self.assertFalse(allSigsValid(batch))
+        self.assertEqual(verifySigs(batch, processes=2), expected)
+        self.assertFalse(allSigsValid(batch, processes=2))
+        self.assertTrue(allSigsValid([batch[0], batch[3], batch[4]], processes=2))
     def test_sign_tx(self):
         """
         Based on dcrd TestSignTxOutput.
@@ -1412,6 +1695,7 @@ class TestTxScript(unittest.TestCase):
         # secp256k1 := chainec.Secp256k1
         from tinydecred.pydecred import mainnet
         testingParams = mainnet
+        sigHashes = TxSigHashes(tx)
         for hashType in hashTypes:
             for suite in signatureSuites:
                 for idx in range(len(tx.txIn)):
@@ -1436,4 +1720,36 @@ class TestTxScript(unittest.TestCase):
                     sigScript = signTxOutput(privKey, testingParams, tx, idx, pkScript, hashType, None, suite)
 
                     self.assertEqual(sigScript, ByteArray(sigStr), msg="%d:%d:%d" % (hashType, idx, suite))
-        return
\ No newline at end of file
+
+                    # Sharing the prefix hash between inputs doesn't change the
+                    # signatures.
+                    sigScript = signTxOutput(privKey, testingParams, tx, idx, pkScript, hashType, None, suite, sigHashes)
+                    self.assertEqual(sigScript, ByteArray(sigStr), msg="%d:%d:%d" % (hashType, idx, suite))
+        return
+    def test_sign_tx_inputs(self):
+        from tinydecred.pydecred import mainnet
+        keys = [crypto.privKeyFromBytes(ByteArray(k)) for k in (
+            "b78a743c0c6557f24a51192b82925942ebade0be86efd7dad58b9fa358d3857c",
+            "a00616c21b117ba621d4c72faf30d30cd665416bdc3c24e549de2348ac68cfb8",
+            "8902ea1f64c6fb7aa40dfbe798f5dc53b466a3fc01534e867581936a8ecbff5b",
+        )]
+        tx = msgtx.MsgTx.new()
+        inputs = []
+        for i in range(7):
+            tx.addTxIn(msgtx.TxIn(msgtx.OutPoint(
+                txHash = hashH(ByteArray(i, length=1).bytes()),
+                idx = i,
+                tree = 0,
+            ), valueIn=i + 1))
+            privKey = keys[i % len(keys)]
+            pkHash = crypto.hash160(privKey.pub.serializeCompressed().bytes())
+            addr = crypto.newAddressPubKeyHash(pkHash, mainnet, crypto.STEcdsaSecp256k1)
+            inputs.append((privKey, makePayToAddrScript(addr.string(), mainnet)))
+        tx.addTxOut(msgtx.TxOut(value=5, pkScript=ByteArray("51")))
+        want = [
+            signTxOutput(privKey, mainnet, tx, i, pkScript, SigHashAll, None, crypto.STEcdsaSecp256k1)
+            for i, (privKey, pkScript) in enumerate(inputs)
+        ]
+        self.assertEqual(signTxInputs(tx, inputs, mainnet), want)
+        self.assertEqual(signTxInputs(tx, inputs, mainnet, processes=3), want)
+        self.assertRaises(Exception, signTxInputs, tx, inputs[1:], mainnet)
@@ -6,19 +6,42 @@ See LICENSE for details
 Based on dcrd MsgBlock.
 """
 import unittest
-from tinydecred.crypto.bytearray import ByteArray
+from tinydecred.crypto.bytearray import ByteArray, bytesProperty
 from tinydecred.crypto.crypto import hashH
+from tinydecred.pydecred.wire import wire
 
 # chainhash.HashSize in go
 HASH_SIZE = 32
 
 MaxHeaderSize = 180
 
+def fixedBytes(b, length):
+	"""
+	b, left-padded with zeros to length bytes.
+	"""
+	if len(b) == length:
+		return b
+	if len(b) > length:
+		raise Exception("%d bytes do not fit in a %d byte field" % (len(b), length))
+	return bytes(length - len(b)) + b
+
 class BlockHeader:
 	"""
 	BlockHeader defines information about a block and is used in the decred
-	block (MsgBlock) and headers (MsgHeaders) messages.
+	block (MsgBlock) and headers (MsgHeaders) messages. The hashes, finalState
+	and extraData are stored as bytes, and read as ByteArrays.
 	"""
+	__slots__ = (
+		"version", "_prevBlock", "_merkleRoot", "_stakeRoot", "voteBits",
+		"_finalState", "voters", "freshStake", "revocations", "poolSize", "bits",
+		"sBits", "height", "size", "timestamp", "nonce", "_extraData",
+		"stakeVersion",
+	)
+	prevBlock = bytesProperty("_prevBlock")
+	merkleRoot = bytesProperty("_merkleRoot")
+	stakeRoot = bytesProperty("_stakeRoot")
+	finalState = bytesProperty("_finalState")
+	extraData = bytesProperty("_extraData")
 	def __init__(self):
 		# Version of the block.  This is not the same as the protocol version.
 		self.version = None # int32
@@ -86,99 +109,75 @@ class BlockHeader:
 		This is part of the Message interface implementation.
 		See Deserialize for decoding block headers stored to disk, such as in a
 		database, as opposed to decoding block headers from the wire.
+
+		Args:
+			b (ByteReader or ByteArray-like): The encoded header. A ByteReader
+				is left positioned after the header, so a batch of headers can
+				be decoded from a single reader.
+			pver (int): The protocol version.
 		"""
+		b = wire.ByteReader.of(b)
 		bh = BlockHeader()
 
 		# byte sizes
-		int64 = 8
-		int32 = uint32 = 4
-		uint16 = 2
 		finalStateSize = 6
-		uint8 = 1
 		extraDataSize = 32
 
 		# grab the data
-		bh.version = b.pop(int32).unLittle().int() # int32
-		bh.prevBlock = b.pop(HASH_SIZE) # chainhash.Hash = [32]byte
-		bh.merkleRoot = b.pop(HASH_SIZE) # chainhash.Hash
-		bh.stakeRoot = b.pop(HASH_SIZE) # chainhash.Hash
-		bh.voteBits = b.pop(uint16).unLittle().int() # uint16
-		bh.finalState = b.pop(finalStateSize) # [6]byte
-		bh.voters = b.pop(uint16).unLittle().int() # uint16
-		bh.freshStake = b.pop(uint8).unLittle().int() # uint8
-		bh.revocations = b.pop(uint8).unLittle().int() # uint8
-		bh.poolSize = b.pop(uint32).unLittle().int() # uint32
-		bh.bits = b.pop(uint32).unLittle().int() # uint32
-		bh.sBits = b.pop(int64).unLittle().int() # int64
-		bh.height = b.pop(uint32).unLittle().int() # uint32
-		bh.size = b.pop(uint32).unLittle().int() # uint32
-		bh.timestamp = b.pop(uint32).unLittle().int() # uint32Time  # time.Time
-		bh.nonce = b.pop(uint32).unLittle().int() # uint32
-		bh.extraData = b.pop(extraDataSize) # [32]byte
-		bh.stakeVersion = b.pop(uint32).unLittle().int() # uint32
+		bh.version = b.readUint32() # int32
+		bh._prevBlock = b.readBytes(HASH_SIZE) # chainhash.Hash = [32]byte
+		bh._merkleRoot = b.readBytes(HASH_SIZE) # chainhash.Hash
+		bh._stakeRoot = b.readBytes(HASH_SIZE) # chainhash.Hash
+		bh.voteBits = b.readUint16() # uint16
+		bh._finalState = b.readBytes(finalStateSize) # [6]byte
+		bh.voters = b.readUint16() # uint16
+		bh.freshStake = b.readUint8() # uint8
+		bh.revocations = b.readUint8() # uint8
+		bh.poolSize = b.readUint32() # uint32
+		bh.bits = b.readUint32() # uint32
+		bh.sBits = b.readUint64() # int64
+		bh.height = b.readUint32() # uint32
+		bh.size = b.readUint32() # uint32
+		bh.timestamp = b.readUint32() # uint32Time  # time.Time
+		bh.nonce = b.readUint32() # uint32
+		bh._extraData = b.readBytes(extraDataSize) # [32]byte
+		bh.stakeVersion = b.readUint32() # uint32
 
 		return bh
 	def serialize(self):
 		return self.btcEncode(0)
-	def btcEncode(self,  pver):
-
-
-	# 	sec := uint32(bh.Timestamp.Unix())
-	# return writeElements(w, bh.Version, &bh.PrevBlock, &bh.MerkleRoot,
-	# 	&bh.StakeRoot, bh.VoteBits, bh.FinalState, bh.Voters,
-	# 	bh.FreshStake, bh.Revocations, bh.PoolSize, bh.Bits, bh.SBits,
-	# 	bh.Height, bh.Size, sec, bh.Nonce, bh.ExtraData,
-	# 	bh.StakeVersion)
+	def btcEncode(self, pver):
+		"""
+		BtcEncode encodes the receiver to w using the decred protocol encoding.
+		This is part of the Message interface implementation.
 
-			# byte sizes
-		int64 = 8
-		int32 = uint32 = 4
-		uint16 = 2
+		Returns:
+			ByteArray: The MaxHeaderSize byte encoding.
+		"""
+		# byte sizes
 		finalStateSize = 6
-		uint8 = 1
 		extraDataSize = 32
 
-		b = ByteArray(0, length=MaxHeaderSize)
-		i = 0
-		b[i] = ByteArray(self.version, length=int32).littleEndian()
-		i += int32
-		b[i] = ByteArray(self.prevBlock, length=HASH_SIZE)
-		i += HASH_SIZE
-		b[i] = ByteArray(self.merkleRoot, length=HASH_SIZE)
-		i += HASH_SIZE
-		b[i] = ByteArray(self.stakeRoot, length=HASH_SIZE)
-		i += HASH_SIZE
-		b[i] = ByteArray(self.voteBits, length=uint16).littleEndian()
-		i += uint16
-		b[i] = ByteArray(self.finalState, length=finalStateSize)
-		i += finalStateSize
-		b[i] = ByteArray(self.voters, length=uint16).littleEndian()
-		i += uint16
-		b[i] = ByteArray(self.freshStake, length=uint8).littleEndian()
-		i += uint8
-		b[i] = ByteArray(self.revocations, length=uint8).littleEndian()
-		i += uint8
-		b[i] = ByteArray(self.poolSize, length=uint32).littleEndian()
-		i += uint32
-		b[i] = ByteArray(self.bits, length=uint32).littleEndian()
-		i += uint32
-		b[i] = ByteArray(self.sBits, length=int64).littleEndian()
-		i += int64
-		b[i] = ByteArray(self.height, length=uint32).littleEndian()
-		i += uint32
-		b[i] = ByteArray(self.size, length=uint32).littleEndian()
-		i += uint32
-		b[i] = ByteArray(self.timestamp, length=uint32).littleEndian()
-		i += uint32
-		b[i] = ByteArray(self.nonce, length=uint32).littleEndian()
-		i += uint32
-		b[i] = ByteArray(self.extraData, length=extraDataSize)
-		i += extraDataSize
-		b[i] = ByteArray(self.stakeVersion, length=uint32).littleEndian()
-		i += uint32
-		if i != MaxHeaderSize:
-			raise Exception("unexpected BlockHeader enocoded size")
-		return b
+		w = wire.ByteWriter(MaxHeaderSize)
+		w.writeUint32(self.version)
+		w.write(fixedBytes(self._prevBlock, HASH_SIZE))
+		w.write(fixedBytes(self._merkleRoot, HASH_SIZE))
+		w.write(fixedBytes(self._stakeRoot, HASH_SIZE))
+		w.writeUint16(self.voteBits)
+		w.write(fixedBytes(self._finalState, finalStateSize))
+		w.writeUint16(self.voters)
+		w.writeUint8(self.freshStake)
+		w.writeUint8(self.revocations)
+		w.writeUint32(self.poolSize)
+		w.writeUint32(self.bits)
+		w.writeUint64(self.sBits)
+		w.writeUint32(self.height)
+		w.writeUint32(self.size)
+		w.writeUint32(self.timestamp)
+		w.writeUint32(self.nonce)
+		w.write(fixedBytes(self._extraData, extraDataSize))
+		w.writeUint32(self.stakeVersion)
+		return w.finish()
 	def hash(self): # chainhash.Hash {
 		"""
 		hash computes the block identifier hash for the given block header.
@@ -191,6 +190,22 @@ class BlockHeader:
 	def id(self):
 		return reversed(self.hash()).hex()
 
+def decodeHeaders(b, pver=0):
+	"""
+	Decode a contiguous run of block headers, each MaxHeaderSize bytes, from a
+	single reader.
+
+	Args:
+		b (ByteArray-like): The encoded headers.
+		pver (int): Optional. The protocol version. Default 0.
+
+	Returns:
+		list(BlockHeader): The headers, in order.
+	"""
+	b = wire.ByteReader.of(b)
+	if b.remaining() % MaxHeaderSize != 0:
+		raise Exception("decodeHeaders: %d bytes is not a whole number of %d byte headers" % (b.remaining(), MaxHeaderSize))
+	return [BlockHeader.btcDecode(b, pver) for _ in range(b.remaining() // MaxHeaderSize)]
 
 class TestBlockHeader(unittest.TestCase):
 	def test_decode(self):
@@ -223,3 +238,22 @@ class TestBlockHeader(unittest.TestCase):
 
 
 
+	def test_decode_batch(self):
+		encoded = ByteArray("060000000bd25508e99bf6f8399efce65762b55873d69dd05a7871631ac8fa7a36f1d05c977ea75040b905415cbc8f7dd519831a031ef5cd9c6a187a9eab8136c8b44fda000000000000000000000000000000000000000000000000000000000000000001000000000000000000000000000000ffff7f20204e0000000000001b00000066010000aadd025d00000000255221163779dfe800000000000000000000000000000000000000000000000000000000")
+		headers = []
+		for height in range(5):
+			header = BlockHeader.deserialize(encoded)
+			header.height = height
+			headers.append(header)
+		batch = ByteArray(b"".join(h.serialize().bytes() for h in headers))
+		b = wire.ByteReader(batch)
+		for header in headers:
+			self.assertEqual(BlockHeader.btcDecode(b, 0).hash(), header.hash())
+		self.assertEqual(b.remaining(), 0)
+		# A truncated header is an error.
+		with self.assertRaises(Exception):
+			BlockHeader.deserialize(batch[:MaxHeaderSize-1])
+		decoded = decodeHeaders(batch)
+		self.assertEqual([h.height for h in decoded], list(range(5)))
+		with self.assertRaises(Exception):
+			decodeHeaders(batch[:len(batch)-1])
@@ -5,8 +5,9 @@ See LICENSE for details
 
 Based on dcrd MsgTx.
 """
+import struct
 import unittest
-from tinydecred.crypto.bytearray import ByteArray
+from tinydecred.crypto.bytearray import ByteArray, bytesProperty
 from tinydecred.crypto.crypto import hashH
 from tinydecred.util import helpers
 from tinydecred.pydecred.wire import wire
@@ -49,23 +50,20 @@ maxTxOutPerMessage = (wire.MaxMessagePayload // minTxOutPayload) + 1
 MaxTxInSequenceNum = 0xffffffff
 
 
-def writeOutPoint(pver, ver, op): #w io.Writer, pver uint32, version uint16, op *OutPoint) error {
+def writeOutPoint(w, pver, ver, op): #w io.Writer, pver uint32, version uint16, op *OutPoint) error {
     """
     writeOutPoint encodes op to the Decred protocol encoding for an OutPoint
-    to w.
+    to w, a wire.ByteWriter.
     """
-    b = op.hash.copy()
-    b += ByteArray(op.index, length=4).littleEndian()
-    b += ByteArray(op.tree, length=1)
-    return b
+    w.write(op._hash)
+    w.writeUint32(op.index)
+    w.writeUint8(op.tree)
 
 
 def readOutPoint(b, pver, ver): #r io.Reader, pver uint32, version uint16, op *OutPoint) error {
     """ readOutPoint reads the next sequence of bytes from r as an OutPoint."""
-    op = OutPoint(None, None, None)
-    op.hash = b.pop(HASH_SIZE)
-    op.index = b.pop(4).unLittle().int()
-    op.tree = b.pop(1).int()
+    txHash = b.readBytes(HASH_SIZE)
+    op = OutPoint(txHash, b.readUint32(), b.readUint8())
     return b, op
 
 def readTxInPrefix(b, pver, serType, ver, ti): # r io.Reader, pver uint32, serType TxSerializeType, version uint16, ti *TxIn) error {
@@ -76,34 +74,32 @@ def readTxInPrefix(b, pver, serType, ver, ti): # r io.Reader, pver uint32, serTy
     b, ti.previousOutPoint = readOutPoint(b, pver, ver)
 
     # Sequence.
-    ti.sequence = b.pop(4).unLittle().int()
+    ti.sequence = b.readUint32()
 
-def writeTxInPrefix(pver, ver, ti): #pver uint32, version uint16, ti *TxIn) error {
+def writeTxInPrefix(w, pver, ver, ti): #w io.Writer, pver uint32, version uint16, ti *TxIn) error {
     """
     writeTxInPrefixs encodes ti to the Decred protocol encoding for a transaction
     input (TxIn) prefix to w.
     """
-    b = writeOutPoint(pver, ver, ti.previousOutPoint)
-    b += ByteArray(ti.sequence, length=4).littleEndian()
-    return b
+    writeOutPoint(w, pver, ver, ti.previousOutPoint)
+    w.writeUint32(ti.sequence)
 
-def writeTxInWitness(pver, ver, ti): #w io.Writer, pver uint32, version uint16, ti *TxIn) error {
+def writeTxInWitness(w, pver, ver, ti): #w io.Writer, pver uint32, version uint16, ti *TxIn) error {
     """
     writeTxWitness encodes ti to the Decred protocol encoding for a transaction
     input (TxIn) witness to w.
     """
     # ValueIn
-    b = ByteArray(ti.valueIn, length=8).littleEndian()
+    w.writeUint64(ti.valueIn)
 
     # BlockHeight.
-    b += ByteArray(ti.blockHeight, length=4).littleEndian()
+    w.writeUint32(ti.blockHeight)
 
     # BlockIndex.
-    b += ByteArray(ti.blockIndex, length=4).littleEndian()
+    w.writeUint32(ti.blockIndex)
 
     # Write the signature script.
-    b += wire.writeVarBytes(pver, ti.signatureScript)
-    return b
+    w.writeVarBytes(ti._signatureScript)
 
 def readScript(b, pver, maxAllowed, fieldName): # r io.Reader, pver uint32, maxAllowed uint32, fieldName string) ([]byte, error) {
     """
@@ -113,7 +109,7 @@ def readScript(b, pver, maxAllowed, fieldName): # r io.Reader, pver uint32, maxA
     greater than the passed maxAllowed parameter which helps protect against
     memory exhaustion attacks and forced panics thorugh malformed messages.  The
     fieldName parameter is only used for the error message so it provides more
-    context in the error.
+    context in the error. The script is returned as bytes.
     """
     count = wire.readVarInt(b, pver)
 
@@ -123,7 +119,7 @@ def readScript(b, pver, maxAllowed, fieldName): # r io.Reader, pver uint32, maxA
     if count > maxAllowed:
         raise Exception("readScript: %s is larger than the max allowed size [count %d, max %d]" % (fieldName, count, maxAllowed))
 
-    a = b.pop(count)
+    a = b.readBytes(count)
 
     return b, a
 
@@ -133,13 +129,13 @@ def readTxInWitness(b, pver, ver, ti): # r io.Reader, pver uint32, version uint1
     (TxIn) in the transaction witness.
     """
     # ValueIn.
-    ti.valueIn = b.pop(8).unLittle().int()
+    ti.valueIn = b.readUint64()
 
     # BlockHeight.
-    ti.blockHeight = b.pop(4).unLittle().int()
+    ti.blockHeight = b.readUint32()
 
     # BlockIndex.
-    ti.blockIndex = b.pop(4).unLittle().int()
+    ti.blockIndex = b.readUint32()
 
     # Signature script.
     b, ti.signatureScript = readScript(b, pver, wire.MaxMessagePayload, "transaction input signature script")
@@ -150,20 +146,19 @@ def readTxOut(b, pver, ver, to): # r io.Reader, pver uint32, version uint16, to
     """
     # readTxOut reads the next sequence of bytes from r as a transaction output (TxOut).
     """
-    to.value = b.pop(8).unLittle().int()
-    to.version = b.pop(2).unLittle().int()
+    to.value = b.readUint64()
+    to.version = b.readUint16()
     b, to.pkScript = readScript(b, pver, wire.MaxMessagePayload, "transaction output public key script")
     return b
 
-def writeTxOut(pver, ver, to): # w io.Writer, pver uint32, version uint16, to *TxOut) error {
+def writeTxOut(w, pver, ver, to): # w io.Writer, pver uint32, version uint16, to *TxOut) error {
     """
     writeTxOut encodes to into the Decred protocol encoding for a transaction
     output (TxOut) to w.
     """
-    b = ByteArray(to.value, length=8).littleEndian()
-    b += ByteArray(to.version, length=2).littleEndian()
-    b += wire.writeVarBytes(pver, to.pkScript)
-    return b
+    w.writeUint64(to.value)
+    w.writeUint16(to.version)
+    w.writeVarBytes(to._pkScript)
 
 # def writeTxScriptsToMsgTx(msg, totalScriptSize, serType): # msg *MsgTx, totalScriptSize uint64, serType TxSerializeType) {
 #   """
@@ -243,8 +238,11 @@ def writeTxOut(pver, ver, to): # w io.Writer, pver uint32, version uint16, to *T
 
 class TxIn:
     """
-    TxIn defines a Decred transaction input.
+    TxIn defines a Decred transaction input. The signature script is stored as
+    bytes, and reads as a ByteArray.
     """
+    __slots__ = ("previousOutPoint", "sequence", "valueIn", "blockHeight", "blockIndex", "_signatureScript")
+    signatureScript = bytesProperty("_signatureScript")
     def __init__(self, previousOutPoint, sequence=MaxTxInSequenceNum, valueIn=0, blockHeight=0, blockIndex=0, signatureScript=None):
         # Non-witness
         self.previousOutPoint = previousOutPoint # OutPoint
@@ -254,7 +252,7 @@ class TxIn:
         self.valueIn = valueIn # int64
         self.blockHeight = blockHeight # uint32
         self.blockIndex = blockIndex # uint32
-        self.signatureScript = signatureScript if signatureScript else ByteArray(b'') # []byte
+        self.signatureScript = signatureScript if signatureScript else b'' # []byte
     def serializeSizePrefix(self):
         """
         SerializeSizePrefix returns the number of bytes it would take to serialize
@@ -271,7 +269,8 @@ class TxIn:
         serialized varint size for the length of SignatureScript +
         SignatureScript bytes.
         """
-        return 8 + 4 + 4 + wire.varIntSerializeSize(len(self.signatureScript)) + len(self.signatureScript)
+        scriptLen = len(self._signatureScript)
+        return 8 + 4 + 4 + wire.varIntSerializeSize(scriptLen) + scriptLen
     def __eq__(self, ti):
         """
         Check whether all fields are equal
@@ -282,19 +281,22 @@ class TxIn:
             self.valueIn == ti.valueIn and
             self.blockHeight == ti.blockHeight and
             self.blockIndex == ti.blockIndex and
-            self.signatureScript == ti.signatureScript
+            self._signatureScript == ti._signatureScript
         )
         return a
 
 
 class TxOut:
     """
-    TxOut defines a Decred transaction output.
+    TxOut defines a Decred transaction output. The pubkey script is stored as
+    bytes, and reads as a ByteArray.
     """
+    __slots__ = ("value", "version", "_pkScript")
+    pkScript = bytesProperty("_pkScript")
     def __init__(self, value=0, pkScript=None, version=0):
         self.value = value # int64
         self.version = version # uint16
-        self.pkScript = pkScript if pkScript else ByteArray(b'') # []byte
+        self.pkScript = pkScript if pkScript else b'' # []byte
     def serializeSize(self):
         """
         SerializeSize returns the number of bytes it would take to serialize the
@@ -302,7 +304,8 @@ class TxOut:
         Value 8 bytes + Version 2 bytes + serialized varint size for
         the length of PkScript + PkScript bytes.
         """
-        return 8 + 2 + wire.varIntSerializeSize(len(self.pkScript)) + len(self.pkScript)
+        scriptLen = len(self._pkScript)
+        return 8 + 2 + wire.varIntSerializeSize(scriptLen) + scriptLen
     def __eq__(self, to):
         """
         Check for all identical fields.
@@ -310,26 +313,29 @@ class TxOut:
         return(
             self.value == to.value and
             self.version == to.version and
-            self.pkScript == to.pkScript
+            self._pkScript == to._pkScript
         )
 
 class OutPoint:
     """
     OutPoint defines a Decred data type that is used to track previous
-    transaction outputs.
+    transaction outputs. The hash is stored as bytes, and reads as a
+    ByteArray.
     """
+    __slots__ = ("_hash", "index", "tree")
+    hash = bytesProperty("_hash")
     def __init__(self, txHash, idx, tree):
-        self.hash = txHash if txHash else ByteArray(0, length=HASH_SIZE) # chainhash.Hash
+        self.hash = txHash if txHash else bytes(HASH_SIZE) # chainhash.Hash
         self.index = idx # uint32
         self.tree = tree # int8
     def __eq__(self, other):
         return (
-            self.hash == other.hash and
+            self._hash == other._hash and
             self.index == other.index and
             self.tree == other.tree
         )
     def txid(self):
-        return reversed(self.hash).hex()
+        return self._hash[::-1].hex()
 
 class MsgTx:
     """
@@ -348,6 +354,12 @@ class MsgTx:
     txOut      []*TxOut
     lockTime   uint32
     expiry     uint32
+
+    The prefix hash and the serialization are memoized. Each is stored with a
+    key built from the fields it was computed from, and is recomputed when the
+    key no longer matches, so adding, removing or replacing inputs, outputs or
+    scripts invalidates it. Scripts and hashes are immutable bytes, so they
+    can only be replaced.
     """
     def __init__(self, cachedHash, serType, version, txIn, txOut, lockTime, expiry):
         self.cachedHash = cachedHash
@@ -357,6 +369,13 @@ class MsgTx:
         self.txOut = txOut
         self.lockTime = lockTime
         self.expiry = expiry
+        # A provided cachedHash is trusted for the fields as they are now.
+        self.hashKey = self.prefixKey() if cachedHash else None
+        # The prefix encoding of a decoded transaction, as (key, bytes), hashed
+        # if the hash is requested before the prefix changes.
+        self.prefixBytes = None
+        # The serialization, as (key, ByteArray).
+        self.serialized = None
     @staticmethod
     def new():
         """ Return a fully serialized version 1 transaction. Python equivalent of NewMsgTx in go."""
@@ -372,7 +391,6 @@ class MsgTx:
     def __eq__(self, tx):
         """ Check equality of all fields. Useful in testing"""
         return (
-            self.cachedHash == tx.cachedHash and
             self.serType == tx.serType and
             self.version == tx.version and
             all((a == b for a, b in zip(self.txIn, tx.txIn))) and
@@ -384,16 +402,51 @@ class MsgTx:
         self.txIn.append(tx)
     def addTxOut(self, tx):
         self.txOut.append(tx)
+    def prefixKey(self):
+        """
+        The fields the prefix encoding is computed from.
+        """
+        return (
+            self.version, self.lockTime, self.expiry,
+            tuple((ti.previousOutPoint._hash, ti.previousOutPoint.index, ti.previousOutPoint.tree, ti.sequence) for ti in self.txIn),
+            tuple((to.value, to.version, to._pkScript) for to in self.txOut),
+        )
+    def witnessKey(self):
+        """
+        The fields the witness encoding is computed from.
+        """
+        return (
+            self.version,
+            tuple((ti.valueIn, ti.blockHeight, ti.blockIndex, ti._signatureScript) for ti in self.txIn),
+        )
+    def serializeKey(self):
+        """
+        The fields the serialization is computed from, for the current
+        serialization type.
+        """
+        if self.serType == wire.TxSerializeNoWitness:
+            return (self.serType, self.prefixKey())
+        if self.serType == wire.TxSerializeOnlyWitness:
+            return (self.serType, self.witnessKey())
+        return (self.serType, self.prefixKey(), self.witnessKey())
     def hash(self): # chainhash.Hash {
         """
         TxHash generates the hash for the transaction prefix.  Since it does not
         contain any witness data, it is not malleable and therefore is stable for
         use in unconfirmed transaction chains.
         """
-        # TxHash should always calculate a non-witnessed hash.
-        toHash = self.mustSerialize(wire.TxSerializeNoWitness)
+        key = self.prefixKey()
+        if self.cachedHash is None or self.hashKey != key:
+            if self.prefixBytes and self.prefixBytes[0] == key:
+                toHash = self.prefixBytes[1]
+            else:
+                # TxHash should always calculate a non-witnessed hash.
+                toHash = self.mustSerialize(wire.TxSerializeNoWitness).bytes()
+            self.cachedHash = hashH(toHash)
+            self.hashKey = key
+            self.prefixBytes = None
         # If this hash is converted to a hex string, it should be reversed first.
-        return hashH(toHash.bytes())
+        return self.cachedHash.copy()
     def txHex(self):
         return self.serialize().hex()
     def txid(self):
@@ -424,60 +477,60 @@ class MsgTx:
         """
         ogSerType = self.serType
         self.serType = serType
-        serialized = self.serialize()
+        serialized = self.btcEncode(0)
         self.serType = ogSerType
         return serialized
-    def encodePrefix(self, pver):
+    def encodePrefix(self, w, pver): #w io.Writer, pver uint32) error {
         """ encodePrefix encodes a transaction prefix into a writer."""
         count = len(self.txIn)
-        b = wire.writeVarInt(pver, count)
+        w.writeVarInt(count)
         for ti in self.txIn:
-            b += writeTxInPrefix(pver, self.version, ti)
+            writeTxInPrefix(w, pver, self.version, ti)
 
         count = len(self.txOut)
-        b += wire.writeVarInt(pver, count)
+        w.writeVarInt(count)
 
         for to in self.txOut:
-            b += writeTxOut(pver, self.version, to)
-        b += ByteArray(self.lockTime, length=4).littleEndian()
-        b += ByteArray(self.expiry, length=4).littleEndian()
-
-        return b
-    def encodeWitness(self, pver): #w io.Writer, pver uint32) error {
+            writeTxOut(w, pver, self.version, to)
+        w.writeUint32(self.lockTime)
+        w.writeUint32(self.expiry)
+    def encodeWitness(self, w, pver): #w io.Writer, pver uint32) error {
         """ encodeWitness encodes a transaction witness into a writer."""
         count = len(self.txIn)
-        b = wire.writeVarInt(pver, count)
+        w.writeVarInt(count)
 
         for ti in self.txIn:
-            b += writeTxInWitness(pver, self.version, ti)
-
-        return b
+            writeTxInWitness(w, pver, self.version, ti)
     def btcEncode(self, pver): #w io.Writer, pver uint32) error {
         """
         BtcEncode encodes the receiver to w using the Decred protocol encoding.
         This is part of the Message interface implementation.
         See Serialize for encoding transactions to be stored to disk, such as in a
         database, as opposed to encoding transactions for the wire.
+
+        The encoding is packed into a buffer of serializeSize bytes.
         """
+        if self.serType not in (wire.TxSerializeNoWitness, wire.TxSerializeOnlyWitness, wire.TxSerializeFull):
+            raise Exception("MsgTx.BtcEncode: unsupported transaction type")
+
+        w = wire.ByteWriter(self.serializeSize())
+
         # The serialized encoding of the version includes the real transaction
         # version in the lower 16 bits and the transaction serialization type
         # in the upper 16 bits.
-        b = ByteArray(self.version | (self.serType<<16), length=4).littleEndian()
+        w.writeUint32(self.version | (self.serType<<16))
 
         if self.serType == wire.TxSerializeNoWitness:
-            b += self.encodePrefix(pver)
+            self.encodePrefix(w, pver)
 
         elif self.serType == wire.TxSerializeOnlyWitness:
-            b += self.encodeWitness(pver)
+            self.encodeWitness(w, pver)
 
         elif self.serType == wire.TxSerializeFull:
-            b += self.encodePrefix(pver)
-            b += self.encodeWitness(pver)
+            self.encodePrefix(w, pver)
+            self.encodeWitness(w, pver)
 
-        else:
-            raise Exception("MsgTx.BtcEncode: unsupported transaction type")
-
-        return b    
+        return w.finish()
     def serializeSize(self):
         """
         SerializeSize returns the number of bytes it would take to serialize the
@@ -520,7 +573,16 @@ class MsgTx:
                 n += txOut.serializeSize()
         return n
     def serialize(self):
-        return self.btcEncode(0)
+        """
+        The serialization, memoized until the transaction changes.
+
+        Returns:
+            ByteArray: The serialized transaction.
+        """
+        key = self.serializeKey()
+        if self.serialized is None or self.serialized[0] != key:
+            self.serialized = (key, self.btcEncode(0))
+        return self.serialized[1].copy()
     def decodePrefix(self, b, pver): # r io.Reader, pver uint32) (uint64, error) {
         """
         decodePrefix decodes a transaction prefix and stores the contents
@@ -556,9 +618,9 @@ class MsgTx:
             totalScriptSize += len(txOut.pkScript)
 
         # Locktime and expiry.
-        self.lockTime = b.pop(4).unLittle().int()
+        self.lockTime = b.readUint32()
 
-        self.expiry = b.pop(4).unLittle().int()
+        self.expiry = b.readUint32()
         return b, totalScriptSize
     def decodeWitness(self, b, pver, isFull): # r io.Reader, pver uint32, isFull bool) (uint64, error) {
         # Witness only; generate the TxIn list and fill out only the
@@ -610,11 +672,18 @@ class MsgTx:
         This is part of the Message interface implementation.
         See Deserialize for decoding transactions stored to disk, such as in a
         database, as opposed to decoding transactions from the wire.
+
+        Args:
+            b (ByteReader or ByteArray-like): The encoded transaction. A
+                ByteReader is left positioned after the transaction.
+            pver (int): The protocol version.
         """
+        b = wire.ByteReader.of(b)
+        start = b.pos
         # The serialized encoding of the version includes the real transaction
         # version in the lower 16 bits and the transaction serialization type
         # in the upper 16 bits.
-        ver = b.pop(4).unLittle().int()
+        ver = b.readUint32()
 
         tx = MsgTx.new()
 
@@ -626,17 +695,29 @@ class MsgTx:
         # types.  
         if tx.serType == wire.TxSerializeNoWitness:
             b, _ = tx.decodePrefix(b, pver)
+            prefixEnd = b.pos
 
         elif tx.serType == wire.TxSerializeOnlyWitness:
             b, _ = tx.decodeWitness(b, pver, False)
 
         elif tx.serType == wire.TxSerializeFull:
             b, _ = tx.decodePrefix(b, pver)
+            prefixEnd = b.pos
             b, _ = tx.decodeWitness(b, pver, True)
 
         else:
             raise Exception("MsgTx.BtcDecode: unsupported transaction type")
 
+        # Keep the encodings that were just read, so they needn't be rebuilt.
+        tx.serialized = (tx.serializeKey(), ByteArray(bytearray(b.view[start:b.pos]), copy=False))
+        if tx.serType != wire.TxSerializeOnlyWitness:
+            # The prefix encoding is the version, tagged as a prefix, followed
+            # by the decoded prefix.
+            prefix = bytearray(prefixEnd - start)
+            struct.pack_into("<I", prefix, 0, tx.version | (wire.TxSerializeNoWitness<<16))
+            prefix[4:] = b.view[start+4:prefixEnd]
+            tx.prefixBytes = (tx.prefixKey(), bytes(prefix))
+
         return tx
     @staticmethod
     def deserialize(b):
@@ -1375,3 +1456,56 @@ class TestMsgTx(unittest.TestCase):
         v = sum(txout.value for txout in tx.txOut)
         print("--total sent: %.2f" % (v*1e-8,))
         print(tx.txHex())
+    def test_tx_decode_reader(self):
+        """
+        Transactions are decoded from a ByteReader in sequence, and a truncated
+        transaction is an error.
+        """
+        tx = multiTx()
+        encoded = tx.serialize()
+        b = wire.ByteReader(encoded + encoded)
+        for _ in range(2):
+            self.assertEqual(MsgTx.btcDecode(b, 0), tx)
+        self.assertEqual(b.remaining(), 0)
+        self.assertEqual(MsgTx.deserialize(encoded.bytes()), tx)
+        with self.assertRaises(Exception):
+            MsgTx.deserialize(encoded[:len(encoded)-1])
+    def test_tx_cache(self):
+        """
+        The hash and serialization are memoized, and recomputed when the
+        transaction changes.
+        """
+        def fresh(tx):
+            return MsgTx.deserialize(tx.btcEncode(0))
+
+        tx = multiTx()
+        h = tx.hash()
+        self.assertEqual(tx.hash(), h)
+        self.assertEqual(tx.serialize(), multiTxEncoded())
+        # A decoded transaction hashes its prefix bytes.
+        decoded = MsgTx.deserialize(multiTxEncoded())
+        self.assertIsNotNone(decoded.prefixBytes)
+        self.assertEqual(decoded.hash(), h)
+        self.assertEqual(decoded.serialize(), multiTxEncoded())
+
+        # Signature scripts change the serialization but not the hash.
+        tx.txIn[0].signatureScript = ByteArray("0102")
+        self.assertEqual(tx.hash(), h)
+        self.assertEqual(tx.serialize(), tx.btcEncode(0))
+        self.assertEqual(fresh(tx).txIn[0].signatureScript, ByteArray("0102"))
+
+        changes = [
+            lambda tx: tx.addTxIn(TxIn(OutPoint(None, 1, 0))),
+            lambda tx: tx.txOut.pop(),
+            lambda tx: setattr(tx.txOut[0], "pkScript", ByteArray("51")),
+            lambda tx: setattr(tx.txIn[0].previousOutPoint, "index", 5),
+            lambda tx: setattr(tx, "expiry", 10),
+        ]
+        for change in changes:
+            for tx in (multiTx(), MsgTx.deserialize(multiTxEncoded())):
+                h = tx.hash()
+                tx.serialize()
+                change(tx)
+                self.assertNotEqual(tx.hash(), h)
+                self.assertEqual(tx.hash(), fresh(tx).hash())
+                self.assertEqual(tx.serialize(), tx.btcEncode(0))
@@ -5,7 +5,9 @@ See LICENSE for details
 
 Constants and common routines from the dcrd wire package. 
 """
-from tinydecred.crypto.bytearray import ByteArray
+import struct
+import unittest
+from tinydecred.crypto.bytearray import ByteArray, decodeBA
 
 MaxInt8   = (1<<7) - 1
 MinInt8   = -1 << 7
@@ -136,14 +138,159 @@ def writeVarBytes(pver, inBytes): #w io.Writer, pver uint32, bytes []byte) error
 	b += inBytes
 	return b
 
+class ByteReader(object):
+	"""
+	ByteReader reads the wire encoding from a buffer. Rather than popping bytes
+	off the front of a ByteArray, which copies the rest of the buffer for every
+	field, ByteReader keeps an offset into a memoryview of the data, so decoding
+	is linear in the size of the data. Integers are little-endian and unsigned.
+	"""
+	def __init__(self, b):
+		"""
+		Args:
+			b (ByteArray-like): The encoded data. A ByteArray or bytearray is
+				not copied, and should not be modified while being read.
+		"""
+		self.view = memoryview(decodeBA(b))
+		self.pos = 0
+	@staticmethod
+	def of(b):
+		"""
+		A ByteReader for b, or b itself if it is already a ByteReader.
+		"""
+		return b if isinstance(b, ByteReader) else ByteReader(b)
+	def remaining(self):
+		"""
+		The number of bytes not yet read.
+		"""
+		return len(self.view) - self.pos
+	def advance(self, n):
+		"""
+		Move the offset past the next n bytes, returning the old offset.
+		"""
+		start = self.pos
+		end = start + n
+		if end > len(self.view):
+			raise Exception("ByteReader: unexpected end of data reading %d bytes at offset %d of %d" % (n, start, len(self.view)))
+		self.pos = end
+		return start
+	def pop(self, n):
+		"""
+		Read the next n bytes.
+
+		Returns:
+			ByteArray: A copy of the bytes.
+		"""
+		start = self.advance(n)
+		return ByteArray(bytearray(self.view[start:start+n]), copy=False)
+	def readBytes(self, n):
+		"""
+		Read the next n bytes.
+
+		Returns:
+			bytes: A copy of the bytes.
+		"""
+		start = self.advance(n)
+		return bytes(self.view[start:start+n])
+	def unpack(self, fmt, n):
+		return struct.unpack_from(fmt, self.view, self.advance(n))[0]
+	def readUint8(self):
+		return self.unpack("<B", 1)
+	def readUint16(self):
+		return self.unpack("<H", 2)
+	def readUint32(self):
+		return self.unpack("<I", 4)
+	def readUint64(self):
+		return self.unpack("<Q", 8)
+
+class ByteWriter(object):
+	"""
+	ByteWriter encodes into a buffer allocated up front, packing each field in
+	place. Building the encoding by appending to a ByteArray copies the whole
+	encoding for every field. Integers are little-endian and unsigned.
+	"""
+	def __init__(self, size):
+		"""
+		Args:
+			size (int): The exact size of the encoding.
+		"""
+		self.b = bytearray(size)
+		self.pos = 0
+	def advance(self, n):
+		"""
+		Move the offset past the next n bytes, returning the old offset.
+		"""
+		start = self.pos
+		end = start + n
+		if end > len(self.b):
+			raise Exception("ByteWriter: writing %d bytes at offset %d overflows the %d byte buffer" % (n, start, len(self.b)))
+		self.pos = end
+		return start
+	def write(self, b):
+		"""
+		Write the bytes.
+
+		Args:
+			b (ByteArray-like): The bytes to write.
+		"""
+		if not isinstance(b, (bytes, bytearray)):
+			b = decodeBA(b)
+		start = self.advance(len(b))
+		self.b[start:self.pos] = b
+	def pack(self, fmt, n, v):
+		struct.pack_into(fmt, self.b, self.advance(n), v)
+	def writeUint8(self, v):
+		self.pack("<B", 1, v)
+	def writeUint16(self, v):
+		self.pack("<H", 2, v)
+	def writeUint32(self, v):
+		self.pack("<I", 4, v)
+	def writeUint64(self, v):
+		self.pack("<Q", 8, v)
+	def writeVarInt(self, val):
+		"""
+		Write val using a variable number of bytes depending on its value. See
+		writeVarInt.
+		"""
+		if val < 0xfd:
+			self.writeUint8(val)
+		elif val <= MaxUint16:
+			self.writeUint8(0xfd)
+			self.writeUint16(val)
+		elif val <= MaxUint32:
+			self.writeUint8(0xfe)
+			self.writeUint32(val)
+		else:
+			self.writeUint8(0xff)
+			self.writeUint64(val)
+	def writeVarBytes(self, b):
+		"""
+		Write the length of b as a varInt, followed by the bytes themselves.
+		"""
+		if not isinstance(b, (bytes, bytearray)):
+			b = decodeBA(b)
+		self.writeVarInt(len(b))
+		self.write(b)
+	def finish(self):
+		"""
+		The encoding. It is an error if the buffer has not been filled.
+
+		Returns:
+			ByteArray: The encoding, sharing memory with the writer.
+		"""
+		if self.pos != len(self.b):
+			raise Exception("ByteWriter: wrote %d bytes of %d" % (self.pos, len(self.b)))
+		return ByteArray(self.b, copy=False)
+
 def readVarInt(b, pver): #r io.Reader, pver uint32) (uint64, error) {
 	"""
 	readVarInt reads a variable length integer from r and returns it as a uint64.
+	b is a ByteReader.
 	"""
-	discriminant = b.pop(1).int()
+	discriminant = b.readUint8()
 	rv = 0
 	if discriminant == 0xff:
-		rv = b.pop(8).unLittle().int()
+		rv = b.readUint64()
 
 		# The encoding is not canonical if the value could have been
 		# encoded using fewer bytes.
@@ -151,7 +298,7 @@ def readVarInt(b, pver): #r io.Reader, pver uint32) (uint64, error) {
 		if rv < minRv:
 			raise Exception("ReadVarInt noncanon error: %d - %d <= %d" % (rv, discriminant, minRv))
 	elif discriminant == 0xfe:
-		rv = b.pop(4).unLittle().int()
+		rv = b.readUint32()
 
 		# The encoding is not canonical if the value could have been
 		# encoded using fewer bytes.
@@ -160,7 +307,7 @@ def readVarInt(b, pver): #r io.Reader, pver uint32) (uint64, error) {
 			raise Exception("ReadVarInt noncanon error: %d - %d <= %d" % (rv, discriminant, minRv))
 
 	elif discriminant == 0xfd:
-		rv = b.pop(2).unLittle().int()
+		rv = b.readUint16()
 
 		# The encoding is not canonical if the value could have been
 		# encoded using fewer bytes.
@@ -171,4 +318,45 @@ def readVarInt(b, pver): #r io.Reader, pver uint32) (uint64, error) {
 	else:
 		rv = discriminant
 
-	return rv
\ No newline at end of file
+	return rv
+
+class TestWire(unittest.TestCase):
+	def test_byte_reader(self):
+		b = ByteReader(ByteArray("010203000400000500000000000000aabbcc"))
+		self.assertEqual(b.readUint8(), 1)
+		self.assertEqual(b.readUint16(), 0x302)
+		self.assertEqual(b.readUint32(), 0x400)
+		self.assertEqual(b.readUint64(), 5)
+		self.assertEqual(b.remaining(), 3)
+		self.assertEqual(b.pop(2), ByteArray("aabb"))
+		self.assertIs(ByteReader.of(b), b)
+		with self.assertRaises(Exception):
+			b.readUint16()
+		# The failed read doesn't move the offset.
+		self.assertEqual(b.pop(1), ByteArray("cc"))
+		self.assertEqual(b.remaining(), 0)
+	def test_byte_writer(self):
+		w = ByteWriter(19)
+		w.writeUint8(1)
+		w.writeUint16(0x302)
+		w.writeUint32(0x400)
+		w.writeUint64(5)
+		with self.assertRaises(Exception):
+			w.finish()
+		w.writeVarBytes(ByteArray("aabb"))
+		with self.assertRaises(Exception):
+			w.writeUint16(1)
+		w.write(b"\xcc")
+		self.assertEqual(w.finish(), ByteArray("01020300040000050000000000000002aabbcc"))
+	def test_var_int(self):
+		for val in (0, 0xfc, 0xfd, MaxUint16, MaxUint16+1, MaxUint32, MaxUint32+1, MaxUint64):
+			w = ByteWriter(varIntSerializeSize(val))
+			w.writeVarInt(val)
+			self.assertEqual(w.finish(), writeVarInt(0, val))
+			b = ByteReader(writeVarInt(0, val))
+			self.assertEqual(readVarInt(b, 0), val)
+			self.assertEqual(b.remaining(), 0)
+		# Non-canonical encodings.
+		for enc in ("fdfc00", "fe ffff0000", "ff ffffffff00000000"):
+			with self.assertRaises(Exception):
+				readVarInt(ByteReader(enc.replace(" ", "")), 0)
@@ -5,6 +5,7 @@ See LICENSE for details
 import os
 import unittest
 from threading import Lock as Mutex
+from tinydecred import coinselect
 from tinydecred.util import tinyjson, helpers
 from tinydecred.crypto import crypto, mnemonic
 from tinydecred.pydecred import txscript
@@ -22,6 +23,31 @@ class KeySource(object):
         self.priv = priv
         self.change = change
 
+class Payment(object):
+    """
+    The outcome of a payment to one recipient of Wallet.sendMany.
+    """
+    def __init__(self, address, value, tx=None, vout=-1, error=None):
+        """
+        Args:
+            address (str): The base-58 encoded address paid.
+            value (int): The amount, in atoms.
+            tx (MsgTx): The transaction paying the recipient, or None if the
+                payment failed.
+            vout (int): The index of the recipient's output in tx.
+            error (Exception): The reason for a failed payment.
+        """
+        self.address = address
+        self.value = value
+        self.tx = tx
+        self.vout = vout
+        self.error = error
+    def ok(self):
+        """
+        Whether the payment was sent.
+        """
+        return self.tx is not None
+
 class Wallet(object):
     """
     Wallet is a wallet. An application would use a Wallet to create and 
@@ -276,28 +302,36 @@ class Wallet(object):
         Get the balance of the currently selected account.
         """
         return self.selectedAccount.balance
-    def getUTXOs(self, requested, approve=None):
+    def getUTXOs(self, requested, approve=None, fees=None, strategies=coinselect.DEFAULT_STRATEGIES):
         """
-        Find confirmed and mature UTXOs, smallest first, that sum to the 
-        requested amount, in atoms. 
+        Find confirmed and mature UTXOs that sum to the requested amount, in
+        atoms. If a fee model is provided, the UTXOs also cover the fee for the
+        transaction that spends them, and are chosen by the coin selection
+        strategies. Otherwise, UTXOs are taken smallest first.
 
         Args:
             requested int: Required amount. Atoms. 
-            filter func(UTXO) -> bool: Optional UTXO filtering function.
+            approve func(UTXO) -> bool: Optional UTXO filtering function.
+            fees (obj): Optional. The fee model for the transaction. See
+                tinydecred.coinselect.
+            strategies (iterable(func)): Optional. The coin selection strategies
+                to try, in order. Default coinselect.DEFAULT_STRATEGIES.
 
         Returns: 
             list(UTXO): A list of UTXOs.
             bool: Success. True if the UTXO sum is >= the requested amount. 
         """
+        utxos = self.openAccount.utxos.sortedByValue(approve)
+        if fees:
+            matches = coinselect.select(utxos, requested, fees, strategies)
+            if matches is None:
+                return [], False
+            return matches, True
         matches = []
-        acct = self.openAccount
         collected = 0
-        pairs = [(u.satoshis, u) for u in acct.utxoscan()]
-        for v, utxo in sorted(pairs, key=lambda p: p[0]):
-            if approve and not approve(utxo):
-                continue
+        for utxo in utxos:
             matches.append(utxo)
-            collected += v
+            collected += utxo.satoshis
             if collected >= requested:
                 break
         return matches, collected >= requested
@@ -423,7 +457,77 @@ class Wallet(object):
         self.signals.balance(acct.calcBalance(self.blockchain.tip["height"]))
         self.save()
         return tx
-        
+    def sendMany(self, pairs, feeRate=None):
+        """
+        Send to many addresses at once. The payments are combined into as few
+        transactions as possible.
+
+        Args:
+            pairs (list(tuple(str, int))): The base-58 encoded addresses and the
+                amounts to send to each, in atoms.
+            feeRate (float): Optional. The fee rate, in atoms/byte.
+
+        Returns:
+            list(Payment): The outcome for each recipient, in the order of
+                pairs.
+        """
+        acct = self.openAccount
+        keysource = KeySource(
+            priv = self.getKey,
+            change = acct.getChangeAddress,
+        )
+        payments = [Payment(addr, value) for addr, value in pairs]
+        for paid, tx, spentUTXOs, newUTXOs, err in self.blockchain.sendMany(pairs, keysource, self.getUTXOs, feeRate):
+            if tx is None:
+                for i in paid:
+                    payments[i].error = err
+                continue
+            acct.addMempoolTx(tx)
+            acct.spendUTXOs(spentUTXOs)
+            for utxo in newUTXOs:
+                acct.addUTXO(utxo)
+            # The outputs are in the order of the recipients.
+            for vout, i in enumerate(paid):
+                payments[i].tx = tx
+                payments[i].vout = vout
+        self.signals.balance(acct.calcBalance(self.blockchain.tip["height"]))
+        self.save()
+        return payments
+    def consolidate(self, address=None, feeRate=None, maxTxSize=None):
+        """
+        Sweep the account's spendable UTXOs into as few as possible, and
+        broadcast the transactions.
+
+        Args:
+            address (str): Optional. The base-58 encoded address to sweep to.
+                By default, each transaction pays to a new change address.
+            feeRate (float): Optional. The fee rate, in atoms/byte.
+            maxTxSize (int): Optional. The maximum serialized transaction size.
+                The default is the blockchain's.
+
+        Returns:
+            list(MsgTx): The broadcast transactions.
+        """
+        acct = self.openAccount
+        keysource = KeySource(
+            priv = self.getKey,
+            change = acct.getChangeAddress,
+        )
+        utxos = acct.utxos.sortedByValue(self.blockchain.approveUTXO)
+        kwargs = {"maxTxSize": maxTxSize} if maxTxSize else {}
+        txs = []
+        for tx, spentUTXOs, newUTXO in self.blockchain.sweep(utxos, keysource, address, feeRate, **kwargs):
+            self.blockchain.broadcast(tx.txHex())
+            acct.addMempoolTx(tx)
+            acct.spendUTXOs(spentUTXOs)
+            # Sweeps to an outside address don't come back to the account.
+            if acct.branchAndIndex(newUTXO.address)[0] is not None:
+                acct.addUTXO(newUTXO)
+            txs.append(tx)
+        self.signals.balance(acct.calcBalance(self.blockchain.tip["height"]))
+        self.save()
+        return txs
+
 tinyjson.register(Wallet)
 
 